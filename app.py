@@ -1,32 +1,35 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, send_from_directory
+from flask import Flask, Response, stream_with_context, render_template, request, jsonify, session, redirect, url_for, flash, send_from_directory
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from flask_session import Session
 import os
+import re
 import json
 from datetime import datetime, timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
-import google.generativeai as genai
-import secrets
 import tempfile
+import atexit
 from pathlib import Path
-from image_generator import ImageGenerator
+from image_generator import ImageGenerator, HF_STATUS_URL
+from image_cache import ImageCache
 from chat_manager import ChatManager
-import requests
+from user_store import UserStore
+from ttl_cache import TTLCache
+from metrics import REGISTRY, timed
+from rate_limiter import RateLimited
+from image_jobs import ImageJobQueue, JobRejected, FINISHED
+from image_processing import ENCODINGS
+from models import db
+from conversation_store import ConversationStore, InvalidCursor
+from history_transfer import export_chunks, gzip_chunks, HistoryImporter
+from search_index import SearchIndex
+from lazy import LazyService
+from session_store import ServerSessionInterface, MemorySessionStore, SQLiteSessionStore, load_secret_key
+from password_hasher import PasswordHasher, HashingBusy, DEFAULT_METHOD
+from login_throttle import LoginThrottle, Throttled
+import click
+import http_pool
 
 # Initialize Flask app
 app = Flask(__name__)
 
-# Auto-generate secret key
-app.secret_key = secrets.token_hex(32)
-
-# Session configuration for Vercel
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
-app.config['SESSION_FILE_DIR'] = tempfile.gettempdir()
-
-# Initialize Flask-Session
-Session(app)
-
 # Configure paths for Vercel deployment
 def get_data_dir():
     """Get the appropriate data directory for the environment"""
@@ -58,6 +61,33 @@ def ensure_data_files():
 
 ensure_data_files()
 
+# Stable signing key, so sessions survive restarts: SECRET_KEY, or one generated once into DATA_DIR
+app.secret_key = load_secret_key(DATA_DIR / '.secret_key')
+if os.environ.get('VERCEL_ENV') and not os.environ.get('SECRET_KEY'):
+    print("Warning: SECRET_KEY is not set; sessions will not survive a cold start")
+
+# Server-side sessions: SESSION_BACKEND is 'sqlite' (shared by workers), 'memory' (one process) or 'filesystem'
+app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlite')
+if SESSION_BACKEND == 'filesystem':
+    app.config['SESSION_TYPE'] = 'filesystem'
+    app.config['SESSION_FILE_DIR'] = tempfile.gettempdir()
+    from flask_session import Session
+    Session(app)
+else:
+    app.session_interface = ServerSessionInterface(
+        MemorySessionStore() if SESSION_BACKEND == 'memory' else SQLiteSessionStore(DATA_DIR / 'sessions.db'),
+        sweep_interval=float(os.environ.get('SESSION_SWEEP_INTERVAL', 300))
+    )
+
+# Chat threads and messages (models.py); SQLite in DATA_DIR unless DATABASE_URL is set
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f"sqlite:///{DATA_DIR / 'chat.db'}")
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True}
+db.init_app(app)
+
+# Indexed, cross-worker safe access to USERS_FILE
+user_store = UserStore(USERS_FILE)
+
 # Initialize Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -71,6 +101,7 @@ class User:
         self.name = user_data.get('name')
         self.password_hash = user_data.get('password')
         self.is_admin = user_data.get('is_admin', False)
+        self.response_cache = user_data.get('response_cache', True)  # opt-out of cached replies
 
     @property
     def is_active(self):
@@ -89,35 +120,131 @@ class User:
 
     @staticmethod
     def get(user_id):
-        with open(USERS_FILE, 'r') as f:
-            users_data = json.load(f)
-            for user in users_data.get('users', []):
-                if str(user.get('id')) == str(user_id):
-                    return User(user)
-        return None
+        user = user_store.get(user_id)
+        return User(user) if user else None
+
+# Deserialized users for load_user; a hit is a request served without a user store read
+user_cache = TTLCache(
+    max_entries=int(os.environ.get('USER_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('USER_CACHE_TTL', 30))
+)
+
+# Password hashing runs on its own small pool, so a login burst can't take every core from chat
+password_hasher = PasswordHasher(
+    workers=int(os.environ.get('PASSWORD_HASH_WORKERS', 2)),
+    max_queue=int(os.environ.get('PASSWORD_HASH_QUEUE', 16)),
+    method=os.environ.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+)
+
+# Failed sign-ins per client IP and per email; over the limit, requests are refused before any hashing
+login_throttle = LoginThrottle(
+    limits={
+        'ip': int(os.environ.get('LOGIN_MAX_FAILURES_PER_IP', 20)),
+        'email': int(os.environ.get('LOGIN_MAX_FAILURES_PER_EMAIL', 5)),
+        'register_ip': int(os.environ.get('LOGIN_MAX_REGISTRATIONS_PER_IP', 50))
+    },
+    window=float(os.environ.get('LOGIN_THROTTLE_WINDOW', 900))
+)
+
+def client_ip():
+    """The caller's address; behind Vercel's proxy it is the first X-Forwarded-For hop"""
+    if os.environ.get('VERCEL_ENV') and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.get(user_id)
-
-# Initialize chat manager and image generator
-try:
-    chat_manager = ChatManager()
-    image_generator = ImageGenerator()
-except Exception as e:
-    print(f"An error occurred while initializing chat manager or image generator: {str(e)}")
-    raise
+    with timed('load_user'):
+        user = user_cache.get(user_id)
+        if user is None:
+            user = User.get(user_id)
+            if user is not None:
+                user_cache.put(user_id, user)
+        return user
+
+# Cache, pool and coalescing counters, exported as gauges on /metrics
+REGISTRY.add_collector('chatai_user_cache', user_cache.stats)
+REGISTRY.add_collector('chatai_password_hasher', password_hasher.stats)
+REGISTRY.add_collector('chatai_login_throttle', login_throttle.stats)
+if isinstance(app.session_interface, ServerSessionInterface):
+    REGISTRY.add_collector('chatai_sessions', app.session_interface.stats)
 
 # Initialize AI models
 def init_ai_models():
     try:
         gemini_key = os.environ.get('GOOGLE_API_KEY')
         if gemini_key:
+            import google.generativeai as genai  # slow to import; only needed once chat is used
             genai.configure(api_key=gemini_key)
     except Exception as e:
         print(f"Warning: Could not initialize Gemini model: {str(e)}")
 
-init_ai_models()
+# The chat manager and image generator are built on first use rather than at import,
+# so a cold start that only serves /login_page skips Gemini, the database and PIL
+def build_chat_manager():
+    try:
+        init_ai_models()
+        conversations = ConversationStore(app)
+        search_index = SearchIndex(app)
+        manager = ChatManager(conversations=conversations, search_index=search_index)
+        conversations.migrate_from_log(manager.store, DATA_DIR)
+        search_index.migrate(DATA_DIR)
+        atexit.register(manager.close)  # write out queued turns (CHAT_WRITE_BEHIND=1)
+    except Exception as e:
+        print(f"An error occurred while initializing chat manager: {str(e)}")
+        raise
+    REGISTRY.add_collector('chatai_context_cache', manager.context_cache.stats)
+    if manager.response_cache is not None:
+        REGISTRY.add_collector('chatai_response_cache', manager.response_cache.stats)
+    REGISTRY.add_collector('chatai_chat_single_flight', manager.single_flight.stats)
+    REGISTRY.add_collector('chatai_gemini_pool', manager.client_pool.stats)
+    REGISTRY.add_collector('chatai_gemini_rate_limiter', manager.rate_limiter.stats)
+    if manager.write_behind is not None:
+        REGISTRY.add_collector('chatai_history_write_behind', manager.write_behind.stats)
+    return manager
+
+def build_image_generator():
+    try:
+        generator = ImageGenerator(cache=ImageCache(
+            DATA_DIR / 'image_cache',
+            max_bytes=int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024)),
+            ttl=float(os.environ.get('IMAGE_CACHE_TTL', 7 * 24 * 3600))
+        ))
+    except Exception as e:
+        print(f"An error occurred while initializing image generator: {str(e)}")
+        raise
+    REGISTRY.add_collector('chatai_image_single_flight', generator.single_flight.stats)
+    REGISTRY.add_collector('chatai_image_cache', generator.cache.stats)
+    return generator
+
+def build_image_store():
+    # Content-addressed store behind /images/<key>; chat responses only carry the URL
+    store = ImageCache(
+        DATA_DIR / 'images',
+        max_bytes=int(os.environ.get('IMAGE_STORE_MAX_BYTES', 1024 * 1024 * 1024))
+    )
+    REGISTRY.add_collector('chatai_image_store', store.stats)
+    return store
+
+def build_image_jobs():
+    # Image generation runs on its own bounded pool, so requests return at once
+    jobs = ImageJobQueue(
+        lambda prompt, hf_api_key: generated_image_url(
+            store_image(image_generator.generate_image_variants(prompt, api_key=hf_api_key))),
+        workers=int(os.environ.get('IMAGE_JOB_WORKERS', 4)),
+        max_queue=int(os.environ.get('IMAGE_JOB_QUEUE', 64)),
+        per_user=int(os.environ.get('IMAGE_JOB_PER_USER', 2)),
+        result_ttl=float(os.environ.get('IMAGE_JOB_TTL', 600))
+    )
+    REGISTRY.add_collector('chatai_image_jobs', jobs.stats)
+    return jobs
+
+chat_manager = LazyService(build_chat_manager)
+conversations = LazyService(lambda: chat_manager.conversations)
+search_index = LazyService(lambda: chat_manager.search_index)
+image_generator = LazyService(build_image_generator)
+image_store = LazyService(build_image_store)
+image_jobs = LazyService(build_image_jobs)
 
 @app.route('/login_page')
 def login_page():
@@ -141,28 +268,30 @@ def register():
                 flash('Passwords do not match.', 'error')
                 return redirect(url_for('register'))
 
-            users = json.load(open(USERS_FILE, 'r'))
-            
+            # Every registration costs a hash; they are counted apart from failed logins,
+            # so sign-ups behind a shared address don't lock its users out of logging in
+            login_throttle.check(register_ip=client_ip())
+            login_throttle.record(register_ip=client_ip())
+
             # Check if email already exists
-            if any(u['email'] == email for u in users.get('users', [])):
+            if user_store.get_by_email(email):
                 flash('Email already registered.', 'error')
                 return redirect(url_for('register'))
 
             # Create new user
-            user_id = str(len(users.get('users', [])) + 1)
-            users['users'].append({
-                'id': user_id,
-                'name': name,
-                'email': email,
-                'password': generate_password_hash(password),
-                'is_admin': False
-            })
-            
-            with open(USERS_FILE, 'w') as f:
-                json.dump(users, f)
+            try:
+                user = user_store.create(name, email, password_hasher.hash(password))
+                user_cache.invalidate(user['id'])
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('register'))
+
             flash('Registration successful! Please login.', 'success')
             return redirect(url_for('login_page'))
 
+        except (Throttled, HashingBusy) as e:
+            flash(str(e), 'error')
+            return redirect(url_for('register'))
         except Exception as e:
             flash(f'An error occurred during registration: {str(e)}', 'error')
             return redirect(url_for('register'))
@@ -176,15 +305,23 @@ def login():
         password = request.form['password']
         login_type = request.form.get('login_type', 'user')
 
-        users = json.load(open(USERS_FILE, 'r'))
-        # Find user by email in the users dictionary
-        user = None
-        for user_data in users.get('users', []):
-            if user_data['email'] == email:
-                user = user_data
-                break
+        ip = client_ip()
+        login_throttle.check(ip=ip, email=email)
+
+        user = user_store.get_by_email(email)
+
+        # Unknown emails are checked against a dummy hash, so they take as long as wrong passwords
+        if password_hasher.verify(user['password'] if user else None, password):
+            login_throttle.reset(email=email)
+            if password_hasher.needs_rehash(user['password']):
+                user_id = str(user['id'])
+
+                def save_password_hash(password_hash):
+                    user_store.update(user_id, password=password_hash)
+                    user_cache.invalidate(user_id)
+
+                password_hasher.rehash(password, save_password_hash)
 
-        if user and check_password_hash(user['password'], password):
             if login_type == 'admin' and not user.get('is_admin', False):
                 flash('Access denied. Admin privileges required.', 'error')
                 return redirect(url_for('login_page'))
@@ -193,9 +330,13 @@ def login():
             login_user(user_obj)
             return redirect(url_for('home'))
         else:
+            login_throttle.record(ip=ip, email=email)
             flash('Invalid email or password.', 'error')
             return redirect(url_for('login_page'))
 
+    except (Throttled, HashingBusy) as e:
+        flash(str(e), 'error')
+        return redirect(url_for('login_page'))
     except Exception as e:
         flash(f'An error occurred during login: {str(e)}', 'error')
         return redirect(url_for('login_page'))
@@ -219,25 +360,30 @@ def update_profile():
         username = request.form.get('username')
         email = request.form.get('email')
         new_password = request.form.get('new_password')
-        
-        users = json.load(open(USERS_FILE, 'r'))
+        response_cache = request.form.get('response_cache')
         
         # Update user data
-        for user in users.get('users', []):
-            if user['id'] == current_user.get_id():
-                if username:
-                    user['name'] = username
-                if email:
-                    user['email'] = email
-                if new_password:
-                    user['password'] = generate_password_hash(new_password)
-        
-        with open(USERS_FILE, 'w') as f:
-            json.dump(users, f)
+        updates = {}
+        if username:
+            updates['name'] = username
+        if email:
+            updates['email'] = email
+        if new_password:
+            updates['password'] = password_hasher.hash(new_password)
+        if response_cache in ('on', 'off'):
+            updates['response_cache'] = response_cache == 'on'
+        if updates:
+            user_store.update(current_user.get_id(), **updates)
+            user_cache.invalidate(current_user.get_id())
         
         flash('Profile updated successfully!', 'success')
         return jsonify({"success": True})
-    
+
+    except HashingBusy as e:
+        response = jsonify({"success": False, "message": str(e)})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
     except Exception as e:
         return jsonify({"success": False, "message": str(e)})
 
@@ -261,49 +407,49 @@ def chat():
         api_key = request.json.get('api_key')
         hf_api_key = request.json.get('hf_api_key')
 
-        if not message:
+        if not message or not isinstance(message, str):
             return jsonify({'error': 'No message provided'}), 400
 
-        if not api_key:
+        if not api_key or not isinstance(api_key, str):
             return jsonify({'error': 'API key is required'}), 400
 
-        # Configure AI models with provided keys
-        try:
-            genai.configure(api_key=api_key)
-        except Exception as e:
-            return jsonify({'error': f'Invalid Gemini API key: {str(e)}'}), 400
-
-        if hf_api_key:
-            try:
-                image_generator.set_api_key(hf_api_key)
-            except Exception as e:
-                return jsonify({'error': f'Invalid Hugging Face API key: {str(e)}'}), 400
+        # Turns are filed into the given thread, or the user's most recent one
+        thread_id = request.json.get('thread_id')
+        if thread_id is not None and conversations.get_thread(current_user.get_id(), thread_id) is None:
+            return jsonify({'error': 'Thread not found'}), 404
 
-        # Check if message is for image generation
+        # Both keys are passed per call (Gemini through chat_manager's client pool, Hugging Face
+        # to the image job), never stored process-wide where another user's request could pick them up
         if message.startswith('@image'):
-            if not hf_api_key:
+            if not hf_api_key or not isinstance(hf_api_key, str):
                 return jsonify({'error': 'Hugging Face API key is required for image generation'}), 400
                 
             image_prompt = message[6:].strip()
+            if not image_prompt:
+                return jsonify({'error': 'Invalid prompt provided'}), 400
             try:
-                image_base64 = image_generator.generate_image(image_prompt)
-                response_text = f"I've generated an image based on your prompt: {image_prompt}"
-                return jsonify({
-                    'response': response_text,
-                    'image': image_base64
-                })
-            except ValueError as e:
-                return jsonify({'error': str(e)}), 400
-            except Exception as e:
-                return jsonify({'error': f"Failed to generate image: {str(e)}"}), 500
+                job = image_jobs.submit(current_user.get_id(), image_prompt, hf_api_key)
+            except JobRejected as e:
+                return job_rejected_response(e)
+            response_text = f"I've generated an image based on your prompt: {image_prompt}"
+            return jsonify(dict(image_job_payload(job), response=response_text)), 202
+
+        # Stream the reply as NDJSON when the client asks for it
+        if request.json.get('stream') or 'application/x-ndjson' in request.headers.get('Accept', ''):
+            return stream_chat_response(message, current_user.get_id(), api_key, current_user.response_cache,
+                                        thread_id)
 
         # Process regular chat message
         try:
-            response = chat_manager.process_message(message, current_user.get_id())
+            response = chat_manager.process_message(
+                message, current_user.get_id(), api_key, use_cache=current_user.response_cache,
+                thread_id=thread_id)
             return jsonify({
                 'response': response,
                 'error': None
             })
+        except RateLimited as e:
+            return rate_limited_response(e)
         except Exception as e:
             return jsonify({'error': f'Failed to process message: {str(e)}'}), 500
 
@@ -311,22 +457,274 @@ def chat():
         print(f"Error in chat: {str(e)}")
         return jsonify({'error': 'Internal server error occurred'}), 500
 
+def rate_limited_response(error):
+    """429 telling the client when the Gemini quota for its key should allow another try"""
+    response = jsonify({'error': str(error), 'retry_after': error.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def stream_chat_response(message, user_id, api_key, use_cache=True, thread_id=None):
+    """Stream a chat reply as NDJSON: {"delta": ...} lines, then a final {"done": true, "response": ...}"""
+    def generate():
+        parts = []
+        try:
+            for text in chat_manager.stream_message(message, user_id, api_key, use_cache=use_cache,
+                                                    thread_id=thread_id):
+                parts.append(text)
+                yield json.dumps({'delta': text}) + '\n'
+            yield json.dumps({'done': True, 'response': ''.join(parts)}) + '\n'
+        except RateLimited as e:
+            yield json.dumps({'error': str(e), 'retry_after': e.retry_after}) + '\n'
+        except Exception as e:
+            yield json.dumps({'error': f'Failed to process message: {str(e)}'}) + '\n'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/generate-image', methods=['POST'])
 @login_required
 def generate_image():
     try:
         prompt = request.json.get('prompt', '')
-        if not prompt:
+        if not prompt or not isinstance(prompt, str):
             return jsonify({'error': 'Prompt is required'}), 400
 
-        # Generate image using the image generator
-        image_url = image_generator.generate(prompt)
-        
-        return jsonify({'image_url': image_url})
+        hf_api_key = request.json.get('hf_api_key')
+        if not hf_api_key or not isinstance(hf_api_key, str):
+            return jsonify({'error': 'Hugging Face API key not set. Please set it in settings.'}), 400
+
+        # Generation runs in the background; the client polls or subscribes for the result
+        job = image_jobs.submit(current_user.get_id(), prompt, hf_api_key)
+        return jsonify(image_job_payload(job)), 202
+    except JobRejected as e:
+        return job_rejected_response(e)
     except Exception as e:
         print(f"Error generating image: {str(e)}")
         return jsonify({'error': 'An error occurred while generating the image'}), 500
 
+def store_image(variants):
+    """Store every variant of a generated image; returns its key, the hash of the JPEG"""
+    image_key = image_store.add(variants['jpeg'])
+    for variant, data in variants.items():
+        if variant != 'jpeg':
+            image_store.put(f'{image_key}.{variant}', data)
+    return image_key
+
+def generated_image_url(image_key):
+    return f'/images/{image_key}'
+
+def image_job_payload(job):
+    return dict(job.to_dict(),
+                status_url=url_for('image_job_status', job_id=job.id),
+                events_url=url_for('image_job_events', job_id=job.id))
+
+def job_rejected_response(error):
+    response = jsonify({'error': str(error)})
+    response.status_code = error.status_code
+    if error.retry_after:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@app.route('/image-jobs/<job_id>', methods=['GET'])
+@login_required
+def image_job_status(job_id):
+    job = image_jobs.get(job_id, current_user.get_id())
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(image_job_payload(job))
+
+@app.route('/image-jobs/<job_id>', methods=['DELETE'])
+@login_required
+def cancel_image_job(job_id):
+    if not image_jobs.cancel(job_id, current_user.get_id()):
+        return jsonify({'error': 'Job not found or already finished'}), 404
+    return jsonify({'status': 'cancelled'})
+
+@app.route('/image-jobs/<job_id>/events')
+@login_required
+def image_job_events(job_id):
+    """Server-sent events: the job's state on every status change, until it finishes"""
+    job = image_jobs.get(job_id, current_user.get_id())
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    payload = image_job_payload(job)
+
+    def generate():
+        status = None
+        while True:
+            if job.status != status:
+                status = job.status
+                yield f"event: status\ndata: {json.dumps(dict(payload, **job.to_dict()))}\n\n"
+                if status in FINISHED:
+                    return
+            elif image_jobs.wait(job, status, timeout=15) == status:
+                yield ": keep-alive\n\n"
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/images/<image_key>')
+@login_required
+def generated_image(image_key):
+    if not re.fullmatch(r'[0-9a-f]{64}', image_key):
+        return jsonify({'error': 'Image not found'}), 404
+
+    # ?format= picks an encoding outright; otherwise WebP goes to clients that accept it.
+    # ?size=thumb asks for the small variant (images stored before thumbnails fall back to full size)
+    formats = [request.args['format']] if request.args.get('format') in ENCODINGS else (
+        ['webp', 'jpeg'] if 'image/webp' in request.headers.get('Accept', '') else ['jpeg'])
+    sizes = ['thumb.', ''] if request.args.get('size') == 'thumb' else ['']
+    for variant in (size + image_format for size in sizes for image_format in formats):
+        filename = image_key if variant == 'jpeg' else f'{image_key}.{variant}'
+        if image_store.path_for(filename).exists():
+            break
+    else:
+        return jsonify({'error': 'Image not found'}), 404
+
+    # Keys are content hashes, so a URL never changes content: cache it for good
+    response = send_from_directory(
+        image_store.path_for(filename).parent,
+        filename,
+        mimetype=ENCODINGS[variant.split('.')[-1]][1],
+        etag=f'{image_key}.{variant}',
+        max_age=365 * 24 * 3600
+    )
+    response.vary.add('Accept')
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/metrics')
+@login_required
+def metrics():
+    if not current_user.is_admin:
+        return jsonify({'error': 'Admin privileges required'}), 403
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/threads', methods=['GET'])
+@login_required
+def list_threads():
+    """A page of the user's threads, most recent first; pass ``next_cursor`` back as ``cursor`` for the next"""
+    chat_manager.flush_history(current_user.get_id())
+    try:
+        threads, next_cursor = conversations.list_threads(
+            current_user.get_id(), request.args.get('cursor'), request.args.get('limit', 20))
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'threads': threads, 'next_cursor': next_cursor})
+
+@app.route('/threads', methods=['POST'])
+@login_required
+def create_thread():
+    title = (request.get_json(silent=True) or {}).get('title')
+    return jsonify(conversations.create_thread(current_user.get_id(), title)), 201
+
+@app.route('/threads/<thread_id>', methods=['PATCH'])
+@login_required
+def rename_thread(thread_id):
+    title = ((request.get_json(silent=True) or {}).get('title') or '').strip()
+    if not title:
+        return jsonify({'error': 'Title is required'}), 400
+    thread = conversations.rename_thread(current_user.get_id(), thread_id, title)
+    if thread is None:
+        return jsonify({'error': 'Thread not found'}), 404
+    return jsonify(thread)
+
+@app.route('/threads/<thread_id>', methods=['DELETE'])
+@login_required
+def delete_thread(thread_id):
+    if not chat_manager.delete_thread(current_user.get_id(), thread_id):
+        return jsonify({'error': 'Thread not found'}), 404
+    return jsonify({'success': True})
+
+@app.route('/threads/<thread_id>/messages', methods=['GET'])
+@login_required
+def thread_messages(thread_id):
+    """A page of a thread's messages, newest page first and oldest first within it"""
+    chat_manager.flush_history(current_user.get_id())
+    try:
+        page = conversations.list_messages(
+            current_user.get_id(), thread_id, request.args.get('cursor'), request.args.get('limit', 50))
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    if page is None:
+        return jsonify({'error': 'Thread not found'}), 404
+    messages, next_cursor = page
+    return jsonify({'messages': messages, 'next_cursor': next_cursor})
+
+@app.route('/search', methods=['GET'])
+@login_required
+def search_history():
+    """Ranked full-text search over the user's turns, ``limit`` per page"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Query is required'}), 400
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'Invalid page or limit'}), 400
+    chat_manager.flush_history(current_user.get_id())
+    with timed('search'):
+        results, has_more = search_index.search(current_user.get_id(), query, (page - 1) * limit, limit)
+    return jsonify({'results': results, 'page': page, 'has_more': has_more})
+
+@app.cli.command('rebuild-search-index')
+@click.option('--user', 'user_id', default=None, help='Only re-index this user id')
+def rebuild_search_index(user_id):
+    """Rebuild the chat history search index from the stored threads"""
+    click.echo(f"Indexed {search_index.rebuild(user_id)} turns")
+
+@app.route('/history/export', methods=['GET'])
+@login_required
+def export_history():
+    """Stream the user's threads and turns as NDJSON (gzipped with ?gzip=1)"""
+    chat_manager.flush_history(current_user.get_id())
+    return history_export_response(export_chunks(conversations, current_user.get_id()))
+
+@app.route('/history/import', methods=['POST'])
+@login_required
+def import_history():
+    """Import an NDJSON (or gzipped) dump, sent as the request body or as a 'file' upload"""
+    chat_manager.flush_history(current_user.get_id())
+    importer = HistoryImporter(chat_manager, user_id=current_user.get_id())
+    return jsonify(importer.run(history_upload()))
+
+@app.route('/admin/history/export', methods=['GET'])
+@login_required
+def export_all_history():
+    if not current_user.is_admin:
+        return jsonify({'error': 'Admin privileges required'}), 403
+    chat_manager.flush_history()
+    return history_export_response(export_chunks(conversations, include_user=True))
+
+@app.route('/admin/history/import', methods=['POST'])
+@login_required
+def import_all_history():
+    if not current_user.is_admin:
+        return jsonify({'error': 'Admin privileges required'}), 403
+    chat_manager.flush_history()
+    importer = HistoryImporter(chat_manager, user_exists=user_store.get)
+    return jsonify(importer.run(history_upload()))
+
+def history_export_response(chunks):
+    filename = 'chat-history.ndjson'
+    mimetype = 'application/x-ndjson'
+    if request.args.get('gzip') == '1':
+        chunks, filename, mimetype = gzip_chunks(chunks), filename + '.gz', 'application/gzip'
+    return Response(chunks, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}',
+                             'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+
+def history_upload():
+    upload = request.files.get('file')
+    return upload.stream if upload is not None else request.stream
+
 @app.route('/clear_history', methods=['POST'])
 @login_required
 def clear_history():
@@ -344,11 +742,8 @@ def verify_gemini_key():
             return jsonify({'valid': False, 'error': 'No API key provided'}), 400
 
         try:
-            # Configure Gemini with the API key
-            genai.configure(api_key=api_key)
-            
             # Try to generate a simple response to verify the key
-            model = genai.GenerativeModel('gemini-1.5-flash')
+            model = chat_manager.client_pool.get(api_key, chat_manager.MODEL_NAME)
             response = model.generate_content("Hello")
             
             return jsonify({
@@ -388,9 +783,10 @@ def verify_api_key():
         }
         
         # Make a lightweight request to verify the key
-        response = requests.get(
-            "https://api-inference.huggingface.co/status/stabilityai/stable-diffusion-3.5-large-turbo",
-            headers=headers
+        response = http_pool.get_session().get(
+            HF_STATUS_URL,
+            headers=headers,
+            timeout=http_pool.DEFAULT_TIMEOUT
         )
         
         if response.status_code == 401:
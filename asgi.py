@@ -0,0 +1,302 @@
+"""ASGI entry point.
+
+The slow, upstream-bound routes (/chat, /generate-image and the two key
+verification routes) are served natively on the event loop, so a single
+process can keep many Gemini and Hugging Face calls in flight. Every other
+route is handed to the regular Flask app through a WSGI adapter.
+
+Run with e.g. ``uvicorn asgi:app``. ASYNC_MAX_INFLIGHT caps the number of
+upstream-bound requests handled at once (default 256).
+"""
+import asyncio
+import json
+import os
+from tempfile import SpooledTemporaryFile
+
+import httpx
+from asgiref.sync import AsyncToSync, sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask_login import current_user
+from werkzeug.test import EnvironBuilder
+
+from app import app as flask_app, chat_manager, conversations, image_generator, store_image, generated_image_url
+from image_generator import HF_STATUS_URL
+from rate_limiter import RateLimited
+
+MAX_INFLIGHT = int(os.environ.get('ASYNC_MAX_INFLIGHT', 256))
+
+
+class _WsgiToAsgiInstance(WsgiToAsgiInstance):
+    """One Flask request through the WSGI adapter, run on the loop's thread pool.
+
+    asgiref's own ``run_wsgi_app`` is thread-sensitive: every Flask request
+    is funnelled through one shared thread and, with requests overlapping,
+    one can be handed to another request's already finished executor
+    ("CurrentThreadExecutor already quit"). Flask is thread-safe, so the
+    app is called through ``sync_to_async(..., thread_sensitive=False)``.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            raise ValueError("WSGI wrapper received a non-HTTP scope")
+        self.scope = scope
+        with SpooledTemporaryFile(max_size=65536) as body:
+            while True:
+                message = await receive()
+                if message['type'] != 'http.request':
+                    raise ValueError("WSGI wrapper received a non-HTTP-request message")
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+            self.sync_send = AsyncToSync(send)
+            await sync_to_async(self._run_flask, thread_sensitive=False)(body)
+
+    def _run_flask(self, body):
+        try:
+            environ = self.build_environ(self.scope, body)
+        except ValueError:  # too many duplicate headers
+            self.sync_send({'type': 'http.response.start', 'status': 400,
+                            'headers': [(b'content-type', b'text/plain')]})
+            self.sync_send({'type': 'http.response.body', 'body': b'Bad Request'})
+            return
+        response = self.wsgi_application(environ, self.start_response)
+        try:
+            for output in response:
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                self.sync_send({'type': 'http.response.body', 'body': output, 'more_body': True})
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({'type': 'http.response.body'})
+
+
+class _WsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _WsgiToAsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+class AsyncChatApp:
+    def __init__(self, flask_app, max_inflight=MAX_INFLIGHT):
+        self.flask_app = flask_app
+        self.wsgi = _WsgiToAsgi(flask_app)
+        self.max_inflight = max_inflight
+        self._semaphore = None
+        self._http = None
+        self.routes = {
+            ('POST', '/chat'): (self.chat, True),
+            ('POST', '/generate-image'): (self.generate_image, True),
+            ('POST', '/verify-gemini-key'): (self.verify_gemini_key, False),
+            ('POST', '/verify_api_key'): (self.verify_api_key, False),
+        }
+
+    async def __call__(self, scope, receive, send):
+        route = None
+        if scope['type'] == 'http':
+            route = self.routes.get((scope['method'], scope['path']))
+        if route is None:
+            return await self.wsgi(scope, receive, send)
+
+        handler, login_required = route
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_inflight)
+
+        headers = [(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers']]
+        user = None
+        if login_required:
+            user = await asyncio.to_thread(self._current_user, scope, headers)
+            if user is None:
+                return await self._send_json(send, {'error': 'Authentication required'}, 401)
+
+        body = await self._read_body(receive)
+        try:
+            data = json.loads(body or b'null')
+        except ValueError:
+            data = None
+
+        async with self._semaphore:
+            await handler(send, data, dict((k.lower(), v) for k, v in headers), user)
+
+    # ------------------------------------------------------------------
+    # Routes
+
+    async def chat(self, send, data, headers, user):
+        if not isinstance(data, dict):
+            return await self._send_json(send, {'error': 'Invalid request format. Expected JSON'}, 400)
+
+        message = data.get('message', '')
+        api_key = data.get('api_key')
+        hf_api_key = data.get('hf_api_key')
+
+        if not message or not isinstance(message, str):
+            return await self._send_json(send, {'error': 'No message provided'}, 400)
+
+        if not api_key or not isinstance(api_key, str):
+            return await self._send_json(send, {'error': 'API key is required'}, 400)
+
+        thread_id = data.get('thread_id')
+        if thread_id is not None and await asyncio.to_thread(conversations.get_thread, user.get_id(), thread_id) is None:
+            return await self._send_json(send, {'error': 'Thread not found'}, 404)
+
+        if message.startswith('@image'):
+            if not hf_api_key or not isinstance(hf_api_key, str):
+                return await self._send_json(send, {'error': 'Hugging Face API key is required for image generation'}, 400)
+
+            image_prompt = message[6:].strip()
+            if not image_prompt:
+                return await self._send_json(send, {'error': 'Invalid prompt provided'}, 400)
+            try:
+                variants = await image_generator.generate_image_variants_async(image_prompt, api_key=hf_api_key)
+                image_key = await asyncio.to_thread(store_image, variants)
+                return await self._send_json(send, {
+                    'response': f"I've generated an image based on your prompt: {image_prompt}",
+                    'image_url': generated_image_url(image_key)
+                })
+            except ValueError as e:
+                return await self._send_json(send, {'error': str(e)}, 400)
+            except Exception as e:
+                return await self._send_json(send, {'error': f"Failed to generate image: {str(e)}"}, 500)
+
+        if data.get('stream') or 'application/x-ndjson' in headers.get('accept', ''):
+            return await self._stream_chat(send, message, user, api_key, thread_id)
+
+        try:
+            response = await chat_manager.process_message_async(
+                message, user.get_id(), api_key, use_cache=user.response_cache, thread_id=thread_id)
+            return await self._send_json(send, {'response': response, 'error': None})
+        except RateLimited as e:
+            return await self._send_json(send, {'error': str(e), 'retry_after': e.retry_after}, 429,
+                                         headers=[(b'retry-after', str(e.retry_after).encode())])
+        except Exception as e:
+            return await self._send_json(send, {'error': f'Failed to process message: {str(e)}'}, 500)
+
+    async def generate_image(self, send, data, headers, user):
+        if not isinstance(data, dict):
+            return await self._send_json(send, {'error': 'Invalid request format. Expected JSON'}, 400)
+
+        prompt = data.get('prompt', '')
+        if not prompt or not isinstance(prompt, str):
+            return await self._send_json(send, {'error': 'Prompt is required'}, 400)
+
+        hf_api_key = data.get('hf_api_key')
+        if not hf_api_key or not isinstance(hf_api_key, str):
+            return await self._send_json(send, {'error': 'Hugging Face API key not set. Please set it in settings.'}, 400)
+
+        try:
+            variants = await image_generator.generate_image_variants_async(prompt, api_key=hf_api_key)
+            image_key = await asyncio.to_thread(store_image, variants)
+            return await self._send_json(send, {'image_url': generated_image_url(image_key)})
+        except Exception as e:
+            print(f"Error generating image: {str(e)}")
+            return await self._send_json(send, {'error': 'An error occurred while generating the image'}, 500)
+
+    async def verify_gemini_key(self, send, data, headers, user):
+        api_key = (data or {}).get('api_key')
+        if not api_key:
+            return await self._send_json(send, {'valid': False, 'error': 'No API key provided'}, 400)
+
+        try:
+            model = chat_manager.client_pool.get_async(api_key, chat_manager.MODEL_NAME)
+            await model.generate_content_async("Hello")
+            return await self._send_json(send, {'valid': True, 'message': 'API key is valid'})
+        except Exception as e:
+            return await self._send_json(send, {'valid': False, 'error': f'Invalid API key: {str(e)}'}, 400)
+
+    async def verify_api_key(self, send, data, headers, user):
+        api_key = (data or {}).get('api_key')
+        if not api_key:
+            return await self._send_json(send, {'valid': False, 'message': 'No API key provided'}, 400)
+
+        cleaned_key = api_key.strip().replace('"', '').replace("'", '')
+        if not cleaned_key.startswith('hf_'):
+            return await self._send_json(send, {'valid': False, 'message': 'Invalid API key format - must start with hf_'}, 400)
+
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=30)
+        try:
+            response = await self._http.get(HF_STATUS_URL, headers={"Authorization": f"Bearer {cleaned_key}"})
+        except Exception as e:
+            print(f"Error verifying API key: {str(e)}")
+            return await self._send_json(send, {'valid': False, 'message': str(e)}, 500)
+
+        if response.status_code == 401:
+            return await self._send_json(send, {'valid': False, 'message': 'Invalid API key'}, 401)
+        return await self._send_json(send, {'valid': True, 'message': 'API key verified successfully'})
+
+    # ------------------------------------------------------------------
+    # Helpers
+
+    async def _stream_chat(self, send, message, user, api_key, thread_id=None):
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'application/x-ndjson'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]
+        })
+        parts = []
+        try:
+            async for text in chat_manager.stream_message_async(
+                    message, user.get_id(), api_key, use_cache=user.response_cache, thread_id=thread_id):
+                parts.append(text)
+                await self._send_line(send, {'delta': text})
+            await self._send_line(send, {'done': True, 'response': ''.join(parts)})
+        except RateLimited as e:
+            await self._send_line(send, {'error': str(e), 'retry_after': e.retry_after})
+        except Exception as e:
+            await self._send_line(send, {'error': f'Failed to process message: {str(e)}'})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    def _current_user(self, scope, headers):
+        """Resolve the logged-in user from the Flask session cookie"""
+        builder = EnvironBuilder(
+            path=scope['path'],
+            method=scope['method'],
+            headers=headers,
+            query_string=scope.get('query_string', b'').decode('latin-1')
+        )
+        with self.flask_app.request_context(builder.get_environ()):
+            if current_user.is_authenticated:
+                return current_user._get_current_object()
+        return None
+
+    @staticmethod
+    async def _read_body(receive):
+        body = b''
+        while True:
+            event = await receive()
+            body += event.get('body', b'')
+            if not event.get('more_body'):
+                return body
+
+    @staticmethod
+    async def _send_json(send, payload, status=200, headers=()):
+        body = json.dumps(payload).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                *headers,
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    @staticmethod
+    async def _send_line(send, payload):
+        await send({
+            'type': 'http.response.body',
+            'body': (json.dumps(payload) + '\n').encode('utf-8'),
+            'more_body': True
+        })
+
+
+app = AsyncChatApp(flask_app)
@@ -0,0 +1,61 @@
+"""Per-call latency of bare requests calls vs. the pooled http_pool session.
+
+Runs against a local Hugging Face stand-in, so no network or API key is
+needed:
+
+    python benchmarks/http_pool_bench.py [--calls 500]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import http_pool  # noqa: E402
+from stubs import HFStubHandler, start_stub  # noqa: E402
+
+
+def measure(post, url, calls):
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        response = post(url, headers={"Authorization": "Bearer hf_bench"}, json={"inputs": "a cat"}, timeout=30)
+        response.raise_for_status()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{name:<16} mean {statistics.mean(timings):7.3f} ms   p50 {statistics.median(timings):7.3f} ms   p95 {p95:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=500)
+    args = parser.parse_args()
+
+    server, base_url = start_stub(HFStubHandler)
+    url = f'{base_url}/models/bench'
+    try:
+        session = http_pool.build_session(backoff_factor=0, backoff_jitter=0)
+        measure(session.post, url, 10)  # warm up
+
+        report('bare requests', measure(requests.post, url, args.calls))
+        report('pooled session', measure(session.post, url, args.calls))
+
+        server.loading_responses = 2
+        start = time.perf_counter()
+        response = session.post(url, json={"inputs": "a cat"}, timeout=30)
+        print(f"503 x2 then 200: status {response.status_code} after {(time.perf_counter() - start) * 1000:.1f} ms")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""Load test of the app's user flows against local Gemini and Hugging Face stand-ins.
+
+Boots the WSGI app from wsgi.py and the ASGI app from asgi.py (under
+uvicorn) on local ports, with both upstream APIs replaced by the stubs in
+stubs.py, and has concurrent simulated users run register/login -> /chat
+-> @image -> /clear_history against each. Reports p50/p95/p99 latency per
+stage, overall requests/s and the number of upstream calls per server, and
+the app's own per-stage timings (see metrics.py). No network or API keys
+are needed:
+
+    python benchmarks/load_test.py [--users 8] [--iterations 10] [--stream]
+        [--gemini-latency 0.2] [--hf-latency 0.5] [--rate-limited 5] [--loading 2]
+        [--servers wsgi,asgi]
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from stubs import GeminiStubHandler, HFStubHandler, start_stub  # noqa: E402
+
+
+class Recorder:
+    """Latencies (ms) and error counts per stage, shared by all simulated users"""
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, stage, started, ok=True):
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.timings[stage].append(elapsed)
+            if not ok:
+                self.errors[stage] += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {stage: dict(count=len(timings), errors=self.errors[stage], **percentiles(timings))
+                    for stage, timings in self.timings.items()}
+
+
+def percentiles(timings) -> dict:
+    timings = sorted(timings)
+
+    def rank(p):
+        return timings[max(int(round(p / 100 * len(timings))) - 1, 0)]
+
+    return {"mean": sum(timings) / len(timings), "p50": rank(50), "p95": rank(95), "p99": rank(99)}
+
+
+def boot_app(gemini_url, hf_url):
+    """Import the apps from wsgi.py and asgi.py, pointed at the stubs and a throwaway data dir"""
+    os.environ['VERCEL_ENV'] = '1'  # keep data and sessions out of the repo
+    os.environ['GEMINI_API_ENDPOINT'] = gemini_url
+    os.environ['HF_API_BASE'] = hf_url
+    # Every simulated user signs up and logs in from 127.0.0.1 at once; let them all queue
+    os.environ.setdefault('LOGIN_MAX_REGISTRATIONS_PER_IP', '100000')
+    os.environ.setdefault('PASSWORD_HASH_QUEUE', '1024')
+    tempfile.tempdir = tempfile.mkdtemp(prefix='chatai-bench-')
+    import wsgi
+    import asgi
+    import app as app_module
+    return {'wsgi': wsgi.app, 'asgi': asgi.app}, app_module
+
+
+def serve(wsgi_app):
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, wsgi_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.shutdown, f'http://127.0.0.1:{server.server_port}'
+
+
+def serve_asgi(asgi_app):
+    import uvicorn
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(asgi_app, log_level='error', lifespan='off'))
+    thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def shutdown():
+        server.should_exit = True
+        thread.join()
+
+    return shutdown, f'http://127.0.0.1:{sock.getsockname()[1]}'
+
+
+def wait_for_job(session, base_url, job):
+    """Follow an image job's server-sent events until it finishes; returns its final state"""
+    with session.get(base_url + job['events_url'], stream=True) as response:
+        for line in response.iter_lines(decode_unicode=True):
+            if line and line.startswith('data: '):
+                job = json.loads(line[6:])
+                if job['status'] in ('done', 'failed', 'cancelled'):
+                    break
+    return job
+
+
+def redirected_to(response, path):
+    """True for a redirect to ``path``; the app answers both success and failure of a form with one"""
+    return response.is_redirect and urlsplit(response.headers.get('Location', '')).path == path
+
+
+def json_ok(response):
+    """True for a successful JSON reply (not, e.g., a redirect to the login page)"""
+    return response.ok and response.headers.get('Content-Type', '').startswith('application/json')
+
+
+def run_user(base_url, user, args, recorder, name='bench'):
+    """One simulated user: register and log in, chat, ask for images, clear history"""
+    session = requests.Session()
+    email = f'{name}{user}@example.com'
+
+    started = time.perf_counter()
+    response = session.post(f'{base_url}/register', allow_redirects=False, data=dict(
+        name=f'{name}{user}', email=email, password='bench', confirm_password='bench'))
+    recorder.record('register', started, redirected_to(response, '/login_page'))
+
+    started = time.perf_counter()
+    response = session.post(f'{base_url}/login', allow_redirects=False, data=dict(email=email, password='bench'))
+    logged_in = redirected_to(response, '/')
+    recorder.record('login', started, logged_in)
+    if not logged_in:
+        return  # every later request would only be bounced to the login page
+
+    for i in range(args.iterations):
+        topic = f'{name}-{i}' if args.shared_prompts else f'{name}-{user}-{i}'
+        # Each user brings their own key: Gemini calls are paced per key, and a sync request
+        # finding its key's tokens used up is refused with 429 rather than kept waiting
+        payload = {'message': f'Tell me about topic {topic}', 'api_key': f'bench-gemini-key-{user}',
+                   'hf_api_key': 'hf_bench', 'stream': args.stream}
+
+        started = time.perf_counter()
+        if args.stream:
+            ok = False
+            with session.post(f'{base_url}/chat', json=payload, stream=True, allow_redirects=False) as response:
+                first = True
+                streamed = response.ok and response.headers.get('Content-Type', '').startswith('application/x-ndjson')
+                for line in response.iter_lines() if streamed else ():
+                    if first:
+                        recorder.record('chat_first_chunk', started)
+                        first = False
+                    event = json.loads(line)
+                    ok = 'error' not in event
+            recorder.record('chat_stream', started, ok)
+        else:
+            response = session.post(f'{base_url}/chat', json=payload, allow_redirects=False)
+            recorder.record('chat', started, json_ok(response) and not response.json().get('error'))
+
+        if args.image_every and (i + 1) % args.image_every == 0:
+            payload = dict(payload, message=f'@image a picture of topic {topic}', stream=False)
+            started = time.perf_counter()
+            response = session.post(f'{base_url}/chat', json=payload, allow_redirects=False)
+            recorder.record('image_submit', started, json_ok(response))
+            job = response.json() if json_ok(response) else {}
+            if 'events_url' in job:
+                job = wait_for_job(session, base_url, job)
+            elif job.get('image_url'):
+                job['status'] = 'done'  # the ASGI app generates the image within the request
+            recorder.record('image', started, job.get('status') == 'done')
+            if job.get('status') == 'done':
+                started = time.perf_counter()
+                # As the chat bubble does: the thumbnail, in WebP when available
+                image = session.get(f"{base_url}{job['image_url']}?size=thumb", allow_redirects=False,
+                                    headers={'Accept': 'image/webp,*/*'})
+                recorder.record('image_fetch', started, image.ok)
+
+    started = time.perf_counter()
+    response = session.post(f'{base_url}/clear_history', allow_redirects=False)
+    recorder.record('clear_history', started, json_ok(response))
+
+
+def report(summary, elapsed, gemini, hf):
+    total = sum(stats['count'] for stats in summary.values())
+    print(f"{'stage':<18}{'count':>7}{'errors':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+    for stage, stats in summary.items():
+        print(f"{stage:<18}{stats['count']:>7}{stats['errors']:>8}"
+              f"{stats['mean']:>10.1f}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}")
+    # First-chunk timings share a request with chat_stream, so they are not counted twice
+    requests_made = total - summary.get('chat_first_chunk', {}).get('count', 0)
+    print(f"\n{requests_made} requests in {elapsed:.2f} s: {requests_made / elapsed:.1f} requests/s")
+    print(f"upstream calls: gemini {gemini.calls}, hugging face {hf.calls}")
+
+
+def report_server_stages():
+    """Mean time per stage inside the app, from its own stage histograms"""
+    from metrics import STAGE_SECONDS
+
+    totals = defaultdict(dict)
+    for name, labels, value in STAGE_SECONDS.samples():
+        if name.endswith(('_sum', '_count')):
+            totals[labels][name.rsplit('_', 1)[1]] = value
+    print(f"\n{'server stage':<26}{'count':>7}{'mean':>10}  (ms)")
+    for labels, values in totals.items():
+        stage = labels.split('"')[1]
+        print(f"{stage:<26}{values['count']:>7}{values['sum'] / values['count'] * 1000:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=8, help='concurrent simulated users')
+    parser.add_argument('--iterations', type=int, default=10, help='chat messages per user')
+    parser.add_argument('--image-every', type=int, default=5, help='send an @image every N messages (0: never)')
+    parser.add_argument('--stream', action='store_true', help='request NDJSON streamed replies')
+    parser.add_argument('--shared-prompts', action='store_true', help='all users send the same prompts')
+    parser.add_argument('--gemini-latency', type=float, default=0.2, help='seconds before a Gemini reply starts')
+    parser.add_argument('--chunk-delay', type=float, default=0.05, help='seconds between streamed chunks')
+    parser.add_argument('--hf-latency', type=float, default=0.5, help='seconds per generated image')
+    parser.add_argument('--rate-limited', type=int, default=0, help='Gemini 429s before the first success')
+    parser.add_argument('--retry-after', type=float, help='Retry-After sent with the Gemini 429s')
+    parser.add_argument('--loading', type=int, default=0, help='Hugging Face 503s before the first success')
+    parser.add_argument('--backoff', type=float, default=0.1,
+                        help="initial 429 backoff without Retry-After (the app's is 2 s)")
+    parser.add_argument('--write-behind', action='store_true', help='queue history writes (CHAT_WRITE_BEHIND=1)')
+    parser.add_argument('--servers', default='wsgi,asgi',
+                        help='comma-separated servers to run the users against, in turn: wsgi, asgi')
+    parser.add_argument('--json', metavar='PATH', help='also write the results to PATH')
+    parser.add_argument('--verbose', action='store_true', help="show the app's own output")
+    args = parser.parse_args()
+
+    gemini, gemini_url = start_stub(GeminiStubHandler, latency=args.gemini_latency,
+                                    chunk_delay=args.chunk_delay, rate_limited_responses=args.rate_limited,
+                                    retry_after=args.retry_after)
+    hf, hf_url = start_stub(HFStubHandler, latency=args.hf_latency, loading_responses=args.loading)
+
+    if args.write_behind:
+        os.environ['CHAT_WRITE_BEHIND'] = '1'
+    apps, app_module = boot_app(gemini_url, hf_url)
+    app_module.chat_manager.rate_limiter.initial_backoff = args.backoff
+
+    results = {}
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    try:
+        for name in args.servers.split(','):
+            shutdown, base_url = (serve_asgi if name == 'asgi' else serve)(apps[name])
+            recorder = Recorder()
+            gemini.calls = hf.calls = 0
+            try:
+                with output, ThreadPoolExecutor(max_workers=args.users) as pool:
+                    started = time.perf_counter()
+                    # Users are named per server so each run signs up fresh accounts
+                    for future in [pool.submit(run_user, base_url, user, args, recorder, name)
+                                   for user in range(args.users)]:
+                        future.result()
+                    elapsed = time.perf_counter() - started
+            finally:
+                shutdown()
+            results[name] = {"elapsed": elapsed, "stages": recorder.summary(),
+                             "upstream_calls": {"gemini": gemini.calls, "hugging_face": hf.calls}}
+            print(f"== {name} ==")
+            report(results[name]['stages'], elapsed, gemini, hf)
+            print()
+    finally:
+        gemini.shutdown()
+        hf.shutdown()
+
+    report_server_stages()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"args": vars(args), "servers": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Cold-start benchmark of the Vercel entry point (wsgi.py).
+
+Each run starts a fresh interpreter with an empty data dir, as a new
+serverless instance would, imports wsgi.py under ``-X importtime`` and
+serves the requested paths in-process. Reports import time by top-level
+package, split into what wsgi.py loads at startup and what is deferred
+until a request needs it, the time to import the app and the time to
+the first response of each path, as medians over ``--runs``:
+
+    python benchmarks/startup_bench.py [--runs 5] [--path /login_page] [--path /chat] [--top 15]
+
+``/chat`` is sent as a logged-in user's message, answered by the local
+Gemini stand-in from stubs.py, so it includes building the chat manager.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Runs in the child interpreter: import the app, then time one request per path.
+# Markers on stderr split the -X importtime log into startup and deferred imports.
+CHILD = r"""
+import json, sys, time
+sys.stderr.write("-- startup\n")
+started = time.perf_counter()
+import wsgi
+imported = time.perf_counter()
+sys.stderr.write("-- deferred\n")
+import gemini_pool
+timings = {"import": imported - started}
+for path in json.loads(sys.argv[1]):
+    client = wsgi.app.test_client()
+    if path == "/chat":
+        from stubs import GeminiStubHandler, start_stub
+        _, gemini_pool.GEMINI_API_ENDPOINT = start_stub(GeminiStubHandler)
+        client.post("/register", data=dict(name="bench", email="bench@example.com",
+                                            password="bench", confirm_password="bench"))
+        client.post("/login", data=dict(email="bench@example.com", password="bench"))
+    started = time.perf_counter()
+    if path == "/chat":
+        response = client.post(path, json={"message": "Hello", "api_key": "bench-gemini-key"})
+    else:
+        response = client.get(path)
+    response.get_data()
+    timings[path] = time.perf_counter() - started
+    timings[path + " status"] = response.status_code
+print("STARTUP " + json.dumps(timings))
+"""
+
+
+def run_once(paths) -> tuple:
+    """One cold start; returns ({phase: seconds}, {(top-level package, when): import µs})"""
+    env = dict(os.environ, VERCEL_ENV='1', TMPDIR=tempfile.mkdtemp(prefix='chatai-startup-'),
+               PYTHONPATH=os.pathsep.join([ROOT, os.path.join(ROOT, 'benchmarks')]),
+               PYTHONWARNINGS='ignore')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD, json.dumps(paths)],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    timings, modules, phase = None, defaultdict(int), None
+    for line in result.stdout.splitlines():
+        if line.startswith('STARTUP '):
+            timings = json.loads(line[len('STARTUP '):])
+    for line in result.stderr.splitlines():
+        if line.startswith('-- '):
+            phase = line[3:]
+        elif phase and line.startswith('import time:') and 'cumulative' not in line:
+            # "import time: self [us] | cumulative | imported package"; self times add up without overlap
+            own, _, name = line[len('import time:'):].split('|')
+            modules[(name.strip().split('.')[0], phase)] += int(own)
+    if timings is None:
+        sys.exit(f"startup run failed:\n{result.stderr[-2000:]}")
+    return timings, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='cold starts to take the median of')
+    parser.add_argument('--path', action='append', dest='paths',
+                        help='request to time after import (repeatable; default /login_page)')
+    parser.add_argument('--top', type=int, default=15, help='slowest imports to list')
+    parser.add_argument('--json', metavar='PATH', help='also write the results to PATH')
+    args = parser.parse_args()
+    paths = args.paths or ['/login_page']
+
+    phases, modules = defaultdict(list), defaultdict(list)
+    for _ in range(args.runs):
+        timings, imports = run_once(paths)
+        for phase, value in timings.items():
+            phases[phase].append(value)
+        for name, micros in imports.items():
+            modules[name].append(micros)
+
+    imports = {}
+    for (name, phase), values in modules.items():
+        imports.setdefault(name, {'startup': 0.0, 'deferred': 0.0})[phase] = statistics.median(values) / 1000
+    ranked = sorted(imports.items(), key=lambda item: -(item[1]['startup'] + item[1]['deferred']))
+    print(f"{'import (by package)':<30}{'startup':>10}{'deferred':>10}  (ms)")
+    for name, millis in ranked[:args.top]:
+        print(f"{name:<30}{millis['startup']:>10.1f}{millis['deferred']:>10.1f}")
+    print(f"{'total':<30}{sum(m['startup'] for m in imports.values()):>10.1f}"
+          f"{sum(m['deferred'] for m in imports.values()):>10.1f}")
+
+    print(f"\n{'phase':<30}{'ms':>10}  (median of {args.runs} cold starts)")
+    results = {}
+    for phase in ['import'] + paths:
+        results[phase] = statistics.median(phases[phase]) * 1000
+        status = f"  HTTP {phases[phase + ' status'][-1]}" if phase != 'import' else ''
+        print(f"{phase:<30}{results[phase]:>10.1f}{status}")
+    results['first_response'] = results['import'] + results[paths[0]]
+    print(f"{'time to first response':<30}{results['first_response']:>10.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"phases_ms": results, "imports_ms": imports}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Local stand-ins for the upstream APIs, used by the benchmarks."""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+from PIL import Image
+
+
+def _sample_image():
+    buffered = BytesIO()
+    Image.new('RGB', (64, 64), (200, 120, 40)).save(buffered, format='PNG')
+    return buffered.getvalue()
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    # Send headers and body in one segment; otherwise Nagle + delayed ACK
+    # adds ~40 ms to every response on a reused connection
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type, headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _record_call(self):
+        with self.server.lock:
+            self.server.calls += 1
+
+    def _take(self, counter):
+        """Consume one of the server's ``counter`` canned failures; True if there was one"""
+        with self.server.lock:
+            remaining = getattr(self.server, counter)
+            if remaining > 0:
+                setattr(self.server, counter, remaining - 1)
+            return remaining > 0
+
+
+class HFStubHandler(_StubHandler):
+    """Hugging Face inference stand-in: POST /models/<model> returns a PNG,
+    GET /status/<model> returns a small JSON document.
+
+    ``server.loading_responses`` 503s are returned before the first success;
+    each generation takes ``server.latency`` seconds.
+    """
+    image = _sample_image()
+
+    def do_GET(self):
+        self._send(200, b'{"loaded": true}', 'application/json')
+
+    def do_POST(self):
+        self._record_call()
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self._take('loading_responses'):
+            self._send(503, b'{"error": "Model is currently loading"}', 'application/json',
+                       headers=[('Retry-After', '0')])
+            return
+        time.sleep(self.server.latency)
+        self._send(200, self.image, 'image/png')
+
+
+class GeminiStubHandler(_StubHandler):
+    """Gemini REST stand-in for ``models/<model>:generateContent`` and
+    ``:streamGenerateContent``.
+
+    The reply echoes the last user message of the prompt. ``server.rate_limited_responses``
+    429s (with ``server.retry_after`` as Retry-After, if set) are returned
+    before the first success; a reply takes ``server.latency``
+    seconds to start and, when streamed, arrives in ``server.stream_chunks``
+    chunks ``server.chunk_delay`` seconds apart.
+    """
+
+    def do_POST(self):
+        self._record_call()
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self._take('rate_limited_responses'):
+            error = {"error": {"code": 429, "message": "Resource has been exhausted", "status": "RESOURCE_EXHAUSTED"}}
+            headers = [('Retry-After', str(self.server.retry_after))] if self.server.retry_after is not None else []
+            self._send(429, json.dumps(error).encode(), 'application/json', headers=headers)
+            return
+
+        prompt = ''.join(part.get('text', '') for content in request.get('contents', [])
+                         for part in content.get('parts', []))
+        questions = [line for line in prompt.splitlines() if line.startswith('User: ')]
+        text = f"Stub reply to: {questions[-1][6:] if questions else prompt[-80:]}"
+        time.sleep(self.server.latency)
+
+        if ':streamGenerateContent' not in self.path:
+            self._send(200, json.dumps(self._response(text)).encode(), 'application/json')
+            return
+
+        # A streamed reply is one JSON array, written element by element
+        count = max(self.server.stream_chunks, 1)
+        size = -(-len(text) // count)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(self.server.chunk_delay)
+            body = ('[' if i == 0 else ',\r\n') + json.dumps(self._response(piece))
+            self._write_chunk(body.encode())
+        self._write_chunk(b']')
+        self._write_chunk(b'')
+
+    def _write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    @staticmethod
+    def _response(text):
+        return {
+            "candidates": [{
+                "content": {"parts": [{"text": text}], "role": "model"},
+                "finishReason": "STOP",
+                "index": 0
+            }]
+        }
+
+
+def start_stub(handler, host='127.0.0.1', port=0, **attrs):
+    """Serve ``handler`` on a background thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.calls = 0
+    server.loading_responses = 0
+    server.rate_limited_responses = 0
+    server.retry_after = None
+    server.latency = 0.0
+    server.chunk_delay = 0.0
+    server.stream_chunks = 4
+    for name, value in attrs.items():
+        setattr(server, name, value)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
@@ -1,19 +1,94 @@
 import json
 import os
-from datetime import datetime
-import google.generativeai as genai
+import hashlib
 from pathlib import Path
+from datetime import datetime
 import tempfile
-import time
+import asyncio
+import itertools
+from chat_store import ChatLogStore
+from context_cache import ContextCache
+from context_builder import ContextBuilder
+from gemini_pool import GeminiClientPool
+from ttl_cache import TTLCache
+from single_flight import SingleFlight
+from metrics import timed, GEMINI_RATE_LIMITED, GEMINI_RETRIES, GEMINI_GAVE_UP
+from rate_limiter import RateLimiter, RateLimited, retry_after_from, is_rate_limit_error
+from write_behind import WriteBehindQueue
 
 class ChatManager:
-    def __init__(self, max_retries=3, initial_delay=2):  # Added retry parameters
+    MODEL_NAME = 'gemini-1.5-flash'  # use lightweight model
+
+    def __init__(self, max_retries=3, initial_delay=2, store=None, context_cache=None, client_pool=None,
+                 context_builder=None, response_cache=None, single_flight=None, rate_limiter=None,
+                 conversations=None, search_index=None, write_behind=None):  # Added retry parameters
         self.data_dir = self._get_data_dir()
         self.chats_file = self.data_dir / 'chats.json'
         self._ensure_chats_file()
         self.max_retries = max_retries
         self.initial_delay = initial_delay
 
+        # History lives in per-user append-only logs; chats.json is only read once for migration
+        self.store = store or ChatLogStore(
+            self.data_dir / 'chat_logs',
+            fsync_policy=os.environ.get('CHAT_LOG_FSYNC', 'interval')
+        )
+        self.store.migrate_from_json(self.chats_file)
+
+        # Tail window of recent turns per active user, so building a prompt only stats the log
+        self.context_cache = context_cache or ContextCache()
+
+        # Keeps prompts within a token budget; older turns live on in a rolling summary
+        self.context_builder = context_builder or ContextBuilder(
+            token_budget=int(os.environ.get('CHAT_CONTEXT_TOKEN_BUDGET', 2000)),
+            summary_budget=int(os.environ.get('CHAT_SUMMARY_TOKEN_BUDGET', 300))
+        )
+
+        # Gemini clients configured per API key, reused across messages
+        self.client_pool = client_pool or GeminiClientPool()
+
+        # Generation settings passed to Gemini (model defaults when empty)
+        self.generation_config = {}
+
+        # Opt-in exact-match cache of responses keyed by (model, full prompt, settings)
+        self.response_cache = response_cache
+        if self.response_cache is None and os.environ.get('CHAT_RESPONSE_CACHE') == '1':
+            self.response_cache = TTLCache(
+                max_entries=int(os.environ.get('CHAT_RESPONSE_CACHE_SIZE', 1024)),
+                ttl=float(os.environ.get('CHAT_RESPONSE_CACHE_TTL', 300))
+            )
+
+        # Identical prompts already in flight to Gemini are waited on rather than sent again
+        self.single_flight = single_flight or SingleFlight(
+            timeout=float(os.environ.get('CHAT_SINGLE_FLIGHT_TIMEOUT', 60))
+        )
+
+        # Paces Gemini calls per API key and backs off on 429s; sync callers are refused with
+        # RateLimited instead of sleeping, only the async path waits (up to GEMINI_MAX_WAIT) and retries
+        self.rate_limiter = rate_limiter or RateLimiter(
+            rate=float(os.environ.get('GEMINI_RATE_LIMIT', 5)),
+            burst=int(os.environ.get('GEMINI_RATE_BURST', 10)),
+            max_wait=float(os.environ.get('GEMINI_MAX_WAIT', 5)),
+            max_queue=int(os.environ.get('GEMINI_MAX_QUEUE', 16)),
+            initial_backoff=initial_delay
+        )
+
+        # Optional ConversationStore; turns are also filed into the user's threads there
+        self.conversations = conversations
+
+        # Optional SearchIndex, kept in step with every change to the history
+        self.search_index = search_index
+
+        # Opt-in write-behind: turns are queued and committed in groups off the response path
+        self.write_behind = write_behind
+        if self.write_behind is None and os.environ.get('CHAT_WRITE_BEHIND') == '1':
+            self.write_behind = WriteBehindQueue(
+                self._write_turns,
+                max_batch=int(os.environ.get('CHAT_WRITE_BEHIND_MAX_BATCH', 64)),
+                max_latency=float(os.environ.get('CHAT_WRITE_BEHIND_MAX_LATENCY_MS', 50)) / 1000,
+                max_pending=int(os.environ.get('CHAT_WRITE_BEHIND_QUEUE', 1024))
+            )
+
     def _get_data_dir(self):
         """Get the appropriate data directory for the environment"""
         if os.environ.get('VERCEL_ENV'):
@@ -34,99 +109,381 @@ class ChatManager:
                 json.dump({"chats": {}}, f)
 
     def get_user_chats(self, user_id: str) -> list:
-        """Get all chats for a user"""
+        """Get all chats for a user, oldest first (imported turns sit at the end of the log)"""
         try:
-            with open(self.chats_file, 'r') as f:
-                chats_data = json.load(f)
-                return chats_data.get("chats", {}).get(user_id, [])
+            self.flush_history(user_id)
+            return sorted(self.store.read(user_id), key=lambda entry: entry["timestamp"])
         except Exception as e:
             print(f"Error getting user chats: {e}")
             return []
 
-    def add_to_history(self, user_id: str, message: str, response: str):
-        """Add a message and response to the chat history"""
+    def add_to_history(self, user_id: str, message: str, response: str, thread_id=None):
+        """Add a message and response to the chat history (and to thread ``thread_id``, if given)"""
         try:
-            # Create a new file if it doesn't exist
-            if not self.chats_file.exists():
-                self._ensure_chats_file()
+            with timed('write_history'):
+                if self.write_behind is not None and self.write_behind.submit(
+                        user_id, (message, response, thread_id, datetime.now().isoformat())):
+                    return None
+                entry, before, after = self.store.append_versioned(user_id, message, response)
+                if self.conversations is not None:
+                    # Context is per thread: the thread's own window and summary (see _recent_context)
+                    thread = self.conversations.add_turn(user_id, message, response, thread_id=thread_id,
+                                                         turn_id=entry["id"], timestamp=entry["timestamp"])
+                    key = (str(user_id), thread["id"])
+                    self.context_cache.append(key, entry, before, after)
+                    summary = self._fold_thread_summary(user_id, thread["id"])
+                    if summary is not None:
+                        self.context_cache.set_summary(key, summary, after, after)
+                else:
+                    cached, evicted = self.context_cache.append(user_id, entry, before, after)
+                    if not cached:
+                        window = self.context_cache.window
+                        recent = self.store.read(user_id, limit=window + 1)
+                        evicted = recent[0] if len(recent) > window else None
+                    if evicted is not None:
+                        self._fold_into_summary(user_id, evicted)
+                if self.search_index is not None:
+                    self.search_index.add(user_id, entry)
+            return entry
+        except Exception as e:
+            self.context_cache.invalidate(user_id)
+            print(f"Error adding to history: {e}")
 
+    def _write_turns(self, turns_by_user: dict):
+        """Write-behind flush: append {user_id: [(message, response, thread_id, timestamp)]} in one go"""
+        entries_by_user, thread_turns = {}, []
+        for user_id, turns in turns_by_user.items():
             try:
-                with open(self.chats_file, 'r') as f:
-                    chats_data = json.load(f)
-            except json.JSONDecodeError:
-                chats_data = {"chats": {}}
+                entries = self.store.append_many(user_id, [(message, response, timestamp)
+                                                           for message, response, _, timestamp in turns])
+                self.context_cache.invalidate(user_id)
+                if self.conversations is None:
+                    # Every turn pushed out of the recent window goes into the summary, oldest first
+                    recent = self.store.read(user_id, limit=self.context_cache.window + len(entries))
+                    for turn in recent[:max(len(recent) - self.context_cache.window, 0)]:
+                        self._fold_into_summary(user_id, turn)
+            except Exception as e:
+                self.context_cache.invalidate(user_id)
+                print(f"Error adding to history: {e}")
+                continue
+            entries_by_user[user_id] = entries
+            thread_turns.extend(
+                (user_id, entry["message"], entry["response"], thread_id, entry["id"], entry["timestamp"])
+                for entry, (_, _, thread_id, _) in zip(entries, turns))
+        if self.conversations is not None and thread_turns:
+            for user_id, thread_id in self.conversations.add_turn_batch(thread_turns):
+                self._fold_thread_summary(user_id, thread_id)
+        if self.search_index is not None and entries_by_user:
+            self.search_index.add_batch(entries_by_user)
 
-            if user_id not in chats_data["chats"]:
-                chats_data["chats"][user_id] = []
+    def flush_history(self, user_id: str = None):
+        """Wait until queued turns of ``user_id`` (or of everyone) are written, so reads see them"""
+        if self.write_behind is not None:
+            if user_id is None:
+                self.write_behind.flush()
+            else:
+                self.write_behind.flush_user(user_id)
 
-            chat_entry = {
-                "timestamp": datetime.now().isoformat(),
-                "message": message,
-                "response": response
-            }
+    def close(self):
+        """Write out queued turns and sync the chat logs; called at shutdown"""
+        if self.write_behind is not None:
+            self.write_behind.close()
+        self.store.close()
 
-            chats_data["chats"][user_id].append(chat_entry)
+    def delete_from_history(self, user_id: str, chat_id: str):
+        """Delete a single message/response pair from the chat history"""
+        self.flush_history(user_id)
+        self.context_cache.invalidate(user_id)
+        try:
+            if self.conversations is not None:
+                self.conversations.delete_turn(user_id, chat_id)
+            if self.search_index is not None:
+                self.search_index.remove(user_id, chat_id)
+            return self.store.delete(user_id, chat_id)
+        except Exception as e:
+            print(f"Error deleting from history: {e}")
+            return False
 
-            with open(self.chats_file, 'w') as f:
-                json.dump(chats_data, f)
+    def delete_thread(self, user_id: str, thread_id) -> bool:
+        """Delete a thread together with its turns in the chat log; False for an unknown thread"""
+        self.flush_history(user_id)
+        turn_ids = self.conversations.delete_thread(user_id, thread_id)
+        if turn_ids is None:
+            return False
+        self.context_cache.invalidate(user_id)
+        try:
+            if turn_ids and self.search_index is not None:
+                self.search_index.remove_turns(user_id, turn_ids)
+            if turn_ids:
+                self.store.delete_many(user_id, turn_ids)
+                self.store.compact(user_id)  # so the deleted text doesn't linger in the log file
+        except Exception as e:
+            print(f"Error deleting thread from history: {e}")
+        return True
 
+    def _fold_thread_summary(self, user_id: str, thread_id):
+        """Fold the turns that left a thread's recent window into the thread's rolling summary;
+        returns the new summary, or None if nothing changed"""
+        try:
+            return self.conversations.update_summary(user_id, thread_id, self.context_cache.window,
+                                                     self.context_builder.fold_into_summary)
         except Exception as e:
-            print(f"Error adding to history: {e}")
+            self.context_cache.invalidate(user_id)
+            print(f"Error updating thread summary: {e}")
+            return None
+
+    def _fold_into_summary(self, user_id: str, turn: dict):
+        """Add a turn that just left the recent window to the user's rolling summary"""
+        summary = self.store.read_summary(user_id)
+        if summary and summary.get("upto") == turn["id"]:
+            return  # already folded in (e.g. by another worker)
+        text = self.context_builder.fold_into_summary(summary["text"] if summary else "", turn)
+        before, after = self.store.write_summary(user_id, text, upto=turn["id"])
+        self.context_cache.set_summary(user_id, {"text": text, "upto": turn["id"]}, before, after)
 
-    def get_context_for_prompt(self, user_id: str, max_messages: int = 5) -> str:
-        """Get the conversation context for the next prompt"""
-        chats = self.get_user_chats(user_id)
-        if not chats:
+    def _recent_context(self, user_id: str, max_messages: int, thread_id=None):
+        """Get the last turns and rolling summary of a thread (without a ConversationStore, of the
+        user's whole log), from the cache when it is current.
+
+        Thread windows are cached per (user_id, thread_id); without a thread
+        the user's current thread is looked up first, with one indexed query.
+        Every turn also goes to the chat log, so the log's version tells when
+        another worker has written to the user's history.
+        """
+        with timed('read_history'):
+            self.flush_history(user_id)
+            if self.conversations is not None:
+                if thread_id is None:
+                    thread_id = self.conversations.latest_thread_id(user_id)
+                    if thread_id is None:
+                        return [], None
+                key = (str(user_id), int(thread_id))
+            else:
+                key = user_id
+            version = self.store.version(user_id)
+            cached = self.context_cache.get(key, version, limit=max_messages)
+            if cached is not None:
+                return cached
+            window = max(max_messages, self.context_cache.window)
+            if self.conversations is not None:
+                turns, summary = self.conversations.recent_context(user_id, thread_id, window)
+            else:
+                turns = self.store.read(user_id, limit=window)
+                summary = self.store.read_summary(user_id)
+            self.context_cache.put(key, turns, summary, version)
+            return (turns[-max_messages:] if max_messages > 0 else []), summary
+
+    def get_context_for_prompt(self, user_id: str, max_messages: int = 5, thread_id=None) -> str:
+        """Get the conversation context for the next prompt (in thread ``thread_id``)"""
+        try:
+            turns, summary = self._recent_context(user_id, max_messages, thread_id)
+        except Exception as e:
+            print(f"Error getting user chats: {e}")
             return ""
+        return self.context_builder.build_context(turns, summary["text"] if summary else None)
+
+    def _generate_content_with_backoff(self, model, full_prompt, stream=False, api_key=None):
+        """Call Gemini once, paced by the shared rate limiter.
 
-        recent_chats = chats[-max_messages:]
-        context = []
-        for chat in recent_chats:
-            context.append(f"User: {chat['message']}")
-            context.append(f"Assistant: {chat['response']}")
+        The call first takes a token for ``api_key``, or fails fast with
+        RateLimited when none is available: this thread never sleeps. A 429
+        blocks the key for the upstream's Retry-After (or a jittered backoff)
+        and is raised as RateLimited carrying that delay, so the client
+        retries instead of a worker waiting. With ``stream=True`` an iterator
+        over the response chunks is returned; the first chunk is fetched here
+        because that is where a streamed call reports rate limits.
+        """
+        with timed('rate_limit_wait'):
+            self.rate_limiter.acquire(api_key)
+        try:
+            with timed('gemini_call'):
+                if not stream:
+                    response = model.generate_content(full_prompt, generation_config=self.generation_config or None)
+                else:
+                    chunks = iter(model.generate_content(
+                        full_prompt, generation_config=self.generation_config or None, stream=True))
+                    first = next(chunks, None)
+                    response = itertools.chain([first] if first is not None else [], chunks)
+        except Exception as e:
+            if not is_rate_limit_error(e):
+                print(f"An unexpected error occurred: {e}")
+                raise  # Re-raise the exception for other errors
+            GEMINI_RATE_LIMITED.inc()
+            raise RateLimited(self.rate_limiter.record_rate_limit(api_key, retry_after_from(e))) from e
+        self.rate_limiter.record_success(api_key)
+        return response
 
-        return "\n".join(context)
+    async def _generate_content_with_backoff_async(self, model, full_prompt, stream=False, api_key=None):
+        """Async variant of _generate_content_with_backoff that retries rate limits.
 
-    def _generate_content_with_backoff(self, model, full_prompt):
-        """Helper function to handle rate limits with exponential backoff."""
+        A 429 blocks the key as above; the next attempt waits for a token with
+        asyncio.sleep (up to the limiter's max_wait, beyond which RateLimited
+        is raised). Returns None once ``max_retries`` attempts were all
+        rate limited.
+        """
         for i in range(self.max_retries):
+            with timed('rate_limit_wait'):
+                await self.rate_limiter.acquire_async(api_key)
+            if i:
+                GEMINI_RETRIES.inc()  # only counted once the call is actually sent again
             try:
-                response = model.generate_content(full_prompt)
+                with timed('gemini_call'):
+                    if not stream:
+                        response = await model.generate_content_async(
+                            full_prompt, generation_config=self.generation_config or None)
+                    else:
+                        stream_response = await model.generate_content_async(
+                            full_prompt, generation_config=self.generation_config or None, stream=True)
+                        chunks = stream_response.__aiter__()
+                        try:
+                            first = await chunks.__anext__()
+                        except StopAsyncIteration:
+                            first = None
+                        response = (first, chunks)
+                self.rate_limiter.record_success(api_key)
                 return response
             except Exception as e:
-                if "429" in str(e):  # Check if the error is a rate limit error
-                    delay = self.initial_delay * (2 ** i)
-                    print(f"Rate limit exceeded. Retrying in {delay} seconds...")
-                    time.sleep(delay)
-                else:
+                if not is_rate_limit_error(e):
                     print(f"An unexpected error occurred: {e}")
-                    raise  # Re-raise the exception for other errors
-        print("Max retries reached. Failed to generate content.")
-        return None  # Or raise an exception, depending on your error handling strategy
+                    raise
+                GEMINI_RATE_LIMITED.inc()
+                self.rate_limiter.record_rate_limit(api_key, retry_after_from(e))
+        GEMINI_GAVE_UP.inc()
+        return None
+
+    def _build_prompt(self, message: str, user_id: str, thread_id=None) -> str:
+        """Assemble the full prompt: summary, recent turns and the new message, within the token budget"""
+        try:
+            turns, summary = self._recent_context(user_id, self.context_cache.window, thread_id)
+        except Exception as e:
+            print(f"Error getting user chats: {e}")
+            turns, summary = [], None
+        with timed('build_context'):
+            return self.context_builder.build_prompt(message, turns, summary["text"] if summary else None)
+
+    def _get_model(self, api_key: str = None, use_async: bool = False):
+        """Get the Gemini model used for text generation.
+
+        With an API key the model comes from the client pool and is bound to
+        that key; without one it falls back to the globally configured key.
+        """
+        if not api_key:
+            import google.generativeai as genai  # loaded on first use, see GeminiClientPool._get
+            return genai.GenerativeModel(self.MODEL_NAME)
+        if use_async:
+            return self.client_pool.get_async(api_key, self.MODEL_NAME)
+        return self.client_pool.get(api_key, self.MODEL_NAME)
+
+    def _prompt_key(self, full_prompt: str) -> str:
+        """Hash of everything that determines a response: model, full prompt and settings"""
+        payload = json.dumps([self.MODEL_NAME, full_prompt, self.generation_config], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _flight_key(self, full_prompt: str, api_key: str = None) -> str:
+        """Single-flight key: the prompt key plus the caller's API key hash, so only calls
+        billed to the same key are merged (a request never rides on another user's key)"""
+        key_hash = GeminiClientPool._key(api_key, self.MODEL_NAME)[0] if api_key else ''
+        return f"{key_hash}:{self._prompt_key(full_prompt)}"
+
+    def _response_cache_key(self, full_prompt: str, use_cache: bool = True):
+        """Key of a prompt in the response cache, or None when caching does not apply"""
+        if self.response_cache is None or not use_cache:
+            return None
+        return self._prompt_key(full_prompt)
+
+    def _cached_response(self, cache_key):
+        return self.response_cache.get(cache_key) if cache_key else None
 
-    def process_message(self, message: str, user_id: str) -> str:
+    def _cache_response(self, cache_key, text: str):
+        if cache_key and text:
+            self.response_cache.put(cache_key, text)
+
+    def process_message(self, message: str, user_id: str, api_key: str = None, use_cache: bool = True,
+                        thread_id=None) -> str:
         """Process a message using Gemini model"""
         try:
-            # Get conversation context
-            context = self.get_context_for_prompt(user_id)
-            full_prompt = f"{context}\nUser: {message}\nAssistant:"
+            full_prompt = self._build_prompt(message, user_id, thread_id)
+            cache_key = self._response_cache_key(full_prompt, use_cache)
+            cached = self._cached_response(cache_key)
+            if cached is not None:
+                self.add_to_history(user_id, message, cached, thread_id)
+                return cached
 
-            # Use Gemini model for text generation
-            # model = genai.GenerativeModel('gemini-1.5-pro-latest')  # or 'gemini-1.5-pro'
-            # model = genai.GenerativeModel('gemini-1.5-flash')
-            try:
-              model = genai.GenerativeModel('gemini-1.5-flash')  # use lightweight model
-            except:
-                model = genai.GenerativeModel('gemini-1.5-pro-latest')  # fallback if needed
+            model = self._get_model(api_key)
+
+            response = self.single_flight.do(self._flight_key(full_prompt, api_key),
+                                             self._generate_content_with_backoff, model, full_prompt, api_key=api_key)
+
+            self._cache_response(cache_key, response.text)
+
+            # Save to history
+            self.add_to_history(user_id, message, response.text, thread_id)
+
+            return response.text
+
+        except Exception as e:
+            print(f"Error processing message: {str(e)}")
+            raise
+
+    def stream_message(self, message: str, user_id: str, api_key: str = None, use_cache: bool = True,
+                       thread_id=None):
+        """Process a message using Gemini model, yielding the response text as it arrives.
+
+        The turn is saved to history only once the stream has completed.
+        """
+        try:
+            full_prompt = self._build_prompt(message, user_id, thread_id)
+            cache_key = self._response_cache_key(full_prompt, use_cache)
+            cached = self._cached_response(cache_key)
+            if cached is not None:
+                yield cached
+                self.add_to_history(user_id, message, cached, thread_id)
+                return
+
+            model = self._get_model(api_key)
+
+            chunks = self._generate_content_with_backoff(model, full_prompt, stream=True, api_key=api_key)
+
+            parts = []
+            for chunk in chunks:
+                text = chunk.text
+                if text:
+                    parts.append(text)
+                    yield text
+
+            self._cache_response(cache_key, "".join(parts))
+
+            # Save to history
+            self.add_to_history(user_id, message, "".join(parts), thread_id)
+
+        except Exception as e:
+            print(f"Error processing message: {str(e)}")
+            raise
 
+    async def process_message_async(self, message: str, user_id: str, api_key: str = None, use_cache: bool = True,
+                                    thread_id=None) -> str:
+        """Async variant of process_message; history I/O runs in a worker thread"""
+        try:
+            full_prompt = await asyncio.to_thread(self._build_prompt, message, user_id, thread_id)
+            cache_key = self._response_cache_key(full_prompt, use_cache)
+            cached = self._cached_response(cache_key)
+            if cached is not None:
+                await asyncio.to_thread(self.add_to_history, user_id, message, cached, thread_id)
+                return cached
+
+            model = self._get_model(api_key, use_async=True)
 
-            response = self._generate_content_with_backoff(model, full_prompt)
+            response = await self.single_flight.do_async(self._flight_key(full_prompt, api_key),
+                                                         self._generate_content_with_backoff_async, model, full_prompt,
+                                                         api_key=api_key)
 
             if response is None:
                 return "Error: Could not generate response due to rate limits."
 
+            self._cache_response(cache_key, response.text)
+
             # Save to history
-            self.add_to_history(user_id, message, response.text)
+            await asyncio.to_thread(self.add_to_history, user_id, message, response.text, thread_id)
 
             return response.text
 
@@ -134,24 +491,57 @@ class ChatManager:
             print(f"Error processing message: {str(e)}")
             raise
 
-
-    def clear_history(self, user_id: str):
-        """Clear chat history for a user"""
+    async def stream_message_async(self, message: str, user_id: str, api_key: str = None, use_cache: bool = True,
+                                   thread_id=None):
+        """Async variant of stream_message"""
         try:
-            if not self.chats_file.exists():
+            full_prompt = await asyncio.to_thread(self._build_prompt, message, user_id, thread_id)
+            cache_key = self._response_cache_key(full_prompt, use_cache)
+            cached = self._cached_response(cache_key)
+            if cached is not None:
+                yield cached
+                await asyncio.to_thread(self.add_to_history, user_id, message, cached, thread_id)
                 return
 
-            try:
-                with open(self.chats_file, 'r') as f:
-                    chats_data = json.load(f)
-            except json.JSONDecodeError:
-                chats_data = {"chats": {}}
+            model = self._get_model(api_key, use_async=True)
 
-            if user_id in chats_data["chats"]:
-                chats_data["chats"][user_id] = []
+            result = await self._generate_content_with_backoff_async(model, full_prompt, stream=True, api_key=api_key)
 
-            with open(self.chats_file, 'w') as f:
-                json.dump(chats_data, f)
+            if result is None:
+                yield "Error: Could not generate response due to rate limits."
+                return
 
+            first, chunks = result
+            parts = []
+            chunk = first
+            while chunk is not None:
+                text = chunk.text
+                if text:
+                    parts.append(text)
+                    yield text
+                try:
+                    chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    chunk = None
+
+            self._cache_response(cache_key, "".join(parts))
+
+            # Save to history
+            await asyncio.to_thread(self.add_to_history, user_id, message, "".join(parts), thread_id)
+
+        except Exception as e:
+            print(f"Error processing message: {str(e)}")
+            raise
+
+    def clear_history(self, user_id: str):
+        """Clear chat history for a user"""
+        self.flush_history(user_id)
+        self.context_cache.invalidate(user_id)
+        try:
+            self.store.clear(user_id)
+            if self.conversations is not None:
+                self.conversations.clear(user_id)
+            if self.search_index is not None:
+                self.search_index.clear(user_id)
         except Exception as e:
             print(f"Error clearing history: {e}")
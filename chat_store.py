@@ -0,0 +1,462 @@
+import json
+import os
+import re
+import hashlib
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock; fall back to in-process locking only
+    fcntl = None
+
+
+class _LogIndex:
+    """In-memory view of one user's log: byte offsets of the live entries"""
+
+    def __init__(self):
+        self.offsets = {}  # entry id -> byte offset of its "add" record (insertion ordered)
+        self.size = 0      # number of bytes of the log already scanned
+        self.inode = None
+        self.dead = 0      # records that compaction would drop
+        self.summary_offset = None  # byte offset of the latest "summary" record
+        self.dead_summaries = 0     # superseded summaries (large records, so counted apart)
+
+
+class ChatLogStore:
+    """Append-only, per-user chat history store.
+
+    Every user gets one JSONL file under ``log_dir``. Each chat turn is a
+    single appended ``add`` record, while ``delete`` and ``clear`` are
+    appended as tombstones, so a write costs one small append no matter how
+    large the history is. An offset index per user is built lazily and
+    caught up incrementally, which also picks up appends made by other
+    worker processes. Logs are compacted once enough tombstoned records
+    accumulate. With the default 'interval' fsync policy a log is synced at
+    most every ``fsync_interval`` seconds; writes in between are synced by a
+    background thread once the interval is up.
+    """
+
+    FSYNC_POLICIES = ('always', 'interval', 'never')
+    MIGRATION_MARKER = '.migrated'
+
+    def __init__(self, log_dir, fsync_policy='interval', fsync_interval=1.0,
+                 compact_min_dead=200, compact_dead_ratio=0.5):
+        if fsync_policy not in self.FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        self.log_dir = Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.compact_min_dead = compact_min_dead
+        self.compact_dead_ratio = compact_dead_ratio
+        self._indexes = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+        self._last_fsync = {}
+        self._unsynced = set()  # logs written since their last fsync ('interval' policy)
+        self._flusher = None
+        self._closed = threading.Event()
+
+    # ------------------------------------------------------------------
+    # Public API
+
+    def read(self, user_id: str, limit: int = None) -> list:
+        """Return the live entries of a user, oldest first (optionally only the last ``limit``)"""
+        with self._user_lock(user_id):
+            f, index = self._open_indexed(user_id)
+            if f is None:
+                return []
+            with f:
+                offsets = list(index.offsets.values())
+                if limit is not None:
+                    offsets = offsets[-limit:] if limit > 0 else []
+                entries = []
+                for offset in offsets:
+                    f.seek(offset)
+                    entries.append(self._to_entry(json.loads(f.readline())))
+            return entries
+
+    def count(self, user_id: str) -> int:
+        """Return the number of live entries of a user"""
+        with self._user_lock(user_id):
+            return len(self._refresh(user_id).offsets)
+
+    def version(self, user_id: str) -> tuple:
+        """Return an (inode, size) pair that changes whenever the user's log does"""
+        try:
+            stat = os.stat(self._log_path(user_id))
+        except FileNotFoundError:
+            return (None, 0)
+        return (stat.st_ino, stat.st_size)
+
+    def append(self, user_id: str, message: str, response: str, timestamp: str = None) -> dict:
+        """Append one chat turn and return the stored entry"""
+        return self.append_versioned(user_id, message, response, timestamp)[0]
+
+    def append_versioned(self, user_id: str, message: str, response: str, timestamp: str = None) -> tuple:
+        """Append one chat turn; returns (entry, version before, version after) of the write"""
+        record = {
+            "op": "add",
+            "id": uuid.uuid4().hex,
+            "timestamp": timestamp or datetime.now().isoformat(),
+            "message": message,
+            "response": response
+        }
+        with self._user_lock(user_id):
+            before, after = self._write(user_id, [record])
+            self._refresh(user_id)
+        return self._to_entry(record), before, after
+
+    def append_many(self, user_id: str, turns) -> list:
+        """Append several (message, response, timestamp) turns in one write; returns the stored entries"""
+        records = [{
+            "op": "add",
+            "id": uuid.uuid4().hex,
+            "timestamp": timestamp or datetime.now().isoformat(),
+            "message": message,
+            "response": response
+        } for message, response, timestamp in turns]
+        if not records:
+            return []
+        with self._user_lock(user_id):
+            self._write(user_id, records)
+            self._refresh(user_id)
+        return [self._to_entry(record) for record in records]
+
+    def read_summary(self, user_id: str):
+        """Return the latest rolling summary of a user as {"text", "upto"}, or None"""
+        with self._user_lock(user_id):
+            f, index = self._open_indexed(user_id)
+            if f is None:
+                return None
+            with f:
+                if index.summary_offset is None:
+                    return None
+                f.seek(index.summary_offset)
+                record = json.loads(f.readline())
+            return {"text": record["text"], "upto": record.get("upto")}
+
+    def write_summary(self, user_id: str, text: str, upto: str = None) -> tuple:
+        """Replace the rolling summary; ``upto`` is the id of the newest summarized entry.
+
+        Returns the log version before and after the write.
+        """
+        with self._user_lock(user_id):
+            before, after = self._write(user_id, [{"op": "summary", "text": text, "upto": upto}])
+            self._refresh(user_id)
+            self._maybe_compact(user_id)
+        return before, after
+
+    def delete(self, user_id: str, entry_id: str) -> bool:
+        """Tombstone one entry; returns False if it does not exist"""
+        with self._user_lock(user_id):
+            if entry_id not in self._refresh(user_id).offsets:
+                return False
+            self._write(user_id, [{"op": "delete", "id": entry_id}])
+            self._refresh(user_id)
+            self._maybe_compact(user_id)
+        return True
+
+    def delete_many(self, user_id: str, entry_ids) -> int:
+        """Tombstone several entries in one write; returns how many existed"""
+        with self._user_lock(user_id):
+            offsets = self._refresh(user_id).offsets
+            records = [{"op": "delete", "id": entry_id} for entry_id in entry_ids if entry_id in offsets]
+            if records:
+                self._write(user_id, records)
+                self._refresh(user_id)
+                self._maybe_compact(user_id)
+        return len(records)
+
+    def clear(self, user_id: str):
+        """Drop all entries of a user"""
+        with self._user_lock(user_id):
+            if not self._log_path(user_id).exists():
+                return
+            self._write(user_id, [{"op": "clear"}])
+            self._refresh(user_id)
+            self._maybe_compact(user_id)
+
+    def compact(self, user_id: str):
+        """Rewrite a user's log so that it only contains live entries"""
+        with self._user_lock(user_id):
+            self._compact(user_id)
+
+    def compact_all(self):
+        """Compact every log that has accumulated dead records"""
+        for user_id in self.user_ids():
+            with self._user_lock(user_id):
+                index = self._refresh(user_id)
+                if index.dead:
+                    self._compact(user_id)
+
+    def user_ids(self) -> list:
+        """Return the ids of all users that have a log"""
+        ids = []
+        for path in self.log_dir.glob('*.jsonl'):
+            try:
+                with open(path, 'rb') as f:
+                    header = json.loads(f.readline() or b'{}')
+            except (OSError, ValueError):
+                continue
+            user_id = header.get('user_id')
+            if user_id is not None:
+                ids.append(user_id)
+        return ids
+
+    def migrate_from_json(self, chats_file) -> int:
+        """One-shot import of the legacy chats.json layout; returns the number of users migrated"""
+        marker = self.log_dir / self.MIGRATION_MARKER
+        if marker.exists():
+            return 0
+
+        with open(self.log_dir / '.migration.lock', 'a+') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            if marker.exists():  # another worker finished the migration first
+                return 0
+
+            migrated = 0
+            chats = {}
+            try:
+                with open(chats_file, 'r') as f:
+                    chats = json.load(f).get("chats", {})
+            except (OSError, ValueError, AttributeError):
+                pass
+
+            if isinstance(chats, dict):
+                for user_id, entries in chats.items():
+                    user_id = str(user_id)
+                    if not entries or self._log_path(user_id).exists():
+                        continue
+                    records = [{
+                        "op": "add",
+                        "id": uuid.uuid4().hex,
+                        "timestamp": entry.get("timestamp") or datetime.now().isoformat(),
+                        "message": entry.get("message", ""),
+                        "response": entry.get("response", "")
+                    } for entry in entries]
+                    with self._user_lock(user_id):
+                        self._write(user_id, records, fsync=True)
+                    migrated += 1
+
+            marker.write_text(datetime.now().isoformat())
+            return migrated
+
+    def flush(self):
+        """fsync every log written since its last fsync (only the 'interval' policy defers them)"""
+        with self._guard:
+            paths, self._unsynced = self._unsynced, set()
+            now = time.monotonic()
+            for path in paths:
+                self._last_fsync[path] = now
+        for path in paths:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:  # cleared since
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def close(self):
+        """Sync outstanding writes and stop the flusher thread; later writes are synced at once"""
+        self._closed.set()
+        self.flush()
+
+    # ------------------------------------------------------------------
+    # Internals
+
+    def _user_lock(self, user_id):
+        with self._guard:
+            lock = self._locks.get(user_id)
+            if lock is None:
+                lock = self._locks[user_id] = threading.RLock()
+            return lock
+
+    def _log_path(self, user_id) -> Path:
+        user_id = str(user_id)
+        if re.fullmatch(r'[A-Za-z0-9-]{1,64}', user_id):
+            name = user_id
+        else:
+            name = '_' + hashlib.sha1(user_id.encode('utf-8')).hexdigest()
+        return self.log_dir / f'{name}.jsonl'
+
+    @staticmethod
+    def _encode(record) -> bytes:
+        return (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+
+    @staticmethod
+    def _to_entry(record) -> dict:
+        return {
+            "id": record["id"],
+            "timestamp": record["timestamp"],
+            "message": record["message"],
+            "response": record["response"]
+        }
+
+    def _open_locked(self, path):
+        """Open a log for appending, holding an exclusive flock on the current file"""
+        while True:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            if not fcntl:
+                return fd
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                # Compaction in another process may have replaced the file
+                # while we were waiting for the lock.
+                if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def _write(self, user_id, records, fsync=False):
+        """Append records under the file lock; returns the log version before and after"""
+        path = self._log_path(user_id)
+        fd = self._open_locked(path)
+        try:
+            stat = os.fstat(fd)
+            data = b''.join(self._encode(record) for record in records)
+            if stat.st_size == 0:
+                before = (None, 0)
+                data = self._encode({"op": "header", "user_id": str(user_id)}) + data
+            else:
+                before = (stat.st_ino, stat.st_size)
+            os.write(fd, data)
+            self._sync(path, fd, force=fsync)
+            return before, (stat.st_ino, stat.st_size + len(data))
+        finally:
+            os.close(fd)
+
+    def _sync(self, path, fd, force=False):
+        if self.fsync_policy == 'never' and not force:
+            return
+        now = time.monotonic()
+        with self._guard:
+            due = (force or self.fsync_policy == 'always' or self._closed.is_set()
+                   or now - self._last_fsync.get(path, 0) >= self.fsync_interval)
+            if due:
+                self._last_fsync[path] = now
+                self._unsynced.discard(path)
+            else:
+                # Synced by the flusher thread within fsync_interval, so the last write
+                # of a burst is not left in the page cache until the next write
+                self._unsynced.add(path)
+                if self._flusher is None or not self._flusher.is_alive():
+                    self._flusher = threading.Thread(target=self._flush_loop, name='chat-log-fsync',
+                                                     daemon=True)
+                    self._flusher.start()
+        if due:
+            os.fsync(fd)
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            self.flush()
+
+    def _open_indexed(self, user_id):
+        """Open a user's log for reading, with its index brought up to date.
+
+        Compaction in another process replaces the file, so an index refreshed
+        from the path may describe a newer file than the one opened; the two
+        are matched by inode and the log is reopened on a mismatch. Returns
+        (file, index), with file None when the user has no log.
+        """
+        path = self._log_path(user_id)
+        while True:
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                return None, self._refresh(user_id)
+            index = self._refresh(user_id)
+            if index.inode == os.fstat(f.fileno()).st_ino:
+                return f, index
+            f.close()
+
+    def _refresh(self, user_id) -> _LogIndex:
+        """Bring the offset index of a user up to date with the log on disk"""
+        path = self._log_path(user_id)
+        index = self._indexes.get(user_id)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            index = self._indexes[user_id] = _LogIndex()
+            return index
+
+        if index is None or index.inode != stat.st_ino or stat.st_size < index.size:
+            index = self._indexes[user_id] = _LogIndex()
+            index.inode = stat.st_ino
+        if stat.st_size == index.size:
+            return index
+
+        with open(path, 'rb') as f:
+            f.seek(index.size)
+            offset = index.size
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # a concurrent append is still in flight
+                self._apply(index, json.loads(line), offset)
+                offset += len(line)
+            index.size = offset
+        return index
+
+    @staticmethod
+    def _apply(index, record, offset):
+        op = record.get("op")
+        if op == "add":
+            index.offsets[record["id"]] = offset
+        elif op == "delete":
+            if index.offsets.pop(record["id"], None) is not None:
+                index.dead += 1
+            index.dead += 1
+        elif op == "clear":
+            index.dead += len(index.offsets) + 1
+            index.offsets.clear()
+            if index.summary_offset is not None:
+                index.summary_offset = None
+                index.dead += 1
+                index.dead_summaries += 1
+        elif op == "summary":
+            if index.summary_offset is not None:
+                index.dead += 1
+                index.dead_summaries += 1
+            index.summary_offset = offset
+
+    def _maybe_compact(self, user_id):
+        index = self._indexes.get(user_id)
+        if index is None or index.dead < self.compact_min_dead:
+            return
+        if (index.dead_summaries >= self.compact_min_dead
+                or index.dead >= (index.dead + len(index.offsets)) * self.compact_dead_ratio):
+            self._compact(user_id)
+
+    def _compact(self, user_id):
+        path = self._log_path(user_id)
+        if not path.exists():
+            return
+        fd = self._open_locked(path)
+        try:
+            # Re-index under the file lock so no append is lost
+            self._indexes.pop(user_id, None)
+            index = self._refresh(user_id)
+            tmp_path = path.with_suffix('.compact')
+            with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                dst.write(self._encode({"op": "header", "user_id": str(user_id)}))
+                live = list(index.offsets.values())
+                if index.summary_offset is not None:
+                    live.insert(0, index.summary_offset)
+                for offset in live:
+                    src.seek(offset)
+                    dst.write(src.readline())
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp_path, path)
+            self._indexes.pop(user_id, None)
+        finally:
+            os.close(fd)
+        self._refresh(user_id)
@@ -0,0 +1,68 @@
+import math
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: roughly four characters per token for English text"""
+    return math.ceil(len(text) / 4) if text else 0
+
+
+def clip_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to about ``max_tokens`` tokens, marking the cut with an ellipsis"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max(max_tokens * 4 - 3, 0)].rstrip() + '...'
+
+
+class ContextBuilder:
+    """Assembles prompt context under a fixed token budget.
+
+    The most recent turns are added newest first until the budget is used
+    up (the last one that does not fit is clipped), and turns that have left
+    the recent window survive as a rolling summary: one short line per turn,
+    with the oldest lines dropped once the summary exceeds its own budget.
+    """
+
+    SUMMARY_HEADER = "Summary of earlier conversation:"
+
+    def __init__(self, token_budget=2000, summary_budget=300, min_clip_tokens=50):
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.min_clip_tokens = min_clip_tokens
+
+    def build_prompt(self, message: str, turns: list, summary: str = None) -> str:
+        """Build the full prompt for ``message``, keeping context within the budget"""
+        question = f"User: {message}\nAssistant:"
+        context = self.build_context(turns, summary, self.token_budget - estimate_tokens(question))
+        return f"{context}\n{question}"
+
+    def build_context(self, turns: list, summary: str = None, budget: int = None) -> str:
+        """Render the summary and as many recent turns as fit in ``budget`` tokens"""
+        budget = self.token_budget if budget is None else budget
+        parts = []
+        if summary:
+            rendered = f"{self.SUMMARY_HEADER}\n{summary}"
+            budget -= estimate_tokens(rendered)
+            parts.append(rendered)
+
+        recent = []
+        for turn in reversed(turns):
+            rendered = f"User: {turn['message']}\nAssistant: {turn['response']}"
+            cost = estimate_tokens(rendered)
+            if cost > budget:
+                if budget >= self.min_clip_tokens:
+                    recent.append(clip_to_tokens(rendered, budget))
+                break
+            recent.append(rendered)
+            budget -= cost
+
+        parts.extend(reversed(recent))
+        return "\n".join(parts)
+
+    def fold_into_summary(self, summary: str, turn: dict) -> str:
+        """Add a turn that left the recent window to the rolling summary"""
+        line = (f"- User: {clip_to_tokens(' '.join(turn['message'].split()), 30)}"
+                f" / Assistant: {clip_to_tokens(' '.join(turn['response'].split()), 50)}")
+        lines = (summary.split('\n') if summary else []) + [line]
+        while len(lines) > 1 and estimate_tokens('\n'.join(lines)) > self.summary_budget:
+            lines.pop(0)
+        return '\n'.join(lines)
@@ -0,0 +1,165 @@
+import threading
+from collections import OrderedDict, deque
+
+
+class _Window:
+    """Tail window and rolling summary of one user (or thread), plus the log version they reflect"""
+
+    def __init__(self, entries, summary, version, size):
+        self.entries = entries
+        self.summary = summary
+        self.version = version
+        self.size = size
+
+
+class ContextCache:
+    """Bounded LRU cache of each active user's most recent chat turns.
+
+    Every cached user, or ``(user_id, thread_id)`` with threads, keeps a
+    ring buffer of the last ``window`` entries and the rolling summary. The
+    cache is kept up to date write-through by ChatManager and tagged with
+    the user's log version (see ``ChatLogStore.version``) it was built from,
+    so appends made by other workers are detected and the window reloaded.
+    Windows are evicted least-recently-used first once either ``max_users``
+    or the approximate ``max_bytes`` budget is exceeded.
+    """
+
+    ENTRY_OVERHEAD = 200  # rough per-entry cost of the dict, id and timestamp
+
+    def __init__(self, window=5, max_users=1024, max_bytes=16 * 1024 * 1024):
+        self.window = window
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self._windows = OrderedDict()
+        self._keys = {}  # user id -> cached keys of that user (the user id, or their threads)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version=None, limit: int = None):
+        """Return the cached (tail, summary) for a user or (user, thread) ``key``, or None on a miss or stale version"""
+        limit = self.window if limit is None else limit
+        with self._lock:
+            cached = self._windows.get(key)
+            if (cached is None or limit > self.window
+                    or (version is not None and cached.version != version)):
+                self.misses += 1
+                return None
+            self._windows.move_to_end(key)
+            self.hits += 1
+            entries = list(cached.entries)
+            return (entries[-limit:] if limit > 0 else []), cached.summary
+
+    def put(self, key, entries: list, summary, version):
+        """Cache the tail and summary of a freshly loaded history"""
+        ring = deque(entries[-self.window:], maxlen=self.window)
+        with self._lock:
+            self._discard(key)
+            self._store(key, _Window(ring, summary, version, self._size_of(ring, summary)))
+
+    def append(self, key, entry: dict, before, after):
+        """Write-through of one new turn; drops the window if it missed other writes.
+
+        The user's other windows (their other threads) that were current stay
+        current, as the turn is all that changed between ``before`` and ``after``.
+        Returns (cached, evicted): whether the window was cached and current,
+        and the entry pushed out of the full ring buffer, if any.
+        """
+        with self._lock:
+            for other in self._keys.get(self._user_of(key), ()):
+                if other != key and self._windows[other].version == before:
+                    self._windows[other].version = after
+            cached = self._windows.get(key)
+            if cached is None:
+                return False, None
+            if cached.version != before:
+                self._discard(key)
+                return False, None
+            evicted = None
+            delta = self._size_of([entry])
+            if len(cached.entries) == self.window:
+                evicted = cached.entries[0]
+                delta -= self._size_of([evicted])
+            cached.entries.append(entry)
+            cached.size += delta
+            self._bytes += delta
+            cached.version = after
+            self._windows.move_to_end(key)
+            self._evict()
+            return True, evicted
+
+    def set_summary(self, key, summary, before, after):
+        """Write-through of a new rolling summary"""
+        with self._lock:
+            cached = self._windows.get(key)
+            if cached is None:
+                return
+            if cached.version != before:
+                self._discard(key)
+                return
+            delta = self._size_of([], summary) - self._size_of([], cached.summary)
+            cached.summary = summary
+            cached.size += delta
+            self._bytes += delta
+            cached.version = after
+            self._evict()
+
+    def invalidate(self, user_id: str):
+        """Forget a user's windows, those of their threads included, e.g. after their history was cleared"""
+        with self._lock:
+            for key in list(self._keys.get(user_id, ())):
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._windows.clear()
+            self._keys.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._windows),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def _size_of(self, entries, summary=None) -> int:
+        size = len(summary["text"]) if summary else 0
+        return size + sum(len(e.get("message") or "") + len(e.get("response") or "") + self.ENTRY_OVERHEAD
+                          for e in entries)
+
+    @staticmethod
+    def _user_of(key):
+        return key[0] if isinstance(key, tuple) else key
+
+    def _discard(self, key):
+        cached = self._windows.pop(key, None)
+        if cached is not None:
+            self._bytes -= cached.size
+            self._forget_key(key)
+
+    def _store(self, key, cached):
+        self._windows[key] = cached
+        self._keys.setdefault(self._user_of(key), set()).add(key)
+        self._bytes += cached.size
+        self._evict()
+
+    def _forget_key(self, key):
+        user_id = self._user_of(key)
+        keys = self._keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys[user_id]
+
+    def _evict(self):
+        while self._windows and (len(self._windows) > self.max_users or self._bytes > self.max_bytes):
+            key, cached = self._windows.popitem(last=False)
+            self._bytes -= cached.size
+            self._forget_key(key)
+            self.evictions += 1
@@ -0,0 +1,475 @@
+import base64
+import json
+import threading
+from datetime import datetime
+
+from sqlalchemy import and_, delete, event, inspect, or_, select, text, tuple_
+
+from models import db, Chat, Message, ThreadSummary
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock; fall back to in-process locking only
+    fcntl = None
+
+DEFAULT_TITLE = "New Chat"
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    """Raised for a pagination cursor that was not issued by this store"""
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat(), row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+
+
+def _enable_sqlite_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+class ConversationStore:
+    """Chat threads and their messages in the database described by models.py.
+
+    Every user can have many threads (``Chat`` rows); each chat turn is
+    stored as two ``Message`` rows, the user's message and the reply. Both
+    lists are read a page at a time with keyset cursors over the
+    (user_id, ..., timestamp, id) indexes, so a page costs one indexed
+    query no matter how long the history is. Each call runs in its own app
+    context, which keeps the store usable from worker threads.
+    """
+
+    MIGRATION_MARKER = '.conversations-migrated'
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+        with app.app_context():
+            if db.engine.dialect.name == 'sqlite':
+                # Readers don't block the writer; several workers share one file
+                event.listen(db.engine, 'connect', _enable_sqlite_wal)
+            db.create_all()
+            self._upgrade_schema()
+
+    # ------------------------------------------------------------------
+    # Threads
+
+    def create_thread(self, user_id: str, title: str = None, created_at: str = None, active: bool = True) -> dict:
+        """Start a thread; ``active=False`` (imports) keeps it from becoming the one turns without a thread go to"""
+        with self.app.app_context():
+            now = datetime.fromisoformat(created_at) if created_at else datetime.now()
+            thread = Chat(user_id=str(user_id), title=(title or DEFAULT_TITLE)[:200],
+                          created_at=now, updated_at=now, last_active_at=datetime.now() if active else None)
+            db.session.add(thread)
+            db.session.commit()
+            return thread.to_dict()
+
+    def find_thread(self, user_id: str, title: str, created_at: str = None) -> dict:
+        """The user's latest thread with this title (and creation time, if given), e.g. from an earlier import"""
+        query = select(Chat).where(Chat.user_id == str(user_id), Chat.title == (title or DEFAULT_TITLE)[:200])
+        if created_at:
+            query = query.where(Chat.created_at == datetime.fromisoformat(created_at))
+        with self.app.app_context():
+            thread = db.session.scalars(query.order_by(Chat.id.desc()).limit(1)).first()
+            return thread.to_dict() if thread is not None else None
+
+    def get_thread(self, user_id: str, thread_id) -> dict:
+        """The thread, if it exists and belongs to ``user_id``"""
+        with self.app.app_context():
+            thread = self._owned_thread(user_id, thread_id)
+            return thread.to_dict() if thread is not None else None
+
+    def list_threads(self, user_id: str, cursor: str = None, limit: int = 20) -> tuple:
+        """One page of threads, most recently updated first; returns (threads, next cursor)"""
+        limit = self._page_size(limit)
+        query = select(Chat).where(Chat.user_id == str(user_id))
+        if cursor:
+            updated_at, thread_id = decode_cursor(cursor)
+            query = query.where(or_(Chat.updated_at < updated_at,
+                                    and_(Chat.updated_at == updated_at, Chat.id < thread_id)))
+        query = query.order_by(Chat.updated_at.desc(), Chat.id.desc()).limit(limit + 1)
+
+        with self.app.app_context():
+            threads = db.session.scalars(query).all()
+            next_cursor = None
+            if len(threads) > limit:
+                threads = threads[:limit]
+                next_cursor = encode_cursor(threads[-1].updated_at, threads[-1].id)
+            return [thread.to_dict() for thread in threads], next_cursor
+
+    def rename_thread(self, user_id: str, thread_id, title: str) -> dict:
+        with self.app.app_context():
+            thread = self._owned_thread(user_id, thread_id)
+            if thread is None:
+                return None
+            thread.title = title[:200]
+            db.session.commit()
+            return thread.to_dict()
+
+    def delete_thread(self, user_id: str, thread_id) -> list:
+        """Delete a thread with its messages and summary; returns the ids of its turns, or None for an unknown thread"""
+        with self.app.app_context():
+            thread = self._owned_thread(user_id, thread_id)
+            if thread is None:
+                return None
+            turn_ids = db.session.scalars(
+                select(Message.turn_id).where(Message.user_id == thread.user_id, Message.chat_id == thread.id,
+                                              Message.turn_id.is_not(None)).distinct()).all()
+            db.session.execute(delete(Message).where(Message.user_id == thread.user_id,
+                                                     Message.chat_id == thread.id))
+            db.session.execute(delete(ThreadSummary).where(ThreadSummary.chat_id == thread.id))
+            db.session.delete(thread)
+            db.session.commit()
+            return turn_ids
+
+    # ------------------------------------------------------------------
+    # Prompt context
+
+    def recent_context(self, user_id: str, thread_id=None, limit: int = 5) -> tuple:
+        """The last ``limit`` turns of a thread, oldest first, and its rolling summary as {"text", "upto"}.
+
+        Without ``thread_id`` this is the user's most recently active
+        thread, the one a turn without a thread is filed in. Returns
+        ([], None) when there is no such thread yet.
+        """
+        with self.app.app_context():
+            thread = (self._owned_thread(user_id, thread_id) if thread_id is not None
+                      else self._latest_thread(str(user_id)))
+            if thread is None or limit <= 0:
+                return [], None
+            # Two messages per turn, newest first through the (user_id, chat_id, timestamp, id) index
+            rows = db.session.scalars(
+                select(Message).where(Message.user_id == thread.user_id, Message.chat_id == thread.id)
+                .order_by(Message.timestamp.desc(), Message.id.desc()).limit(2 * limit)).all()
+            summary = db.session.get(ThreadSummary, thread.id)
+            return (self._rows_to_turns(reversed(rows))[-limit:],
+                    {"text": summary.text, "upto": summary.upto} if summary else None)
+
+    def latest_thread_id(self, user_id: str):
+        """Id of the thread a turn without a thread goes to, or None before the user's first turn"""
+        with self.app.app_context():
+            thread = self._latest_thread(str(user_id))
+            return thread.id if thread is not None else None
+
+    def update_summary(self, user_id: str, thread_id, window: int, fold):
+        """Fold the turns of a thread that have left its last ``window`` turns into its rolling summary.
+
+        ``fold(text, turn)`` returns the summary with ``turn`` added. Only
+        turns newer than the summary are read, so this is normally one
+        indexed query that finds nothing. Returns the new summary as
+        {"text", "upto"}, or None when nothing was folded.
+        """
+        with self.app.app_context():
+            thread = self._owned_thread(user_id, thread_id)
+            if thread is None:
+                return None
+            summary = db.session.get(ThreadSummary, thread.id)
+            query = select(Message).where(Message.user_id == thread.user_id, Message.chat_id == thread.id,
+                                          Message.is_user.is_(False))
+            if summary is not None and summary.upto_at is not None:
+                query = query.where(tuple_(Message.timestamp, Message.id) >
+                                    tuple_(summary.upto_at, summary.upto_message_id))
+            replies = db.session.scalars(
+                query.order_by(Message.timestamp.desc(), Message.id.desc()).offset(window)).all()
+            if not replies:
+                return None
+            replies.reverse()
+            messages = {row.turn_id: row.content for row in db.session.scalars(select(Message).where(
+                Message.user_id == thread.user_id, Message.chat_id == thread.id, Message.is_user.is_(True),
+                Message.turn_id.in_([reply.turn_id for reply in replies])))}
+
+            if summary is None:
+                summary = ThreadSummary(chat_id=thread.id, user_id=thread.user_id, text='')
+                db.session.add(summary)
+            text = summary.text
+            for reply in replies:
+                text = fold(text, {"id": reply.turn_id, "timestamp": reply.timestamp.isoformat(),
+                                   "message": messages.get(reply.turn_id, ''), "response": reply.content})
+            summary.text = text
+            summary.upto = replies[-1].turn_id
+            summary.upto_at, summary.upto_message_id = replies[-1].timestamp, replies[-1].id
+            db.session.commit()
+            return {"text": summary.text, "upto": summary.upto}
+
+    # ------------------------------------------------------------------
+    # Messages
+
+    def list_messages(self, user_id: str, thread_id, cursor: str = None, limit: int = 50) -> tuple:
+        """One page of a thread's messages; returns (messages, next cursor) or None for an unknown thread.
+
+        Pages walk backwards from the newest message and the cursor points
+        at older ones, while the messages within a page are oldest first,
+        ready to be prepended to what the client already shows.
+        """
+        limit = self._page_size(limit)
+        with self.app.app_context():
+            thread = self._owned_thread(user_id, thread_id)
+            if thread is None:
+                return None
+            query = select(Message).where(Message.user_id == thread.user_id, Message.chat_id == thread.id)
+            if cursor:
+                timestamp, message_id = decode_cursor(cursor)
+                query = query.where(or_(Message.timestamp < timestamp,
+                                        and_(Message.timestamp == timestamp, Message.id < message_id)))
+            query = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1)
+
+            messages = db.session.scalars(query).all()
+            next_cursor = None
+            if len(messages) > limit:
+                messages = messages[:limit]
+                next_cursor = encode_cursor(messages[-1].timestamp, messages[-1].id)
+            return [message.to_dict() for message in reversed(messages)], next_cursor
+
+    def add_turn(self, user_id: str, message: str, response: str, thread_id=None,
+                 turn_id: str = None, timestamp: str = None) -> dict:
+        """Store one chat turn and return its thread.
+
+        Without ``thread_id`` the turn goes to the user's most recently
+        active thread (never an imported one the user hasn't chatted in),
+        which is created on first use. A thread still
+        carrying the default title is named after its first message.
+        """
+        with self.app.app_context():
+            if thread_id is not None and self._owned_thread(user_id, thread_id) is None:
+                raise LookupError("Thread not found")
+            thread = self._file_turn(str(user_id), message, response, thread_id, turn_id, timestamp)
+            db.session.commit()
+            return thread.to_dict()
+
+    def add_turn_batch(self, turns) -> set:
+        """Store (user_id, message, response, thread_id, turn_id, timestamp) turns with a single commit.
+
+        A turn whose thread was deleted in the meantime goes to the user's
+        most recent thread instead, as the turn itself is already in the log.
+        Returns the (user_id, thread_id) pairs that received turns.
+        """
+        threads = set()
+        with self.app.app_context():
+            for user_id, message, response, thread_id, turn_id, timestamp in turns:
+                if thread_id is not None and self._owned_thread(user_id, thread_id) is None:
+                    thread_id = None
+                thread = self._file_turn(str(user_id), message, response, thread_id, turn_id, timestamp)
+                threads.add((str(user_id), thread.id))
+            db.session.commit()
+        return threads
+
+    def add_turns(self, user_id: str, thread_id, entries):
+        """Store chat log entries (imported turns) in an existing thread with a single commit.
+
+        The thread's activity is left alone: imported turns, however recent,
+        don't make it the thread new turns without a thread go to.
+        """
+        user_id = str(user_id)
+        with self.app.app_context():
+            thread = self._owned_thread(user_id, thread_id)
+            if thread is None:
+                raise LookupError("Thread not found")
+            for entry in entries:
+                when = datetime.fromisoformat(entry['timestamp'])
+                thread.updated_at = max(thread.updated_at, when)
+                db.session.add_all(self._turn_messages(user_id, thread.id, entry['id'],
+                                                       entry['message'], entry['response'], when))
+            db.session.commit()
+
+    def existing_turns(self, user_id: str, thread_id, timestamps) -> set:
+        """(timestamp, message) of the thread's turns at any of ``timestamps``, to skip re-imported turns"""
+        when = {datetime.fromisoformat(timestamp) for timestamp in timestamps}
+        if not when:
+            return set()
+        with self.app.app_context():
+            rows = db.session.execute(
+                select(Message.timestamp, Message.content).where(
+                    Message.user_id == str(user_id), Message.chat_id == int(thread_id),
+                    Message.is_user.is_(True), Message.timestamp.in_(when))).all()
+            return {(timestamp.isoformat(), content) for timestamp, content in rows}
+
+    def iter_turns(self, user_id: str = None, batch_size: int = 500):
+        """Yield ("thread", dict) and ("turn", dict) records for export, a thread before its turns.
+
+        Covers one user, or everyone when ``user_id`` is None. Rows are read
+        in keyset-paged batches, each in a short transaction of its own, so
+        memory stays flat however much history there is.
+        """
+        order = (Message.user_id, Message.chat_id, Message.timestamp, Message.id)
+        last = None
+        current_thread = None
+        pending = None  # user message waiting for its reply
+        while True:
+            query = select(Message)
+            if user_id is not None:
+                query = query.where(Message.user_id == str(user_id))
+            if last is not None:
+                query = query.where(tuple_(*order) > tuple_(*last))
+            query = query.order_by(*order).limit(batch_size)
+
+            with self.app.app_context():
+                rows = db.session.scalars(query).all()
+                if not rows:
+                    break
+                last = (rows[-1].user_id, rows[-1].chat_id, rows[-1].timestamp, rows[-1].id)
+                thread_ids = {row.chat_id for row in rows}
+                threads = {thread.id: thread.to_dict() for thread in
+                           db.session.scalars(select(Chat).where(Chat.id.in_(thread_ids)))}
+                rows = [(row.user_id, row.chat_id, row.to_dict(), row.turn_id) for row in rows]
+
+            for owner, thread_id, message, turn_id in rows:
+                if thread_id != current_thread:
+                    current_thread, pending = thread_id, None
+                    yield "thread", dict(threads[thread_id], user_id=owner)
+                if message['is_user']:
+                    pending = message
+                    continue
+                yield "turn", {
+                    "user_id": owner,
+                    "thread_id": thread_id,
+                    "id": turn_id,
+                    "timestamp": message['timestamp'],
+                    "message": pending['content'] if pending else '',
+                    "response": message['content']
+                }
+                pending = None
+
+    def delete_turn(self, user_id: str, turn_id: str) -> bool:
+        """Delete both messages of a chat turn, by the id it has in the chat log"""
+        with self.app.app_context():
+            result = db.session.execute(delete(Message).where(Message.user_id == str(user_id),
+                                                              Message.turn_id == turn_id))
+            db.session.commit()
+            return result.rowcount > 0
+
+    def clear(self, user_id: str):
+        """Drop every thread and message of a user"""
+        with self.app.app_context():
+            db.session.execute(delete(Message).where(Message.user_id == str(user_id)))
+            db.session.execute(delete(ThreadSummary).where(ThreadSummary.user_id == str(user_id)))
+            db.session.execute(delete(Chat).where(Chat.user_id == str(user_id)))
+            db.session.commit()
+
+    # ------------------------------------------------------------------
+    # Migration
+
+    def migrate_from_log(self, log_store, marker_dir) -> int:
+        """One-shot import of the existing chat logs, one thread per user; returns the number of users migrated"""
+        marker = marker_dir / self.MIGRATION_MARKER
+        if marker.exists():
+            return 0
+
+        with self._lock, open(marker_dir / '.conversations-migration.lock', 'a+') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            if marker.exists():  # another worker finished the migration first
+                return 0
+
+            migrated = 0
+            with self.app.app_context():
+                for user_id in log_store.user_ids():
+                    user_id = str(user_id)
+                    entries = log_store.read(user_id)
+                    has_threads = db.session.scalars(
+                        select(Chat.id).where(Chat.user_id == user_id).limit(1)).first()
+                    if not entries or has_threads is not None:
+                        continue
+                    first = datetime.fromisoformat(entries[0]['timestamp'])
+                    last = datetime.fromisoformat(entries[-1]['timestamp'])
+                    thread = Chat(user_id=user_id, title="Earlier conversation", created_at=first, updated_at=last,
+                                  last_active_at=last)
+                    db.session.add(thread)
+                    db.session.flush()
+                    for entry in entries:
+                        db.session.add_all(self._turn_messages(
+                            user_id, thread.id, entry['id'], entry.get('message', ''),
+                            entry.get('response', ''), datetime.fromisoformat(entry['timestamp'])))
+                    db.session.commit()
+                    migrated += 1
+
+            marker.write_text(datetime.now().isoformat())
+            return migrated
+
+    # ------------------------------------------------------------------
+    # Internals
+
+    def _file_turn(self, user_id, message, response, thread_id, turn_id, timestamp):
+        when = datetime.fromisoformat(timestamp) if timestamp else datetime.now()
+        if thread_id is not None:
+            thread = self._owned_thread(user_id, thread_id)
+        else:
+            thread = self._latest_thread(user_id)
+            if thread is None:
+                thread = Chat(user_id=user_id, title=DEFAULT_TITLE, created_at=when, updated_at=when)
+                db.session.add(thread)
+                db.session.flush()
+
+        if thread.title == DEFAULT_TITLE and message:
+            thread.title = message.strip()[:50] or DEFAULT_TITLE
+        thread.updated_at = max(thread.updated_at, when)
+        thread.last_active_at = max(thread.last_active_at or when, when)
+        db.session.add_all(self._turn_messages(user_id, thread.id, turn_id, message, response, when))
+        return thread
+
+    @staticmethod
+    def _latest_thread(user_id):
+        """The thread the user last chatted in; imported threads only count once chatted in"""
+        return db.session.scalars(
+            select(Chat).where(Chat.user_id == user_id, Chat.last_active_at.is_not(None))
+            .order_by(Chat.last_active_at.desc(), Chat.id.desc()).limit(1)
+        ).first()
+
+    @staticmethod
+    def _upgrade_schema():
+        """Add columns introduced after a database was created (create_all only adds tables)"""
+        columns = {column['name'] for column in inspect(db.engine).get_columns('chat')}
+        if 'last_active_at' not in columns:
+            with db.engine.begin() as connection:
+                connection.execute(text('ALTER TABLE chat ADD COLUMN last_active_at DATETIME'))
+                # Which old threads were imported is not recorded; treat them all as chatted in
+                connection.execute(text('UPDATE chat SET last_active_at = updated_at'))
+                connection.execute(text('CREATE INDEX IF NOT EXISTS ix_chat_user_active '
+                                        'ON chat (user_id, last_active_at, id)'))
+
+    @staticmethod
+    def _rows_to_turns(rows) -> list:
+        """Pair message rows, in thread order, into chat log style turns"""
+        turns = []
+        for row in rows:
+            if not turns or turns[-1]["id"] != row.turn_id:
+                turns.append({"id": row.turn_id, "timestamp": row.timestamp.isoformat(),
+                              "message": "", "response": ""})
+            turns[-1]["message" if row.is_user else "response"] = row.content
+        return turns
+
+    @staticmethod
+    def _turn_messages(user_id, thread_id, turn_id, message, response, when):
+        return [
+            Message(user_id=user_id, chat_id=thread_id, turn_id=turn_id, content=message,
+                    is_user=True, timestamp=when),
+            Message(user_id=user_id, chat_id=thread_id, turn_id=turn_id, content=response,
+                    is_user=False, timestamp=when),
+        ]
+
+    @staticmethod
+    def _owned_thread(user_id, thread_id):
+        try:
+            thread = db.session.get(Chat, int(thread_id))
+        except (TypeError, ValueError):
+            return None
+        return thread if thread is not None and thread.user_id == str(user_id) else None
+
+    @staticmethod
+    def _page_size(limit) -> int:
+        try:
+            return min(max(int(limit), 1), MAX_PAGE_SIZE)
+        except (TypeError, ValueError):
+            return 20
@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Overridable so the app can be pointed at a local stand-in (e.g. for benchmarks);
+# the stand-in is spoken to over the REST transport
+GEMINI_API_ENDPOINT = os.environ.get('GEMINI_API_ENDPOINT')
+
+
+def _unsupported(genai):
+    return (f"google-generativeai {getattr(genai, '__version__', '(unknown version)')} is not supported: "
+            "per-key Gemini clients rely on its private _ClientManager and GenerativeModel._client / "
+            "_async_client; install the 0.8 series (pip install 'google-generativeai>=0.8,<0.9')")
+
+
+class _PooledModel:
+    def __init__(self, model, manager):
+        self.model = model
+        self.manager = manager
+        self.last_used = time.monotonic()
+
+
+class _ThreadedAsyncModel:
+    """``generate_content_async`` for a model on the REST transport, which has no
+    async client: the sync call, and each chunk of a streamed reply, is run in
+    a worker thread instead. Everything else is the wrapped model's."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    async def generate_content_async(self, *args, stream=False, **kwargs):
+        response = await asyncio.to_thread(self.model.generate_content, *args, stream=stream, **kwargs)
+        return _iterate_in_thread(response) if stream else response
+
+
+async def _iterate_in_thread(iterable):
+    chunks = iter(iterable)
+    done = object()
+    while (chunk := await asyncio.to_thread(next, chunks, done)) is not done:
+        yield chunk
+
+
+class GeminiClientPool:
+    """Configured GenerativeModel clients, one per (API key hash, model name).
+
+    ``genai.configure`` mutates process-wide state, so two users with
+    different keys racing through it can end up calling Gemini with each
+    other's key. Instead every pooled model gets its own client manager
+    configured with its own key, and is reused across messages until it is
+    evicted (least recently used beyond ``max_clients``) or has been idle
+    for ``idle_ttl`` seconds. Raw keys are never kept as pool keys.
+
+    Binding a model to a client manager uses private parts of
+    google-generativeai, hence its pin to 0.8.x in requirements.txt;
+    another version without them fails on the first client with a
+    RuntimeError saying so.
+    """
+
+    def __init__(self, max_clients=256, idle_ttl=600.0):
+        self.max_clients = max_clients
+        self.idle_ttl = idle_ttl
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(api_key, model_name):
+        return (hashlib.sha256(api_key.encode('utf-8')).hexdigest(), model_name)
+
+    def get(self, api_key: str, model_name: str):
+        """Get the GenerativeModel bound to ``api_key``"""
+        return self._get(api_key, model_name).model
+
+    def get_async(self, api_key: str, model_name: str):
+        """Get the GenerativeModel bound to ``api_key`` for ``*_async`` calls.
+
+        Must be called from the event loop that will use the model, as the
+        async transport binds to it. With ``GEMINI_API_ENDPOINT`` (REST, which
+        has no async transport) the sync client runs in worker threads.
+        """
+        pooled = self._get(api_key, model_name)
+        if GEMINI_API_ENDPOINT:
+            return _ThreadedAsyncModel(pooled.model)
+        if pooled.model._async_client is None:
+            pooled.model._async_client = pooled.manager.get_default_client('generative_async')
+        return pooled.model
+
+    def _get(self, api_key, model_name):
+        if not api_key:
+            raise ValueError("API key is required")
+        key = self._key(api_key, model_name)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            pooled = self._clients.get(key)
+            if pooled is not None:
+                self._clients.move_to_end(key)
+                pooled.last_used = now
+                self.hits += 1
+                return pooled
+            self.misses += 1
+
+        # google.generativeai takes about a second to import, so it is loaded with the first client
+        import google.generativeai as genai
+        try:
+            from google.generativeai.client import _ClientManager
+        except ImportError:
+            raise RuntimeError(_unsupported(genai)) from None
+
+        manager = _ClientManager()
+        if GEMINI_API_ENDPOINT:
+            manager.configure(api_key=api_key, transport='rest',
+                              client_options={'api_endpoint': GEMINI_API_ENDPOINT})
+        else:
+            manager.configure(api_key=api_key)
+        model = genai.GenerativeModel(model_name)
+        if not (hasattr(model, '_client') and hasattr(model, '_async_client')):
+            raise RuntimeError(_unsupported(genai))
+        model._client = manager.get_default_client('generative')
+        pooled = _PooledModel(model, manager)
+
+        with self._lock:
+            # Another thread may have created the same client meanwhile; keep the first
+            existing = self._clients.get(key)
+            if existing is not None:
+                return existing
+            self._clients[key] = pooled
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+            return pooled
+
+    def _expire(self, now):
+        while self._clients:
+            key, pooled = next(iter(self._clients.items()))
+            if now - pooled.last_used < self.idle_ttl:
+                break
+            del self._clients[key]
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,217 @@
+import gzip
+import io
+import json
+import zlib
+from datetime import datetime
+
+FORMAT_VERSION = 1
+CHUNK_BYTES = 64 * 1024
+IMPORTED_TITLE = "Imported chat"  # thread for imported turns that name no thread
+
+
+def export_chunks(conversations, user_id=None, include_user=False, batch_size=500):
+    """Yield a history dump as NDJSON, in chunks of about CHUNK_BYTES.
+
+    The first line is an {"type": "export"} header, then every thread
+    that has turns is followed by its turns, oldest first. Admin-wide
+    dumps (``include_user``) carry the owner's ``user_id`` on each record.
+    """
+    header = {"type": "export", "version": FORMAT_VERSION, "exported_at": datetime.now().isoformat()}
+    buffer = [json.dumps(header) + '\n']
+    size = len(buffer[0])
+    for kind, record in conversations.iter_turns(user_id, batch_size=batch_size):
+        record = dict(type=kind, **record)
+        if not include_user:
+            record.pop('user_id', None)
+        line = json.dumps(record) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_BYTES:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def gzip_chunks(chunks):
+    """Gzip a stream of byte chunks on the fly"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _RawReader(io.RawIOBase):
+    """Adapts any object with read() so it can be buffered (and peeked at)"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def open_dump(stream):
+    """A line-readable view of an uploaded dump, gunzipped if it starts with the gzip magic"""
+    buffered = io.BufferedReader(_RawReader(stream), CHUNK_BYTES)
+    if buffered.peek(2)[:2] == b'\x1f\x8b':
+        return gzip.GzipFile(fileobj=buffered)
+    return buffered
+
+
+def _parse_timestamp(value) -> str:
+    when = datetime.fromisoformat(value)
+    if when.tzinfo is not None:
+        when = when.astimezone().replace(tzinfo=None)  # the stores keep naive local time
+    return when.isoformat()
+
+
+class HistoryImporter:
+    """Streams an NDJSON dump (as written by export_chunks) into a ChatManager's stores.
+
+    Lines are read and validated one at a time; turns are written to the
+    chat log and the conversation store in batches of ``batch_size``, so
+    memory stays flat whatever the size of the dump. Invalid lines are
+    skipped and reported (up to ``max_errors``). With a ``user_id`` every
+    record is imported for that user; without one (admin-wide dumps) each
+    record must name an existing user, checked with ``user_exists``.
+    """
+
+    def __init__(self, chat_manager, user_id=None, user_exists=None, batch_size=500,
+                 max_line_bytes=4 * 1024 * 1024, max_errors=100):
+        self.chat_manager = chat_manager
+        self.conversations = chat_manager.conversations
+        self.user_id = str(user_id) if user_id is not None else None
+        self.user_exists = user_exists
+        self.batch_size = batch_size
+        self.max_line_bytes = max_line_bytes
+        self.max_errors = max_errors
+        self._threads = {}     # (user id, thread id in the dump) -> thread id here
+        self._defaults = {}    # user id -> thread for turns that name no thread
+        self._known_users = {}
+        self._batch_key = None
+        self._batch = []
+        self.result = {"threads": 0, "turns": 0, "duplicates": 0, "skipped": 0, "errors": []}
+
+    def run(self, stream) -> dict:
+        """Import every line of ``stream``; returns counts and the first errors"""
+        dump = open_dump(stream)
+        line_number = 0
+        while True:
+            line = dump.readline(self.max_line_bytes + 1)
+            if not line:
+                break
+            line_number += 1
+            if len(line) > self.max_line_bytes and not line.endswith(b'\n'):
+                while line and not line.endswith(b'\n'):  # drop the rest of the line
+                    line = dump.readline(CHUNK_BYTES)
+                self._error(line_number, "line too long")
+                continue
+            if not line.strip():
+                continue
+            try:
+                self._import(json.loads(line))
+            except (ValueError, TypeError, KeyError) as e:
+                self._error(line_number, str(e))
+        self._flush()
+        return self.result
+
+    def _import(self, record):
+        if not isinstance(record, dict):
+            raise ValueError("expected a JSON object")
+        kind = record.get('type')
+        if kind == 'export':
+            if record.get('version') != FORMAT_VERSION:
+                raise ValueError(f"unsupported export version {record.get('version')!r}")
+            return
+        if kind not in ('thread', 'turn'):
+            raise ValueError(f"unknown record type {kind!r}")
+
+        user_id = self._owner(record)
+        if kind == 'thread':
+            title = record.get('title')
+            if title is not None and not isinstance(title, str):
+                raise ValueError("title must be a string")
+            created_at = _parse_timestamp(record['created_at']) if record.get('created_at') else None
+            self._flush()
+            # A thread imported before (same title and creation time) is filled in again, not duplicated
+            thread = self.conversations.find_thread(user_id, title, created_at) if created_at else None
+            if thread is None:
+                thread = self.conversations.create_thread(user_id, title, created_at, active=False)
+                self.result["threads"] += 1
+            self._threads[(user_id, record.get('id'))] = thread['id']
+            return
+
+        message, response = record.get('message'), record.get('response')
+        if not isinstance(message, str) or not isinstance(response, str):
+            raise ValueError("message and response must be strings")
+        timestamp = _parse_timestamp(record['timestamp']) if record.get('timestamp') else None
+        if record.get('thread_id') is not None:
+            thread_id = self._threads.get((user_id, record['thread_id']))
+            if thread_id is None:
+                raise ValueError(f"turn refers to unknown thread {record['thread_id']!r}")
+        else:
+            thread_id = self._default_thread(user_id)
+
+        if self._batch_key != (user_id, thread_id) or len(self._batch) >= self.batch_size:
+            self._flush()
+            self._batch_key = (user_id, thread_id)
+        self._batch.append((message, response, timestamp))
+
+    def _owner(self, record) -> str:
+        if self.user_id is not None:
+            return self.user_id
+        user_id = record.get('user_id')
+        if user_id is None:
+            raise ValueError("user_id is required in admin imports")
+        user_id = str(user_id)
+        if user_id not in self._known_users:
+            self._known_users[user_id] = self.user_exists is None or bool(self.user_exists(user_id))
+        if not self._known_users[user_id]:
+            raise ValueError(f"unknown user {user_id!r}")
+        return user_id
+
+    def _default_thread(self, user_id):
+        if user_id not in self._defaults:
+            self._flush()
+            thread = self.conversations.find_thread(user_id, IMPORTED_TITLE)
+            if thread is None:
+                thread = self.conversations.create_thread(user_id, IMPORTED_TITLE, active=False)
+                self.result["threads"] += 1
+            self._defaults[user_id] = thread['id']
+        return self._defaults[user_id]
+
+    def _flush(self):
+        # The chat log is append-only, so imported turns land after the existing ones whatever
+        # their timestamps. Prompt context doesn't follow the log's order: it comes from the
+        # turn's own thread in the conversation store, ordered by timestamp, and imported turns
+        # go to threads that only take new turns once the user chats in them
+        if not self._batch:
+            return
+        user_id, thread_id = self._batch_key
+        # Turns already in the thread (same time and message) are skipped, so a dump can be re-imported
+        existing = self.conversations.existing_turns(
+            user_id, thread_id, [timestamp for _, _, timestamp in self._batch if timestamp])
+        batch = [turn for turn in self._batch if (turn[2], turn[0]) not in existing]
+        self.result["duplicates"] += len(self._batch) - len(batch)
+        self._batch = []
+        if not batch:
+            return
+        entries = self.chat_manager.store.append_many(user_id, batch)
+        self.conversations.add_turns(user_id, thread_id, entries)
+        if self.chat_manager.search_index is not None:
+            self.chat_manager.search_index.add_many(user_id, entries)
+        self.chat_manager.context_cache.invalidate(user_id)
+        self.result["turns"] += len(entries)
+
+    def _error(self, line_number, message):
+        self.result["skipped"] += 1
+        if len(self.result["errors"]) < self.max_errors:
+            self.result["errors"].append(f"line {line_number}: {message}")
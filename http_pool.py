@@ -0,0 +1,59 @@
+import os
+import threading
+
+POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 20))
+MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+# (connect, read) timeouts in seconds, as accepted by requests
+DEFAULT_TIMEOUT = (
+    float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5)),
+    float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def build_session(pool_size=POOL_SIZE, max_retries=MAX_RETRIES, backoff_factor=1.0, backoff_jitter=1.0):
+    """Create a keep-alive session with a connection pool and jittered retries.
+
+    Connection failures and 503 "model loading" responses are retried with
+    exponential backoff (honouring Retry-After); read timeouts are not, so a
+    slow upstream never costs more than one read timeout. Once retries are
+    exhausted the last 503 response is returned to the caller as is.
+    """
+    # Imported here so a cold start that never calls upstream doesn't load requests
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        status=max_retries,
+        status_forcelist=(503,),
+        allowed_methods=None,  # inference POSTs are safe to repeat
+        backoff_factor=backoff_factor,
+        backoff_jitter=backoff_jitter,
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """Get the process-wide pooled session shared by all upstream HTTP callers.
+
+    The session carries no per-user state (keys are sent per request) and
+    urllib3's connection pool is thread-safe, so it is shared between threads.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+class ImageCache:
+    """Disk cache of encoded images, addressed by a hash of what produced them.
+
+    The key covers the normalized prompt, the model id and the output
+    format/quality, so a hit can be served straight from the stored bytes.
+    A file's mtime is its creation time (for the TTL) and its atime is
+    bumped on every hit (for LRU eviction once ``max_bytes`` is exceeded).
+    """
+
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._total_bytes = sum(size for _, _, size in self._scan())
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        return ' '.join(prompt.split()).lower()
+
+    def key_for(self, prompt: str, model: str, image_format: str, quality: int) -> str:
+        payload = json.dumps([self.normalize_prompt(prompt), model, image_format.lower(), quality])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path_for(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def get(self, key: str):
+        """Return the cached bytes for ``key``, or None on a miss or expired entry"""
+        path = self.path_for(key)
+        try:
+            stat = os.stat(path)
+            if time.time() - stat.st_mtime > self.ttl:
+                self._remove(path, stat.st_size)
+                self.misses += 1
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, (time.time(), stat.st_mtime))  # LRU touch, keep creation time
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        path = self.path_for(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_name(f'{key}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        try:
+            previous = os.stat(path).st_size
+        except FileNotFoundError:
+            previous = 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._total_bytes += len(data) - previous
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget:
+            self._evict()
+
+    def add(self, data: bytes) -> str:
+        """Store ``data`` under the hash of its content and return that key"""
+        key = hashlib.sha256(data).hexdigest()
+        path = self.path_for(key)
+        try:
+            stat = os.stat(path)
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            self.put(key, data)
+        return key
+
+    def stats(self) -> dict:
+        return {
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def _scan(self):
+        """Yield (last access, path, size) of every cached file"""
+        for path in self.cache_dir.glob('*/*'):
+            if path.suffix == '.tmp':
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            yield stat.st_atime, path, stat.st_size
+
+    def _remove(self, path, size):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._total_bytes -= size
+
+    def _evict(self):
+        with self._lock:
+            # Other workers share the directory, so re-measure instead of trusting our total
+            entries = sorted(self._scan())
+            self._total_bytes = sum(size for _, _, size in entries)
+            for accessed, path, size in entries:
+                if self._total_bytes <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                self._total_bytes -= size
+                self.evictions += 1
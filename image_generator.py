@@ -1,66 +1,117 @@
 import os
-import base64
-from io import BytesIO
-from PIL import Image
-import requests
+import asyncio
+import hashlib
+import http_pool
+from single_flight import SingleFlight
+from metrics import timed
+from image_processing import ImageProcessor, ENCODINGS
+
+# Overridable so the app can be pointed at a local stand-in (e.g. for benchmarks)
+HF_API_BASE = os.environ.get('HF_API_BASE', 'https://api-inference.huggingface.co')
+HF_MODEL = 'stabilityai/stable-diffusion-3.5-large-turbo'
+HF_MODEL_URL = f"{HF_API_BASE}/models/{HF_MODEL}"
+HF_STATUS_URL = f"{HF_API_BASE}/status/{HF_MODEL}"
 
 class ImageGenerator:
-    def __init__(self):
-        self.hf_api_key = None
-
-    def set_api_key(self, api_key: str):
-        """Set the Hugging Face API key"""
-        if not api_key or not isinstance(api_key, str):
-            raise ValueError("Invalid API key provided")
-        self.hf_api_key = api_key
-
-    def generate_image(self, prompt: str) -> str:
-        """Generate image using Hugging Face Stable Diffusion"""
-        if not self.hf_api_key:
+    def __init__(self, session=None, cache=None, single_flight=None, processor=None):
+        self.session = session or http_pool.get_session()
+        self.cache = cache  # optional ImageCache of encoded results
+        self._async_client = None
+        # Decoding and encoding the variants happens off the request thread
+        self.processor = processor or ImageProcessor(workers=int(os.environ.get(
+            'IMAGE_PROCESS_WORKERS', 0 if os.environ.get('VERCEL_ENV') else 1)))
+        # Identical prompts already being generated are waited on rather than sent again
+        self.single_flight = single_flight or SingleFlight(
+            timeout=float(os.environ.get('IMAGE_SINGLE_FLIGHT_TIMEOUT', 120))
+        )
+
+    def _validate(self, prompt, api_key):
+        if not api_key:
             raise ValueError("Hugging Face API key not set. Please set it in settings.")
-        
+
         if not prompt or not isinstance(prompt, str):
             raise ValueError("Invalid prompt provided")
 
+    def _check_status(self, status_code):
+        if status_code == 401:
+            raise ValueError("Invalid Hugging Face API key")
+        elif status_code == 503:
+            raise ValueError("Model is currently loading. Please try again in a few minutes.")
+
+    def _cache_keys(self, prompt):
+        """Cache key of every variant of a prompt's image, or None without a cache"""
+        if self.cache is None:
+            return None
+        keys = {}
+        for name in self.processor.formats:
+            quality = ENCODINGS[name][2]['quality']
+            for variant in (name, f'thumb.{name}'):
+                keys[variant] = self.cache.key_for(prompt, HF_MODEL, variant, quality)
+        return keys
+
+    def _cached_variants(self, cache_keys):
+        """All variants from the cache, or None unless every one of them is there"""
+        if not cache_keys:
+            return None
+        variants = {}
+        for variant, key in cache_keys.items():
+            variants[variant] = self.cache.get(key)
+            if variants[variant] is None:
+                return None
+        return variants
+
+    def _cache_variants(self, cache_keys, variants):
+        if cache_keys:
+            for variant, key in cache_keys.items():
+                self.cache.put(key, variants[variant])
+
+    def _flight_key(self, prompt, api_key):
+        """Single-flight key of a prompt; includes a hash of the caller's Hugging Face key, so a
+        request only ever waits on a call billed to its own key"""
+        key_hash = hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+        return (HF_MODEL, self.processor.formats, ' '.join(prompt.split()).lower(), key_hash)
+
+    def generate_image_variants(self, prompt: str, api_key: str) -> dict:
+        """Generate image using Hugging Face Stable Diffusion, in every output variant.
+
+        Returns {variant: bytes}: 'jpeg', 'webp' (when supported) and a
+        'thumb.' variant of each. The caller's key is passed per call.
+        """
+        self._validate(prompt, api_key)
+
+        cache_keys = self._cache_keys(prompt)
+        cached = self._cached_variants(cache_keys)
+        if cached is not None:
+            return cached
+
         try:
-            print(f"Generating image with Hugging Face for prompt: {prompt}")
-            
-            headers = {"Authorization": f"Bearer {self.hf_api_key}"}
-            response = requests.post(
-                "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-3.5-large-turbo",
-                headers=headers,
-                json={"inputs": prompt},
-                timeout=30  # Add timeout
-            )
-            
-            if response.status_code == 401:
-                raise ValueError("Invalid Hugging Face API key")
-            elif response.status_code == 503:
-                raise ValueError("Model is currently loading. Please try again in a few minutes.")
-            
+            return self.single_flight.do(self._flight_key(prompt, api_key), self._fetch_image,
+                                         prompt, api_key, cache_keys)
+        except TimeoutError:
+            print("Timed out waiting for an identical image request")
+            raise ValueError("Request timed out. Please try again.")
+
+    def _fetch_image(self, prompt: str, api_key: str, cache_keys) -> dict:
+        """Call Hugging Face and encode the result; run by the single-flight leader only"""
+        import requests  # already loaded by the pooled session
+
+        try:
+            headers = {"Authorization": f"Bearer {api_key}"}
+            with timed('image_network'):
+                response = self.session.post(
+                    HF_MODEL_URL,
+                    headers=headers,
+                    json={"inputs": prompt},
+                    timeout=http_pool.DEFAULT_TIMEOUT
+                )
+
+            self._check_status(response.status_code)
             response.raise_for_status()
-            print(f"API Response status: {response.status_code}")
-            
-            image_bytes = response.content
-            if not image_bytes:
-                raise ValueError("No image data received from API")
-                
-            print(f"Received image bytes: {len(image_bytes)} bytes")
-            
-            image = Image.open(BytesIO(image_bytes))
-            print(f"Image opened successfully: {image.size}, mode: {image.mode}")
-            
-            if image.mode == 'RGBA':
-                image = image.convert('RGB')
-                print("Converted image to RGB mode")
-            
-            buffered = BytesIO()
-            image.save(buffered, format="JPEG", quality=85)  # Reduced quality for better performance
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            print(f"Converted to base64 string, length: {len(img_str)}")
-            
-            return img_str
-            
+
+            variants = self.processor.render(response.content)
+            self._cache_variants(cache_keys, variants)
+            return variants
+
         except requests.exceptions.Timeout:
             print("Request timed out while generating image")
             raise ValueError("Request timed out. Please try again.")
@@ -69,4 +120,56 @@ class ImageGenerator:
             raise ValueError("Network error occurred. Please check your connection.")
         except Exception as e:
             print(f"Error generating image: {str(e)}")
-            raise ValueError(f"Failed to generate image: {str(e)}")
\ No newline at end of file
+            raise ValueError(f"Failed to generate image: {str(e)}")
+
+    async def generate_image_variants_async(self, prompt: str, api_key: str) -> dict:
+        """Generate image variants without blocking the event loop (used by the ASGI app)"""
+        self._validate(prompt, api_key)
+
+        cache_keys = self._cache_keys(prompt)
+        cached = await asyncio.to_thread(self._cached_variants, cache_keys)
+        if cached is not None:
+            return cached
+
+        try:
+            return await self.single_flight.do_async(self._flight_key(prompt, api_key), self._fetch_image_async,
+                                                     prompt, api_key, cache_keys)
+        except TimeoutError:
+            print("Timed out waiting for an identical image request")
+            raise ValueError("Request timed out. Please try again.")
+
+    async def _fetch_image_async(self, prompt: str, api_key: str, cache_keys) -> dict:
+        """Async variant of _fetch_image"""
+        import httpx  # only the ASGI app generates images asynchronously
+
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(http_pool.DEFAULT_TIMEOUT[1], connect=http_pool.DEFAULT_TIMEOUT[0]),
+                limits=httpx.Limits(max_keepalive_connections=http_pool.POOL_SIZE)
+            )
+
+        try:
+            with timed('image_network'):
+                response = await self._async_client.post(
+                    HF_MODEL_URL,
+                    headers={"Authorization": f"Bearer {api_key}"},
+                    json={"inputs": prompt}
+                )
+
+            self._check_status(response.status_code)
+            response.raise_for_status()
+
+            # Decoding and re-encoding is CPU work; keep it off the event loop
+            variants = await self.processor.render_async(response.content)
+            await asyncio.to_thread(self._cache_variants, cache_keys, variants)
+            return variants
+
+        except httpx.TimeoutException:
+            print("Request timed out while generating image")
+            raise ValueError("Request timed out. Please try again.")
+        except httpx.HTTPError as e:
+            print(f"Network error while generating image: {str(e)}")
+            raise ValueError("Network error occurred. Please check your connection.")
+        except Exception as e:
+            print(f"Error generating image: {str(e)}")
+            raise ValueError(f"Failed to generate image: {str(e)}")
@@ -0,0 +1,164 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import STAGE_SECONDS
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobRejected(Exception):
+    """Raised when a job is not accepted; ``status_code`` is the HTTP status to answer with"""
+
+    def __init__(self, message, status_code=429, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class ImageJob:
+    def __init__(self, user_id, prompt):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.prompt = prompt
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.future = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "prompt": self.prompt,
+            "image_url": self.result,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished
+        }
+
+
+class ImageJobQueue:
+    """Runs image generation on a bounded worker pool, independent of web workers.
+
+    ``generate(prompt, api_key)`` is called on one of ``workers`` threads
+    and returns the URL of the stored image. At most ``max_queue`` jobs
+    wait for a worker and each user may have ``per_user`` jobs queued or
+    running; beyond that submit raises JobRejected. Finished jobs are kept
+    for ``result_ttl`` seconds. A queued job can be cancelled outright; a
+    running one is marked cancelled and its result discarded, since the
+    upstream call cannot be interrupted.
+    """
+
+    def __init__(self, generate, workers=4, max_queue=64, per_user=2, result_ttl=600.0):
+        self.generate = generate
+        self.workers = workers
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    def submit(self, user_id, prompt: str, api_key: str) -> ImageJob:
+        """Queue a job for ``user_id``, or raise JobRejected"""
+        with self._lock:
+            self._expire(time.time())
+            active = [job for job in self._jobs.values() if job.status in (QUEUED, RUNNING)]
+            if sum(1 for job in active if job.user_id == user_id) >= self.per_user:
+                self.rejected += 1
+                raise JobRejected(f"You already have {self.per_user} images generating. "
+                                  f"Please wait for one to finish.")
+            if sum(1 for job in active if job.status == QUEUED) >= self.max_queue:
+                self.rejected += 1
+                raise JobRejected("Image generation is busy. Please try again in a moment.",
+                                  status_code=503, retry_after=10)
+            job = ImageJob(user_id, prompt)
+            self._jobs[job.id] = job
+            job.future = self._executor.submit(self._run, job, api_key)
+            return job
+
+    def get(self, job_id: str, user_id):
+        """The job, if it exists and belongs to ``user_id``"""
+        with self._lock:
+            self._expire(time.time())
+            job = self._jobs.get(job_id)
+            return job if job is not None and job.user_id == user_id else None
+
+    def cancel(self, job_id: str, user_id) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.user_id != user_id or job.status in FINISHED:
+                return False
+            job.future.cancel()
+            self._finish(job, CANCELLED)
+            self.cancelled += 1
+            return True
+
+    def wait(self, job: ImageJob, seen_status: str, timeout: float) -> str:
+        """Block until the job's status differs from ``seen_status`` or ``timeout``; returns the status"""
+        with self._changed:
+            self._changed.wait_for(lambda: job.status != seen_status, timeout)
+            return job.status
+
+    def _run(self, job, api_key):
+        with self._lock:
+            if job.status != QUEUED:
+                return
+            job.status = RUNNING
+            self._changed.notify_all()
+        STAGE_SECONDS.observe(time.time() - job.created, stage='image_job_queued')
+
+        try:
+            result, error = self.generate(job.prompt, api_key), None
+        except ValueError as e:
+            result, error = None, str(e)
+        except Exception as e:
+            print(f"Error in image job {job.id}: {e}")
+            result, error = None, f"Failed to generate image: {str(e)}"
+
+        with self._lock:
+            if job.status != RUNNING:
+                return  # cancelled while running
+            job.result, job.error = result, error
+            self._finish(job, FAILED if error else DONE)
+            if error:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished = time.time()
+        self._changed.notify_all()
+
+    def _expire(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished is not None and now - job.finished > self.result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+            return {
+                "queued": statuses.count(QUEUED),
+                "running": statuses.count(RUNNING),
+                "stored": len(statuses),
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected
+            }
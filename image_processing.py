@@ -0,0 +1,157 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from metrics import timed, STAGE_SECONDS
+
+# Encoders by variant format: (PIL format, mimetype, save options)
+ENCODINGS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 85, 'optimize': True}),
+}
+THUMBNAIL_SIZE = 512  # longest side; the chat bubble shows images 400px wide
+
+
+def available_formats():
+    """Output formats in order of preference; JPEG is always there as the fallback"""
+    from PIL import features
+
+    return tuple(name for name in ENCODINGS if name != 'webp' or features.check('webp'))
+
+
+def render_variants(image_bytes: bytes, formats=('jpeg',), thumbnail_size=THUMBNAIL_SIZE):
+    """Decode an upstream image once and encode every variant.
+
+    Returns ({variant: bytes}, {stage: seconds}). Variants are named by
+    format ('webp', 'jpeg') and 'thumb.<format>' for the thumbnail. Module
+    level so it can run in a worker process. PIL is imported here, on first
+    use, rather than with the app.
+    """
+    from PIL import Image
+
+    timings = {}
+    start = time.perf_counter()
+    image = Image.open(BytesIO(image_bytes))
+    image.load()
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    thumbnail = image.copy()
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size))
+    timings['image_decode'] = time.perf_counter() - start
+
+    variants = {}
+    for name in formats:
+        pil_format, _, options = ENCODINGS[name]
+        start = time.perf_counter()
+        for prefix, source in (('', image), ('thumb.', thumbnail)):
+            buffered = BytesIO()
+            source.save(buffered, format=pil_format, **options)
+            variants[prefix + name] = buffered.getvalue()
+        timings[f'image_encode_{name}'] = time.perf_counter() - start
+    return variants, timings
+
+
+class ImageProcessor:
+    """Runs render_variants in a process pool, off the web process's GIL.
+
+    With ``workers=0``, or where a process pool cannot be started (e.g. no
+    /dev/shm on serverless hosts), rendering happens inline instead. A pool
+    whose worker died (BrokenProcessPool) is replaced and the render retried
+    once.
+    """
+
+    def __init__(self, workers=1, thumbnail_size=THUMBNAIL_SIZE):
+        self.workers = workers
+        self.thumbnail_size = thumbnail_size
+        self.formats = available_formats()
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None and self.workers > 0:
+                try:
+                    # Not fork: forking a threaded web process can copy a lock held by
+                    # another thread into the worker. Workers start from a fork server (or
+                    # spawn, e.g. on Windows). The fork server preloads only this module,
+                    # never ``__main__`` (the whole app), so workers fork with it imported.
+                    # Each worker still imports ``__main__`` as ``__mp_main__`` when it
+                    # starts, so the entry scripts keep their startup under
+                    # ``if __name__ == '__main__'``.
+                    if 'forkserver' in multiprocessing.get_all_start_methods():
+                        context = multiprocessing.get_context('forkserver')
+                        context.set_forkserver_preload(['image_processing'])
+                    else:
+                        context = multiprocessing.get_context('spawn')
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                except (OSError, NotImplementedError, ValueError) as e:
+                    print(f"Error starting image process pool, rendering inline: {e}")
+                    self.workers = 0
+            return self._pool
+
+    def _discard_pool(self, pool):
+        """Drop a broken pool so the next call starts a fresh one"""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def render(self, image_bytes: bytes) -> dict:
+        """Encode every variant of ``image_bytes``; returns {variant: bytes}"""
+        if not image_bytes:
+            raise ValueError("No image data received from API")
+        with timed('image_process'):
+            for attempt in range(2):
+                pool = self._get_pool()
+                if pool is None:
+                    variants, timings = render_variants(image_bytes, self.formats, self.thumbnail_size)
+                    break
+                try:
+                    variants, timings = pool.submit(
+                        render_variants, image_bytes, self.formats, self.thumbnail_size).result()
+                    break
+                except BrokenProcessPool as e:
+                    print(f"Image process pool broke, restarting it: {e}")
+                    self._discard_pool(pool)
+                    if attempt:
+                        raise
+        self._record(timings)
+        return variants
+
+    async def render_async(self, image_bytes: bytes) -> dict:
+        """Async variant of render; never blocks the event loop"""
+        if not image_bytes:
+            raise ValueError("No image data received from API")
+        with timed('image_process'):
+            for attempt in range(2):
+                pool = self._get_pool()
+                if pool is None:
+                    variants, timings = await asyncio.to_thread(
+                        render_variants, image_bytes, self.formats, self.thumbnail_size)
+                    break
+                try:
+                    variants, timings = await asyncio.wrap_future(pool.submit(
+                        render_variants, image_bytes, self.formats, self.thumbnail_size))
+                    break
+                except BrokenProcessPool as e:
+                    print(f"Image process pool broke, restarting it: {e}")
+                    self._discard_pool(pool)
+                    if attempt:
+                        raise
+        self._record(timings)
+        return variants
+
+    @staticmethod
+    def _record(timings):
+        for stage, seconds in timings.items():
+            STAGE_SECONDS.observe(seconds, stage=stage)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
@@ -0,0 +1,38 @@
+import threading
+
+
+class LazyService:
+    """Stands in for an object that is only built, by ``factory()``, on first use.
+
+    Attribute reads and writes go to the built object, so module-level
+    names such as ``app.chat_manager`` keep working while a cold start
+    that never touches them doesn't pay for their imports and setup. The
+    proxy's own attributes are prefixed so they can't hide the object's.
+    """
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_lazy_factory', factory)
+        object.__setattr__(self, '_lazy_instance', None)
+        object.__setattr__(self, '_lazy_lock', threading.Lock())
+
+    def _lazy_get(self):
+        if self._lazy_instance is None:
+            with self._lazy_lock:
+                if self._lazy_instance is None:
+                    object.__setattr__(self, '_lazy_instance', self._lazy_factory())
+        return self._lazy_instance
+
+    def __getattr__(self, name):
+        return getattr(self._lazy_get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._lazy_get(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._lazy_get(), name)
+
+    def __repr__(self):
+        if self._lazy_instance is None:
+            return f'<LazyService {self._lazy_factory.__name__} (not built)>'
+        return repr(self._lazy_instance)
+
@@ -0,0 +1,76 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class Throttled(Exception):
+    """Raised for a client or account with too many recent attempts; ``retry_after`` in seconds"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = max(int(math.ceil(retry_after)), 1)
+        super().__init__(f"Too many attempts. Please try again in {self.retry_after} s.")
+
+
+class LoginThrottle:
+    """Counts attempts per key in fixed windows: failed logins per client IP and per
+    email, and registrations per client IP, each kind in its own bucket.
+
+    Once a key reaches its limit within ``window`` seconds, ``check``
+    raises Throttled until the window is over, before any password hash
+    is computed, so a brute-force run costs almost no CPU. Keys are
+    hashed and at most ``max_keys`` are tracked, least recently used
+    first out.
+    """
+
+    def __init__(self, limits=None, window=900.0, max_keys=100000):
+        self.limits = limits or {'ip': 20, 'email': 5, 'register_ip': 50}
+        self.window = window
+        self.max_keys = max_keys
+        self._counts = OrderedDict()  # hashed key -> [attempts, window start]
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    @staticmethod
+    def _key(kind, value):
+        return kind, hashlib.sha256(str(value).strip().lower().encode('utf-8')).hexdigest()
+
+    def check(self, **keys):
+        """Raise Throttled if any of ``keys`` (e.g. ip=..., email=...) is over its limit"""
+        now = time.monotonic()
+        with self._lock:
+            for kind, value in keys.items():
+                if value is None:
+                    continue
+                entry = self._counts.get(self._key(kind, value))
+                if entry is not None and now - entry[1] < self.window and entry[0] >= self.limits[kind]:
+                    self.throttled += 1
+                    raise Throttled(entry[1] + self.window - now)
+
+    def record(self, **keys):
+        """Count one attempt against each of ``keys`` (a failed login, a registration)"""
+        now = time.monotonic()
+        with self._lock:
+            for kind, value in keys.items():
+                if value is None:
+                    continue
+                key = self._key(kind, value)
+                entry = self._counts.get(key)
+                if entry is None or now - entry[1] >= self.window:
+                    entry = self._counts[key] = [0, now]
+                entry[0] += 1
+                self._counts.move_to_end(key)
+            while len(self._counts) > self.max_keys:
+                self._counts.popitem(last=False)
+
+    def reset(self, **keys):
+        """Forget the failures of ``keys``, e.g. of an email after a successful sign-in"""
+        with self._lock:
+            for kind, value in keys.items():
+                if value is not None:
+                    self._counts.pop(self._key(kind, value), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"keys": len(self._counts), "throttled": self.throttled}
@@ -0,0 +1,161 @@
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labelnames, key), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Cumulative-bucket histogram of observed values (seconds, by convention)"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}  # label values -> [per-bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time spent in the ``with`` block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, list(counts), total, count) for key, (counts, total, count) in self._series.items())
+        samples = []
+        for key, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _labels(self.labelnames, key, [('le', _number(bound))])
+                samples.append((f'{self.name}_bucket', labels, cumulative))
+            samples.append((f'{self.name}_sum', _labels(self.labelnames, key), total))
+            samples.append((f'{self.name}_count', _labels(self.labelnames, key), count))
+        return samples
+
+
+class Registry:
+    """Set of metrics rendered together in the Prometheus text exposition format.
+
+    Besides counters and histograms it takes collectors: callables returning
+    a component's ``stats()`` dict, whose numeric values are exported as
+    gauges named ``<prefix>_<key>`` at render time.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, prefix, stats):
+        with self._lock:
+            self._collectors = [c for c in self._collectors if c[0] != prefix] + [(prefix, stats)]
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(f'{name}{labels} {_number(value)}' for name, labels, value in metric.samples())
+
+        for prefix, stats in collectors:
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"Error collecting {prefix} metrics: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                lines.append(f'# TYPE {prefix}_{key} gauge')
+                lines.append(f'{prefix}_{key} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'chatai_stage_seconds', 'Time spent in each stage of handling a chat or image request', ('stage',))
+GEMINI_RATE_LIMITED = REGISTRY.counter(
+    'chatai_gemini_rate_limited_total', 'Gemini calls rejected with 429')
+GEMINI_RETRIES = REGISTRY.counter(
+    'chatai_gemini_retries_total', 'Gemini calls sent again after a 429 (async path)')
+GEMINI_GAVE_UP = REGISTRY.counter(
+    'chatai_gemini_retries_exhausted_total', 'Messages that failed after max_retries rate limits')
+
+
+def timed(stage: str):
+    """Context manager recording the time spent in ``stage``"""
+    return STAGE_SECONDS.time(stage=stage)
@@ -5,17 +5,88 @@ db = SQLAlchemy()
 
 class Chat(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False)
     title = db.Column(db.String(200), default="New Chat")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Last time the user chatted in (or started) the thread; imports leave it unset, so
+    # turns sent without a thread never land in an imported one
+    last_active_at = db.Column(db.DateTime)
+
+    # A user's threads are listed most recently updated first
+    __table_args__ = (
+        db.Index('ix_chat_user_updated', 'user_id', 'updated_at', 'id'),
+        db.Index('ix_chat_user_active', 'user_id', 'last_active_at', 'id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
     def __repr__(self):
         return f'<Chat {self.title}>'
 
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id'), nullable=False)
+    user_id = db.Column(db.String(64), nullable=False)
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id', ondelete='CASCADE'), nullable=False)
+    turn_id = db.Column(db.String(32))  # id of the turn in the chat log, shared by message and reply
     content = db.Column(db.Text, nullable=False)
     is_user = db.Column(db.Boolean, default=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    chat = db.relationship('Chat', backref=db.backref('messages', lazy=True)) 
\ No newline at end of file
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    chat = db.relationship('Chat', backref=db.backref('messages', lazy=True, cascade='all, delete-orphan',
+                                                      passive_deletes=True))
+
+    # Pages of a thread are read newest first, scoped to the owner
+    __table_args__ = (
+        db.Index('ix_message_user_chat_time', 'user_id', 'chat_id', 'timestamp', 'id'),
+        db.Index('ix_message_user_turn', 'user_id', 'turn_id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'thread_id': self.chat_id,
+            'content': self.content,
+            'is_user': self.is_user,
+            'timestamp': self.timestamp.isoformat()
+        }
+
+class ThreadSummary(db.Model):
+    """Rolling summary of the turns of a thread that have left its recent window"""
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False)
+    text = db.Column(db.Text, nullable=False, default='')
+    upto = db.Column(db.String(32))  # turn id of the newest summarized turn
+    # Position of that turn's reply in the thread, so newer turns are found through the index
+    upto_at = db.Column(db.DateTime)
+    upto_message_id = db.Column(db.Integer)
+
+class SearchDocument(db.Model):
+    """One indexed chat turn and its length in terms, for BM25 length normalisation"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False)
+    turn_id = db.Column(db.String(32), nullable=False)
+    length = db.Column(db.Integer, nullable=False)
+
+    # Covers both the per-user document stats and deletes by turn
+    __table_args__ = (db.Index('ix_search_document_user_turn', 'user_id', 'turn_id', 'length'),)
+
+class SearchPosting(db.Model):
+    """Occurrences of one term in one chat turn (message and response together)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(64), nullable=False)
+    term = db.Column(db.String(40), nullable=False)
+    turn_id = db.Column(db.String(32), nullable=False)
+    tf = db.Column(db.Integer, nullable=False)
+    length = db.Column(db.Integer, nullable=False)  # of the turn, copied here so scoring needs no join
+
+    __table_args__ = (
+        db.Index('ix_search_posting_user_term', 'user_id', 'term', 'turn_id', 'tf', 'length'),
+        db.Index('ix_search_posting_user_turn', 'user_id', 'turn_id'),
+    )
@@ -0,0 +1,122 @@
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from metrics import STAGE_SECONDS, timed
+
+DEFAULT_METHOD = 'pbkdf2:sha256:600000'
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full; ``retry_after`` is a hint in seconds"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = max(int(math.ceil(retry_after)), 1)
+        super().__init__(f"The server is busy. Please try again in {self.retry_after} s.")
+
+
+class PasswordHasher:
+    """Hashes and checks passwords on a small dedicated pool, away from request threads.
+
+    PBKDF2 and scrypt release the GIL, so ``workers`` caps the cores that
+    authentication can take. Up to ``max_queue`` calls may wait for a
+    worker; beyond that they fail fast with HashingBusy instead of piling
+    up behind a login burst. New hashes use ``method``, and a hash made
+    with other parameters is upgraded in the background after a
+    successful check (see ``rehash``).
+    """
+
+    def __init__(self, workers=2, max_queue=16, method=DEFAULT_METHOD, timeout=30.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.method = method
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.prefix = None
+        self._dummy_hash = None
+        self.rejected = 0
+        self.rehashed = 0
+        self._prepared = False
+
+    def _prepare(self):
+        """One hash made up front: checked for unknown users, and its prefix (e.g.
+        'scrypt:32768:8:1' for 'scrypt') tells which stored hashes are outdated"""
+        self._dummy_hash = generate_password_hash('dummy', method=self.method)
+        self.prefix = self._dummy_hash.split('$', 1)[0]
+
+    def _submit(self, stage, fn, *args):
+        with self._lock:
+            if not self._prepared:
+                # Queued with the first hash rather than at startup, where it would slow a cold start
+                self._prepared = True
+                self._executor.submit(self._prepare)
+            if self._pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HashingBusy(self._pending / self.workers)
+            self._pending += 1
+        queued = time.monotonic()
+
+        def run():
+            STAGE_SECONDS.observe(time.monotonic() - queued, stage='password_queued')
+            try:
+                with timed(stage):
+                    return fn(*args)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+        return self._executor.submit(run)
+
+    def hash(self, password: str) -> str:
+        return self._submit('password_hash', generate_password_hash, password, self.method).result(self.timeout)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        """Check a password; with no ``password_hash`` (unknown user) a dummy hash is checked
+        anyway, so the answer takes as long either way"""
+        if not password_hash:
+            self._submit('password_verify', self._check_dummy, password).result(self.timeout)
+            return False
+        return self._submit('password_verify', check_password_hash, password_hash, password).result(self.timeout)
+
+    def _check_dummy(self, password):
+        if self._dummy_hash is None:
+            self._prepare()
+        check_password_hash(self._dummy_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """Whether a hash was made with other parameters than ``method`` (False until that is known)"""
+        return bool(password_hash) and self.prefix is not None and password_hash.split('$', 1)[0] != self.prefix
+
+    def rehash(self, password: str, save):
+        """Hash ``password`` with the current method in the background and pass it to ``save``.
+
+        Skipped when the pool is busy; it is tried again on the next login.
+        """
+        def upgrade():
+            password_hash = generate_password_hash(password, method=self.method)
+            save(password_hash)
+            with self._lock:
+                self.rehashed += 1
+
+        def report(future):
+            if future.exception() is not None:
+                print(f"Error rehashing password: {future.exception()}")
+
+        try:
+            self._submit('password_hash', upgrade).add_done_callback(report)
+        except HashingBusy:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "workers": self.workers,
+                "rejected": self.rejected,
+                "rehashed": self.rehashed
+            }
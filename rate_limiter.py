@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+
+class RateLimited(Exception):
+    """Raised when a call is not admitted; ``retry_after`` is a hint in seconds"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = max(int(math.ceil(retry_after)), 1)
+        super().__init__(f"Too many requests for this API key. Try again in {self.retry_after} s.")
+
+
+def retry_after_from(error):
+    """Seconds the upstream asked us to wait in a rate-limit error, or None.
+
+    Looks at a Retry-After header on the HTTP response (REST transport) and
+    at RetryInfo in the error details (gRPC transport).
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    value = headers.get('Retry-After') if hasattr(headers, 'get') else None
+    if value:
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+    for detail in getattr(error, 'details', None) or []:
+        delay = getattr(detail, 'retry_delay', None)
+        if delay is not None and (delay.seconds or delay.nanos):
+            return delay.seconds + delay.nanos / 1e9
+    return None
+
+
+def is_rate_limit_error(error) -> bool:
+    return getattr(error, 'code', None) == 429 or "429" in str(error)
+
+
+class _Bucket:
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.tokens = float(capacity)
+        self.updated = now  # may lie in the future while the key is blocked
+        self.waiting = 0
+        self.failures = 0
+        self.last_used = now
+
+
+class RateLimiter:
+    """Adaptive token buckets, one per API key (hashed), shared by all requests.
+
+    Every upstream call takes a token first. An async caller that would
+    have to wait up to ``max_wait`` seconds for one waits without blocking
+    the event loop; beyond that, or with ``max_queue`` callers already
+    waiting on the key, it fails fast with RateLimited so the client can be
+    told when to try again. Sync callers (WSGI worker threads) never wait:
+    without a token at hand they get RateLimited straight away. A
+    rate-limit response from upstream blocks the key for its Retry-After
+    (or a jittered exponential backoff) and halves the key's rate; each
+    success raises it again additively, up to ``rate``.
+    """
+
+    def __init__(self, rate=1.0, burst=5, max_wait=5.0, max_queue=16, min_rate=0.05,
+                 initial_backoff=2.0, max_backoff=60.0, max_keys=1024, idle_ttl=600.0):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.min_rate = min_rate
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_keys = max_keys
+        self.idle_ttl = idle_ttl
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        self.rate_limited = 0
+
+    @staticmethod
+    def _key(api_key):
+        return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()
+
+    def _bucket(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            while self._buckets:
+                oldest_key, oldest = next(iter(self._buckets.items()))
+                if len(self._buckets) < self.max_keys and now - oldest.last_used < self.idle_ttl:
+                    break
+                if oldest.waiting:
+                    break
+                del self._buckets[oldest_key]
+            bucket = self._buckets[key] = _Bucket(self.rate, self.burst, now)
+        self._buckets.move_to_end(key)
+        bucket.last_used = now
+        return bucket
+
+    def _reserve(self, api_key, max_wait):
+        """Take a token now or book one in the future; returns (bucket, seconds to wait)"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(self._key(api_key), now)
+            if now > bucket.updated:
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * bucket.rate)
+                bucket.updated = now
+            wait = max(bucket.updated - now, 0.0) + max(1.0 - bucket.tokens, 0.0) / bucket.rate
+            if wait > 0 and (wait > max_wait or bucket.waiting >= self.max_queue):
+                self.rejected += 1
+                raise RateLimited(wait)
+            bucket.tokens -= 1
+            self.admitted += 1
+            if wait > 0:
+                bucket.waiting += 1
+            return bucket, wait
+
+    def _done_waiting(self, bucket):
+        with self._lock:
+            bucket.waiting -= 1
+
+    def acquire(self, api_key: str):
+        """Take a token for ``api_key`` now, or raise RateLimited with the time to wait.
+
+        Never sleeps, so a WSGI worker thread is not held while the key is paced.
+        """
+        self._reserve(api_key, max_wait=0.0)
+
+    async def acquire_async(self, api_key: str):
+        """Wait for a token for ``api_key`` with asyncio.sleep, up to ``max_wait``, or raise RateLimited"""
+        bucket, wait = self._reserve(api_key, self.max_wait)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._done_waiting(bucket)
+
+    def record_success(self, api_key: str):
+        with self._lock:
+            bucket = self._buckets.get(self._key(api_key))
+            if bucket is not None:
+                bucket.failures = 0
+                bucket.rate = min(self.rate, bucket.rate + self.rate / 10)
+
+    def record_rate_limit(self, api_key: str, retry_after: float = None):
+        """Block the key after a 429, for ``retry_after`` or a jittered backoff"""
+        now = time.monotonic()
+        with self._lock:
+            self.rate_limited += 1
+            bucket = self._bucket(self._key(api_key), now)
+            if retry_after is None:
+                backoff = min(self.max_backoff, self.initial_backoff * (2 ** bucket.failures))
+                retry_after = random.uniform(backoff / 2, backoff)
+            bucket.failures += 1
+            bucket.rate = max(self.min_rate, bucket.rate / 2)
+            bucket.tokens = min(bucket.tokens, 0.0)
+            bucket.updated = max(bucket.updated, now + retry_after)
+            return retry_after
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "keys": len(self._buckets),
+                "waiting": sum(bucket.waiting for bucket in self._buckets.values()),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "rate_limited": self.rate_limited
+            }
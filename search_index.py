@@ -0,0 +1,239 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, select
+
+from models import db, Message, SearchDocument, SearchPosting
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock; fall back to in-process locking only
+    fcntl = None
+
+TOKEN_RE = re.compile(r'\w+')
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have i if in is it its me my of on or so
+that the this to was we were what when which who will with you your
+""".split())
+MAX_TERM_LENGTH = 40
+MAX_QUERY_TERMS = 10
+
+
+def tokenize(text: str) -> list:
+    """Lowercased word terms of ``text``, without stopwords and one-letter words"""
+    return [term for term in TOKEN_RE.findall((text or '').lower())
+            if 1 < len(term) <= MAX_TERM_LENGTH and term not in STOPWORDS]
+
+
+class SearchIndex:
+    """Per-user inverted index over chat turns, stored next to the conversations.
+
+    Every turn (message and response together) is one document: a
+    ``SearchDocument`` row with its length and one ``SearchPosting`` per
+    distinct term. Turns are added and removed one at a time as history
+    changes, and a query only reads the postings of its own terms through
+    the covering (user_id, term) index and ranks them with BM25.
+    """
+
+    MIGRATION_MARKER = '.search-indexed'
+
+    def __init__(self, app, k1=1.2, b=0.75):
+        self.app = app
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        with app.app_context():
+            db.create_all()
+
+    def add(self, user_id: str, entry: dict):
+        """Index one chat log entry ({"id", "message", "response"})"""
+        self.add_many(user_id, [entry])
+
+    def add_many(self, user_id: str, entries):
+        self.add_batch({user_id: entries})
+
+    def add_batch(self, entries_by_user: dict):
+        """Index {user_id: [entry, ...]} with a single commit"""
+        with self.app.app_context():
+            for user_id, entries in entries_by_user.items():
+                self._insert(str(user_id), entries)
+            db.session.commit()
+
+    def remove(self, user_id: str, turn_id: str):
+        self.remove_turns(user_id, [turn_id])
+
+    def remove_turns(self, user_id: str, turn_ids):
+        """Drop several turns (e.g. those of a deleted thread) with a single commit"""
+        turn_ids = list(turn_ids)
+        with self.app.app_context():
+            for start in range(0, len(turn_ids), 500):
+                self._delete(str(user_id), turn_ids[start:start + 500])
+            db.session.commit()
+
+    def clear(self, user_id: str):
+        with self.app.app_context():
+            self._delete(str(user_id))
+            db.session.commit()
+
+    def search(self, user_id: str, query: str, offset: int = 0, limit: int = 20) -> tuple:
+        """Turns matching any term of ``query``, best first; returns (results, has_more)"""
+        user_id = str(user_id)
+        terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        if not terms:
+            return [], False
+
+        with self.app.app_context():
+            documents, average_length = db.session.execute(
+                select(func.count(), func.avg(SearchDocument.length))
+                .where(SearchDocument.user_id == user_id)).one()
+            if not documents:
+                return [], False
+            frequencies = dict(db.session.execute(
+                select(SearchPosting.term, func.count())
+                .where(SearchPosting.user_id == user_id, SearchPosting.term.in_(terms))
+                .group_by(SearchPosting.term)).all())
+            if not frequencies:
+                return [], False
+
+            idf = {term: math.log(1 + (documents - df + 0.5) / (df + 0.5)) for term, df in frequencies.items()}
+            average_length = float(average_length or 1)
+            wanted = offset + limit + 1
+            # Terms in most turns have a low IDF but the most postings. They are only read for
+            # the turns the rarer terms found when those fill the page and outscore any turn
+            # that has nothing but common terms; otherwise every term is scored in full
+            common = [term for term, df in frequencies.items() if df > documents / 2]
+            rare = [term for term in frequencies if term not in common]
+            live = []
+            if common and rare:
+                scores = self._score(user_id, rare, idf, average_length)
+                ceiling = sum(idf[term] for term in common) * (self.k1 + 1)
+                best = heapq.nsmallest(wanted, scores.values(), key=lambda score: -score)
+                if len(best) == wanted and best[-1] >= ceiling:
+                    turn_ids = list(scores)
+                    for start in range(0, len(turn_ids), 500):
+                        self._score(user_id, common, idf, average_length, turn_ids[start:start + 500], scores)
+                    live = self._ranked_live(user_id, scores, wanted)
+            if len(live) < wanted:
+                scores = self._score(user_id, list(frequencies), idf, average_length)
+                live = self._ranked_live(user_id, scores, wanted)
+
+        return live[offset:offset + limit], len(live) > offset + limit
+
+    def _score(self, user_id: str, terms, idf, average_length, turn_ids=None, scores=None):
+        """Add the BM25 scores of ``terms`` (in ``turn_ids`` only, if given) to {turn_id: score}"""
+        # Scored here rather than with GROUP BY turn_id, which would tempt the planner
+        # into the (user_id, turn_id) index and a scan of every posting of the user
+        scores = defaultdict(float) if scores is None else scores
+        query = (select(SearchPosting.turn_id, SearchPosting.term, SearchPosting.tf, SearchPosting.length)
+                 .where(SearchPosting.user_id == user_id, SearchPosting.term.in_(terms)))
+        if turn_ids is not None:
+            query = query.where(SearchPosting.turn_id.in_(turn_ids))
+        for turn_id, term, tf, length in db.session.execute(query):
+            norm = self.k1 * (1 - self.b + self.b * length / average_length)
+            scores[turn_id] += idf[term] * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def _ranked_live(self, user_id: str, scores: dict, wanted: int) -> list:
+        """The best ``wanted`` scored turns whose messages still exist, best first"""
+        # Turns whose messages are gone (postings not yet removed) are skipped before
+        # paging, so a page is only short when the results run out
+        order = lambda item: (-item[1], item[0])
+        live = self._live(user_id, heapq.nsmallest(wanted, scores.items(), key=order))
+        if len(live) < wanted < len(scores):
+            rest = sorted(scores.items(), key=order)[wanted:]
+            for start in range(0, len(rest), wanted):
+                if len(live) >= wanted:
+                    break
+                live.extend(self._live(user_id, rest[start:start + wanted]))
+        return live
+
+    def rebuild(self, user_id: str = None, batch_size: int = 500) -> int:
+        """Re-index one user's turns, or everyone's, from the stored messages; returns the turn count"""
+        indexed = 0
+        with self.app.app_context():
+            self._delete(str(user_id) if user_id is not None else None)
+            db.session.commit()
+            owners = ([str(user_id)] if user_id is not None else
+                      db.session.scalars(select(Message.user_id).distinct()).all())
+            for owner in owners:
+                last = ''
+                while True:
+                    turn_ids = db.session.scalars(
+                        select(Message.turn_id)
+                        .where(Message.user_id == owner, Message.turn_id > last)
+                        .group_by(Message.turn_id).order_by(Message.turn_id).limit(batch_size)).all()
+                    if not turn_ids:
+                        break
+                    entries = {turn_id: {"id": turn_id, "message": "", "response": ""} for turn_id in turn_ids}
+                    for message in db.session.scalars(select(Message).where(
+                            Message.user_id == owner, Message.turn_id.in_(turn_ids))):
+                        entries[message.turn_id]["message" if message.is_user else "response"] = message.content
+                    self._insert(owner, entries.values())
+                    db.session.commit()
+                    indexed += len(turn_ids)
+                    last = turn_ids[-1]
+        return indexed
+
+    def migrate(self, marker_dir) -> int:
+        """Build the index once for history that predates it; returns the number of turns indexed"""
+        marker = marker_dir / self.MIGRATION_MARKER
+        if marker.exists():
+            return 0
+        with self._lock, open(marker_dir / '.search-index.lock', 'a+') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            if marker.exists():  # another worker finished first
+                return 0
+            indexed = self.rebuild()
+            marker.write_text(datetime.now().isoformat())
+            return indexed
+
+    # ------------------------------------------------------------------
+    # Internals
+
+    @staticmethod
+    def _rows(user_id, entries):
+        documents, postings = [], []
+        for entry in entries:
+            terms = tokenize(entry.get("message", "")) + tokenize(entry.get("response", ""))
+            documents.append({"user_id": user_id, "turn_id": entry["id"], "length": len(terms)})
+            postings.extend({"user_id": user_id, "term": term, "turn_id": entry["id"], "tf": tf,
+                             "length": len(terms)} for term, tf in Counter(terms).items())
+        return documents, postings
+
+    def _insert(self, user_id, entries):
+        documents, postings = self._rows(user_id, entries)
+        if documents:
+            db.session.execute(insert(SearchDocument), documents)
+        if postings:
+            db.session.execute(insert(SearchPosting), postings)
+
+    @staticmethod
+    def _live(user_id, hits) -> list:
+        """Results for (turn_id, score) hits, in order, leaving out turns that no longer exist"""
+        turns = {}
+        for message in db.session.scalars(select(Message).where(
+                Message.user_id == user_id, Message.turn_id.in_([turn_id for turn_id, _ in hits]))):
+            turn = turns.setdefault(message.turn_id, {
+                "turn_id": message.turn_id,
+                "thread_id": message.chat_id,
+                "timestamp": message.timestamp.isoformat(),
+                "message": "",
+                "response": ""
+            })
+            turn["message" if message.is_user else "response"] = message.content
+        return [dict(turns[turn_id], score=round(score, 4)) for turn_id, score in hits if turn_id in turns]
+
+    @staticmethod
+    def _delete(user_id, turn_ids=None):
+        for model in (SearchPosting, SearchDocument):
+            statement = delete(model)
+            if user_id is not None:
+                statement = statement.where(model.user_id == user_id)
+            if turn_ids is not None:
+                statement = statement.where(model.turn_id.in_(turn_ids))
+            db.session.execute(statement)
@@ -0,0 +1,275 @@
+import heapq
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+
+class MemorySessionStore:
+    """Sessions in a dict, for a single process; expiry times are kept in a heap for sweeping"""
+
+    def __init__(self):
+        self._sessions = {}  # sid -> (data, expires)
+        self._expiries = []  # (expires, sid); stale entries are skipped when popped
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+    def get(self, sid: str):
+        """(data, expires) of a live session, or None"""
+        with self._lock:
+            item = self._sessions.get(sid)
+        if item is None or item[1] <= time.time():
+            return None
+        return item
+
+    def set(self, sid: str, data: bytes, expires: float):
+        with self._lock:
+            old = self._sessions.get(sid)
+            self._bytes += len(data) - (len(old[0]) if old else 0)
+            self._sessions[sid] = (data, expires)
+            heapq.heappush(self._expiries, (expires, sid))
+
+    def touch(self, sid: str, expires: float):
+        with self._lock:
+            item = self._sessions.get(sid)
+            if item is not None:
+                self._sessions[sid] = (item[0], expires)
+                heapq.heappush(self._expiries, (expires, sid))
+
+    def delete(self, sid: str):
+        with self._lock:
+            item = self._sessions.pop(sid, None)
+            if item is not None:
+                self._bytes -= len(item[0])
+
+    def sweep(self, now: float) -> int:
+        expired = 0
+        with self._lock:
+            while self._expiries and self._expiries[0][0] <= now:
+                expires, sid = heapq.heappop(self._expiries)
+                item = self._sessions.get(sid)
+                if item is not None and item[1] == expires:
+                    del self._sessions[sid]
+                    self._bytes -= len(item[0])
+                    expired += 1
+        return expired
+
+    def size(self) -> tuple:
+        with self._lock:
+            return len(self._sessions), self._bytes
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite file shared by every worker on the host.
+
+    Lookups go through the primary key and sweeps through an index on the
+    expiry time. Each thread keeps its own connection.
+    """
+
+    def __init__(self, path, sweep_batch=1000):
+        self.path = str(path)
+        self.sweep_batch = sweep_batch
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS sessions "
+                               "(id TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL) WITHOUT ROWID")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_sessions_expires ON sessions (expires)")
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def get(self, sid: str):
+        row = self._connection().execute(
+            "SELECT data, expires FROM sessions WHERE id = ? AND expires > ?", (sid, time.time())).fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    def set(self, sid: str, data: bytes, expires: float):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)", (sid, data, expires))
+
+    def touch(self, sid: str, expires: float):
+        self._connection().execute("UPDATE sessions SET expires = ? WHERE id = ?", (expires, sid))
+
+    def delete(self, sid: str):
+        self._connection().execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+    def sweep(self, now: float) -> int:
+        """Delete expired sessions, a batch at a time so writers are never held up for long"""
+        connection = self._connection()
+        expired = 0
+        while True:
+            deleted = connection.execute(
+                "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions WHERE expires <= ? LIMIT ?)",
+                (now, self.sweep_batch)).rowcount
+            expired += deleted
+            if deleted < self.sweep_batch:
+                return expired
+
+    def size(self) -> tuple:
+        count, size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions").fetchone()
+        return count, size
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires=None, new=False):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.new = new
+        self.modified = False
+
+
+class ServerSessionInterface(SessionInterface):
+    """Server-side sessions: the cookie carries a signed random id, the data stays in ``store``.
+
+    A session is written only when it changes; otherwise its expiry is
+    pushed back at most once per ``refresh_interval`` seconds. Expired
+    sessions are deleted by a background sweeper every ``sweep_interval``
+    seconds, which also refreshes the session count and size reported by
+    stats(), so a scrape never scans the store.
+    """
+
+    serializer = session_json_serializer
+
+    def __init__(self, store, sweep_interval=300.0, refresh_interval=3600.0):
+        self.store = store
+        self.sweep_interval = sweep_interval
+        self.refresh_interval = refresh_interval
+        self._sweeper = None
+        self._lock = threading.Lock()
+        self.created = 0
+        self.deleted = 0
+        self.expired = 0
+        self.sessions = 0
+        self.bytes = 0
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='chatai-session', key_derivation='hmac')
+
+    def open_session(self, app, request):
+        self._start_sweeper()
+        sid = None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('ascii')
+            except BadSignature:
+                sid = None
+        if sid:
+            item = self.store.get(sid)
+            if item is not None:
+                data, expires = item
+                try:
+                    return ServerSession(self.serializer.loads(data.decode('utf-8')), sid=sid, expires=expires)
+                except ValueError:
+                    pass
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                self._count('deleted')
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        expires = now + app.permanent_session_lifetime.total_seconds()
+        if session.modified:
+            self.store.set(session.sid, self.serializer.dumps(dict(session)).encode('utf-8'), expires)
+            if session.new:
+                self._count('created')
+        elif session.expires is not None and expires - session.expires >= self.refresh_interval:
+            self.store.touch(session.sid, expires)
+        else:
+            return  # nothing changed and the expiry is recent enough
+
+        response.vary.add('Cookie')
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode('ascii'),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _start_sweeper(self):
+        # Started on first request, so forked workers each get their own sweeper
+        if self._sweeper is None or not self._sweeper.is_alive():
+            with self._lock:
+                if self._sweeper is None or not self._sweeper.is_alive():
+                    self._sweeper = threading.Thread(target=self._sweep_forever, name='session-sweeper', daemon=True)
+                    self._sweeper.start()
+
+    def _sweep_forever(self):
+        while True:
+            self.sweep()
+            time.sleep(self.sweep_interval)
+
+    def sweep(self):
+        try:
+            expired = self.store.sweep(time.time())
+            sessions, size = self.store.size()
+        except Exception as e:
+            print(f"Error sweeping sessions: {e}")
+            return
+        with self._lock:
+            self.expired += expired
+            self.sessions, self.bytes = sessions, size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": self.sessions,
+                "bytes": self.bytes,
+                "created": self.created,
+                "deleted": self.deleted,
+                "expired": self.expired
+            }
+
+
+def load_secret_key(path):
+    """SECRET_KEY from the environment, else one generated once and kept in ``path``"""
+    key = os.environ.get('SECRET_KEY')
+    if key:
+        return key
+    if not os.path.exists(path):
+        # Written aside and linked into place, so concurrent workers agree on one key
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(temp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(temp_path)
+    with open(path) as f:
+        return f.read().strip()
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+
+_LEADER_CANCELLED = object()  # a follower's signal to run the call itself
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapses identical concurrent calls into one.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is still running (followers) wait up to ``timeout``
+    seconds for the leader's result, or its exception, instead of repeating
+    the work. Threads and coroutines are tracked separately, since a
+    coroutine must not block on a thread and vice versa.
+    """
+
+    def __init__(self, timeout=60.0):
+        self.timeout = timeout
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.takeovers = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` unless an identical call is already in flight"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not call.done.wait(self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                raise TimeoutError("Timed out waiting for an identical request in flight")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """Await ``fn(*args, **kwargs)`` unless an identical coroutine is already in flight.
+
+        A cancelled leader (e.g. its client disconnected) hands over instead of
+        failing its followers: the first of them to wake up runs the call again
+        as the new leader, and the others wait for it.
+        """
+        handed_over = False
+        while True:
+            with self._lock:
+                future = self._async_calls.get(key)
+                leader = future is None
+                if leader:
+                    future = self._async_calls[key] = asyncio.get_running_loop().create_future()
+                    self.leaders += 1
+                    self.takeovers += handed_over
+                else:
+                    self.coalesced += 1
+            if leader:
+                break
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    self.timeouts += 1
+                raise TimeoutError("Timed out waiting for an identical request in flight")
+            if result is not _LEADER_CANCELLED:
+                return result
+            handed_over = True
+
+        try:
+            result = await fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.set_result(_LEADER_CANCELLED)
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved, followers may not exist
+            raise
+        finally:
+            with self._lock:
+                self._async_calls.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls) + len(self._async_calls),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts,
+                "takeovers": self.takeovers
+            }
@@ -72,33 +72,54 @@ async function sendMessage() {
             body: JSON.stringify({
                 message: message,
                 api_key: localStorage.getItem('apiKey'),
-                hf_api_key: localStorage.getItem('hfApiKey')
+                hf_api_key: localStorage.getItem('hfApiKey'),
+                stream: !message.startsWith('@image') // Stream text replies token by token
             })
         });
 
         const contentType = response.headers.get("content-type");
+        if (contentType && contentType.includes("application/x-ndjson")) {
+            const reply = await streamBotMessage(response);
+            removeTypingIndicator();
+
+            // Save chat history
+            saveChat(message, true);
+            if (reply) {
+                saveChat(reply, false);
+            }
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+            return;
+        }
+
         if (!contentType || !contentType.includes("application/json")) {
             throw new Error("Server returned non-JSON response");
         }
 
-        const data = await response.json();
-        
-        // Remove typing indicator
-        removeTypingIndicator();
+        let data = await response.json();
 
         if (!response.ok) {
+            removeTypingIndicator();
             throw new Error(data.error || 'Server error occurred');
         }
 
+        // Images are generated in the background; wait for the job to finish
+        if (data.job_id) {
+            const job = await waitForImageJob(data);
+            data = { ...data, image_url: job.image_url };
+        }
+
+        // Remove typing indicator
+        removeTypingIndicator();
+
         // Display bot response
         if (data.response) {
-            appendMessage(data.response, false, false, data.image);
+            appendMessage(data.response, false, false, data.image_url || data.image);
         }
 
         // Save chat history
         saveChat(message, true);
         if (data.response) {
-            saveChat(data.response, false, data.image); // Save with image data
+            saveChat(data.response, false, data.image_url || data.image); // Save with image URL
         }
 
     } catch (error) {
@@ -177,8 +198,132 @@ function loadChat(chatId) {
     }
 }
 
+// Function to format bot message content (markdown and code blocks) as HTML
+function formatBotContent(content) {
+    // First handle code blocks (save them to restore later)
+    let codeBlocks = [];
+    let processedContent = content.replace(/```([\w:\/.-]+)?\n([\s\S]*?)```/g, (match, lang, code) => {
+        codeBlocks.push({
+            language: lang || 'code snippet',
+            code: code.trim()
+        });
+        return `###CODEBLOCK${codeBlocks.length - 1}###`;
+    });
+
+    // Handle markdown formatting
+    processedContent = processedContent
+        .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>')
+        .replace(/\n\n/g, '</p><p>')
+        .replace(/\n/g, '<br>');
+
+    if (!processedContent.startsWith('<p>')) {
+        processedContent = `<p>${processedContent}</p>`;
+    }
+
+    // Restore code blocks with syntax highlighting
+    return processedContent.replace(/###CODEBLOCK(\d+)###/g, (match, index) => {
+        const block = codeBlocks[index];
+        return createCodeBlockHTML(block.language, block.code);
+    });
+}
+
+// Wait for a background image job by polling its status URL. Server-sent events
+// hold a server worker for the whole job under the Flask server, so they are opt-in.
+function waitForImageJob(job, useEvents = false) {
+    return new Promise((resolve, reject) => {
+        const settle = (state) => {
+            if (state.status === 'done') {
+                resolve(state);
+            } else if (state.status === 'failed' || state.status === 'cancelled') {
+                reject(new Error(state.error || `Image generation ${state.status}`));
+            } else {
+                return false;
+            }
+            return true;
+        };
+
+        const poll = async () => {
+            try {
+                const response = await fetch(job.status_url);
+                const state = await response.json();
+                if (!response.ok) {
+                    throw new Error(state.error || 'Server error occurred');
+                }
+                if (!settle(state)) {
+                    setTimeout(poll, 1000);
+                }
+            } catch (error) {
+                reject(error);
+            }
+        };
+
+        if (!useEvents || !job.events_url || !window.EventSource) {
+            poll();
+            return;
+        }
+
+        const events = new EventSource(job.events_url);
+        events.addEventListener('status', (event) => {
+            if (settle(JSON.parse(event.data))) {
+                events.close();
+            }
+        });
+        events.onerror = () => {
+            events.close();
+            poll();
+        };
+    });
+}
+
+// Function to render a streamed (NDJSON) bot response as it arrives
+async function streamBotMessage(response) {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'message bot-message';
+    const bubble = document.createElement('div');
+    bubble.className = 'message-bubble';
+    messageDiv.appendChild(bubble);
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let content = '';
+    let started = false;
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+
+        for (const line of lines) {
+            if (!line.trim()) continue;
+            const data = JSON.parse(line);
+            if (data.error) {
+                throw new Error(data.error);
+            }
+            if (data.delta) {
+                if (!started) {
+                    removeTypingIndicator();
+                    chatMessages.appendChild(messageDiv);
+                    started = true;
+                }
+                content += data.delta;
+                bubble.innerHTML = formatBotContent(content);
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            }
+            if (data.done) {
+                content = data.response;
+            }
+        }
+    }
+
+    return content;
+}
+
 // Function to append message to chat
-async function appendMessage(content, isUser, skipTyping = false, imageBase64 = null) {
+async function appendMessage(content, isUser, skipTyping = false, imageData = null) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `message ${isUser ? 'user-message' : 'bot-message'}`;
     
@@ -209,31 +354,7 @@ async function appendMessage(content, isUser, skipTyping = false, imageBase64 =
         messageDiv.appendChild(bubble);
         chatMessages.appendChild(messageDiv);
 
-        // First handle code blocks (save them to restore later)
-        let codeBlocks = [];
-        let processedContent = content.replace(/```([\w:\/.-]+)?\n([\s\S]*?)```/g, (match, lang, code) => {
-            codeBlocks.push({
-                language: lang || 'code snippet',
-                code: code.trim()
-            });
-            return `###CODEBLOCK${codeBlocks.length - 1}###`;
-        });
-
-        // Handle markdown formatting
-        processedContent = processedContent
-            .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>')
-            .replace(/\n\n/g, '</p><p>')
-            .replace(/\n/g, '<br>');
-
-        if (!processedContent.startsWith('<p>')) {
-            processedContent = `<p>${processedContent}</p>`;
-        }
-
-        // Restore code blocks with syntax highlighting
-        processedContent = processedContent.replace(/###CODEBLOCK(\d+)###/g, (match, index) => {
-            const block = codeBlocks[index];
-            return createCodeBlockHTML(block.language, block.code);
-        });
+        const processedContent = formatBotContent(content);
 
         // Only apply typing effect for new messages, not loaded history
         if (!skipTyping) {
@@ -243,7 +364,7 @@ async function appendMessage(content, isUser, skipTyping = false, imageBase64 =
         }
 
         // Add image if present
-        if (imageBase64) {
+        if (imageData) {
             const imgContainer = document.createElement('div');
             imgContainer.className = 'message-image';
             
@@ -256,7 +377,11 @@ async function appendMessage(content, isUser, skipTyping = false, imageBase64 =
             
             // Create image
             const img = document.createElement('img');
-            img.src = `data:image/jpeg;base64,${imageBase64}`;
+            // Images are served by URL; chats saved before that hold raw base64.
+            // The bubble shows the thumbnail, the full image opens on click.
+            const isUrl = imageData.startsWith('/');
+            const fullSrc = isUrl ? imageData : `data:image/jpeg;base64,${imageData}`;
+            img.src = isUrl ? `${imageData}?size=thumb` : fullSrc;
             img.alt = 'Generated Image';
             img.style.width = '100%';
             img.style.height = 'auto';
@@ -278,7 +403,7 @@ async function appendMessage(content, isUser, skipTyping = false, imageBase64 =
                 modal.style.zIndex = '1000';
                 
                 const modalImg = document.createElement('img');
-                modalImg.src = img.src;
+                modalImg.src = fullSrc;
                 modalImg.style.maxWidth = '90%';
                 modalImg.style.maxHeight = '90%';
                 modalImg.style.objectFit = 'contain';
@@ -308,7 +433,7 @@ async function appendMessage(content, isUser, skipTyping = false, imageBase64 =
             downloadBtn.onclick = (e) => {
                 e.stopPropagation();
                 const link = document.createElement('a');
-                link.href = img.src;
+                link.href = isUrl ? `${imageData}?format=jpeg` : fullSrc;
                 link.download = `generated-image-${Date.now()}.jpg`;
                 link.click();
             };
@@ -327,7 +452,7 @@ async function appendMessage(content, isUser, skipTyping = false, imageBase64 =
                     const currentChat = chats.find(chat => chat.id === currentChatId);
                     if (currentChat) {
                         currentChat.messages.forEach(msg => {
-                            if (msg.imageData === imageBase64) {
+                            if (msg.imageData === imageData) {
                                 msg.imageData = null;
                             }
                         });
@@ -0,0 +1,39 @@
+import importlib
+
+import pytest
+from flask import Flask
+
+from chat_manager import ChatManager
+from conversation_store import ConversationStore
+from models import db
+
+
+@pytest.fixture
+def conversations(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'chat.db'}"
+    db.init_app(app)
+    store = ConversationStore(app)
+    yield store
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def threaded_manager(tmp_path, monkeypatch, conversations):
+    """A ChatManager filing turns into threads, as the app builds it"""
+    monkeypatch.setenv('VERCEL_ENV', '1')
+    monkeypatch.setattr('tempfile.tempdir', str(tmp_path))
+    return ChatManager(conversations=conversations)
+
+
+@pytest.fixture(scope='session')
+def appmod(tmp_path_factory):
+    """The Flask app, imported once with its data in a temporary directory"""
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('VERCEL_ENV', '1')
+        patch.setenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+        patch.setattr('tempfile.tempdir', str(tmp_path_factory.mktemp('app')))
+        module = importlib.import_module('app')
+        module.app.config['TESTING'] = True
+        yield module
@@ -0,0 +1,38 @@
+import pytest
+
+
+@pytest.fixture(scope='module')
+def client(appmod):
+    client = appmod.app.test_client()
+    client.post('/register', data={'name': 'alice', 'email': 'alice@example.com',
+                                   'password': 'secret', 'confirm_password': 'secret'})
+    client.post('/login', data={'email': 'alice@example.com', 'password': 'secret'})
+    return client
+
+
+def test_images_are_served_by_key_in_the_accepted_encoding(appmod, client):
+    image_key = appmod.store_image({'jpeg': b'jpeg-bytes', 'webp': b'webp-bytes',
+                                    'thumb.jpeg': b'thumb-bytes'})
+    url = appmod.generated_image_url(image_key)
+    assert url == f'/images/{image_key}'
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == b'jpeg-bytes'
+    assert response.mimetype == 'image/jpeg'
+    assert 'immutable' in response.headers['Cache-Control']
+
+    response = client.get(url, headers={'Accept': 'image/webp,*/*'})
+    assert (response.data, response.mimetype) == (b'webp-bytes', 'image/webp')
+    assert client.get(url + '?size=thumb').data == b'thumb-bytes'
+    # No WebP thumbnail was stored, so the JPEG one is served instead
+    assert client.get(url + '?size=thumb', headers={'Accept': 'image/webp'}).data == b'thumb-bytes'
+
+
+def test_unknown_or_malformed_image_keys_are_not_found(client):
+    assert client.get('/images/' + '0' * 64).status_code == 404
+    assert client.get('/images/..%2Fchat.db').status_code == 404
+
+
+def test_images_need_a_login(appmod):
+    assert appmod.app.test_client().get('/images/' + '0' * 64).status_code in (302, 401)
@@ -0,0 +1,48 @@
+import asyncio
+import importlib
+
+import httpx
+import pytest
+
+
+@pytest.fixture(scope='module')
+def asgi(appmod):
+    return importlib.import_module('asgi')
+
+
+def client_for(asgi):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi.app), base_url='http://testserver')
+
+
+async def log_in(client):
+    # Goes through the Flask app behind the WSGI adapter
+    await client.post('/register', data={'name': 'bob', 'email': 'bob@example.com',
+                                         'password': 'secret', 'confirm_password': 'secret'})
+    await client.post('/login', data={'email': 'bob@example.com', 'password': 'secret'})
+
+
+def test_chat_and_image_routes_need_a_login(asgi):
+    async def run():
+        async with client_for(asgi) as client:
+            return (await client.post('/chat', json={'message': 'hi', 'api_key': 'key'})).status_code
+
+    assert asyncio.run(run()) == 401
+
+
+@pytest.mark.parametrize('path, payload', [
+    ('/chat', ['not', 'an', 'object']),
+    ('/chat', {'message': ['hi'], 'api_key': 'key'}),
+    ('/chat', {'message': 'hi', 'api_key': 42}),
+    ('/chat', {'message': '@image a cat', 'api_key': 'key', 'hf_api_key': {'token': 'hf_x'}}),
+    ('/generate-image', {'prompt': 7, 'hf_api_key': 'hf_x'}),
+    ('/generate-image', {'prompt': 'a cat', 'hf_api_key': ['hf_x']}),
+])
+def test_malformed_input_is_refused_before_any_upstream_call(asgi, path, payload):
+    async def run():
+        async with client_for(asgi) as client:
+            await log_in(client)
+            return await client.post(path, json=payload)
+
+    response = asyncio.run(run())
+    assert response.status_code == 400
+    assert response.json()['error']
@@ -0,0 +1,204 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from chat_manager import ChatManager
+from metrics import GEMINI_RETRIES
+from rate_limiter import RateLimiter, RateLimited
+from ttl_cache import TTLCache
+
+
+class Reply:
+    def __init__(self, text):
+        self.text = text
+
+
+class SlowModel:
+    """Stands in for a Gemini model; each call takes long enough for callers to overlap"""
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(0.2)
+        with self._lock:
+            self.calls.append(prompt)
+        return Reply('hi')
+
+
+class TooManyRequests(Exception):
+    """A Gemini 429 as the REST transport reports it"""
+
+    code = 429
+
+    def __init__(self, retry_after):
+        super().__init__('429 Resource has been exhausted')
+        self.response = type('Response', (), {'headers': {'Retry-After': str(retry_after)}})()
+
+
+class FlakyModel:
+    """Answers with a 429 first, then succeeds"""
+
+    def __init__(self, retry_after=0.05):
+        self.retry_after = retry_after
+        self.calls = 0
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            raise TooManyRequests(self.retry_after)
+        return Reply('hi')
+
+    async def generate_content_async(self, prompt, **kwargs):
+        return self.generate_content(prompt, **kwargs)
+
+
+def retries():
+    return sum(value for _, _, value in GEMINI_RETRIES.samples())
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setenv('VERCEL_ENV', '1')
+    monkeypatch.setattr('tempfile.tempdir', str(tmp_path))
+    manager = ChatManager()
+    model = SlowModel()
+    monkeypatch.setattr(manager, '_build_prompt', lambda message, user_id, thread_id=None: 'User: hello')
+    monkeypatch.setattr(manager, '_get_model', lambda api_key=None, use_async=False: model)
+    monkeypatch.setattr(manager, 'add_to_history', lambda *args, **kwargs: None)
+    manager.model = model
+    return manager
+
+
+def send_concurrently(manager, keys):
+    threads = [threading.Thread(target=manager.process_message, args=('hello', f'user{i}', key))
+               for i, key in enumerate(keys)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_flight_key_depends_on_api_key(manager):
+    assert manager._flight_key('User: hello', 'key-a') != manager._flight_key('User: hello', 'key-b')
+    assert manager._flight_key('User: hello', 'key-a') == manager._flight_key('User: hello', 'key-a')
+    assert 'key-a' not in manager._flight_key('User: hello', 'key-a')
+
+
+def test_different_keys_never_share_a_flight(manager):
+    send_concurrently(manager, ['key-a', 'key-b'])
+    assert len(manager.model.calls) == 2
+    assert manager.single_flight.coalesced == 0
+
+
+def test_same_key_shares_a_flight(manager):
+    send_concurrently(manager, ['key-a', 'key-a'])
+    assert len(manager.model.calls) == 1
+    assert manager.single_flight.coalesced == 1
+
+
+def test_sync_429_is_refused_with_retry_after_then_succeeds(manager):
+    manager.rate_limiter = RateLimiter(rate=100, burst=1)
+    model = FlakyModel(retry_after=3)
+    before = retries()
+    with pytest.raises(RateLimited) as refused:
+        manager._generate_content_with_backoff(model, 'User: hello', api_key='key-a')
+    assert refused.value.retry_after == 3
+    assert model.calls == 1
+    # The key stays blocked for the upstream's Retry-After, without a second call
+    with pytest.raises(RateLimited):
+        manager._generate_content_with_backoff(model, 'User: hello', api_key='key-a')
+    assert model.calls == 1
+
+    manager.rate_limiter = RateLimiter(rate=100, burst=1)  # as if the Retry-After had passed
+    assert manager._generate_content_with_backoff(model, 'User: hello', api_key='key-a').text == 'hi'
+    assert model.calls == 2
+    assert retries() == before
+
+
+def test_async_429_is_retried_then_succeeds(manager):
+    manager.rate_limiter = RateLimiter(rate=100, burst=1)
+    model = FlakyModel(retry_after=0.05)
+    before = retries()
+    response = asyncio.run(manager._generate_content_with_backoff_async(model, 'User: hello', api_key='key-a'))
+    assert response.text == 'hi'
+    assert model.calls == 2
+    assert retries() == before + 1
+
+
+
+def context_cache_counts(manager):
+    stats = manager.context_cache.stats()
+    return stats['hits'], stats['misses']
+
+
+def test_thread_context_is_served_from_the_cache(threaded_manager, conversations):
+    manager = threaded_manager
+    first = conversations.create_thread('alice', 'first')
+    second = conversations.create_thread('alice', 'second')
+    manager.add_to_history('alice', 'hello', 'hi', thread_id=first['id'])
+
+    # Loaded from the database once, then written through
+    turns, _ = manager._recent_context('alice', 5, first['id'])
+    assert [turn['message'] for turn in turns] == ['hello']
+    assert context_cache_counts(manager) == (0, 1)
+    manager.add_to_history('alice', 'and you?', 'fine', thread_id=first['id'])
+    turns, _ = manager._recent_context('alice', 5, first['id'])
+    assert [turn['message'] for turn in turns] == ['hello', 'and you?']
+    assert context_cache_counts(manager) == (1, 1)
+
+    # A turn in another thread leaves this one's window current
+    manager.add_to_history('alice', 'weather?', 'sunny', thread_id=second['id'])
+    manager._recent_context('alice', 5, first['id'])
+    assert context_cache_counts(manager) == (2, 1)
+    turns, _ = manager._recent_context('alice', 5, second['id'])
+    assert [turn['message'] for turn in turns] == ['weather?']
+    assert context_cache_counts(manager) == (2, 2)
+
+    # A turn without a thread goes to the most recently active one, and so does its context
+    manager.add_to_history('alice', 'and tomorrow?', 'rain')
+    turns, _ = manager._recent_context('alice', 5)
+    assert [turn['message'] for turn in turns] == ['weather?', 'and tomorrow?']
+    assert context_cache_counts(manager) == (3, 2)
+
+    # Deleting a thread drops its window
+    assert manager.delete_thread('alice', second['id'])
+    assert manager._recent_context('alice', 5, second['id']) == ([], None)
+
+
+def test_repeated_prompts_are_answered_from_the_response_cache(manager):
+    manager.response_cache = TTLCache()
+    assert manager.process_message('hello', 'alice', 'key-a') == 'hi'
+    assert manager.process_message('hello', 'bob', 'key-b') == 'hi'
+    assert len(manager.model.calls) == 1
+
+    # A user who opted out always gets a fresh reply, and doesn't fill the cache either
+    manager.process_message('hello', 'carol', 'key-c', use_cache=False)
+    assert len(manager.model.calls) == 2
+    assert manager.response_cache.stats()['entries'] == 1
+
+
+class Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class StreamingModel:
+    def generate_content(self, prompt, stream=False, **kwargs):
+        assert stream
+        return iter([Chunk('Hel'), Chunk(''), Chunk('lo')])
+
+
+def test_a_streamed_reply_is_saved_to_history_once_complete(monkeypatch, manager):
+    saved = []
+    monkeypatch.setattr(manager, '_get_model', lambda api_key=None, use_async=False: StreamingModel())
+    monkeypatch.setattr(manager, 'add_to_history', lambda *args: saved.append(args))
+
+    stream = manager.stream_message('hello', 'alice', 'key-a')
+    assert next(stream) == 'Hel'
+    assert saved == []
+    assert list(stream) == ['lo']
+    assert saved == [('alice', 'hello', 'Hello', None)]
@@ -0,0 +1,94 @@
+import os
+import time
+
+import pytest
+
+from chat_store import ChatLogStore
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    calls = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: calls.append(fd) or fsync(fd))
+    return calls
+
+
+def messages(entries):
+    return [entry['message'] for entry in entries]
+
+
+def test_read_follows_appends_and_deletes(tmp_path):
+    store = ChatLogStore(tmp_path, fsync_policy='never')
+    entries = [store.append('alice', f'm{i}', f'r{i}') for i in range(5)]
+    assert store.delete('alice', entries[1]['id'])
+    assert not store.delete('alice', 'missing')
+
+    assert messages(store.read('alice')) == ['m0', 'm2', 'm3', 'm4']
+    assert messages(store.read('alice', limit=2)) == ['m3', 'm4']
+    assert store.count('alice') == 4
+    assert store.read('bob') == []
+
+
+def test_another_worker_sees_appends_through_its_own_index(tmp_path):
+    first = ChatLogStore(tmp_path, fsync_policy='never')
+    second = ChatLogStore(tmp_path, fsync_policy='never')
+    first.append('alice', 'm0', 'r0')
+    assert messages(second.read('alice')) == ['m0']
+
+    # Caught up from the last scanned offset, not re-read from the start
+    entry = first.append('alice', 'm1', 'r1')
+    first.delete('alice', entry['id'])
+    first.append('alice', 'm2', 'r2')
+    assert messages(second.read('alice')) == ['m0', 'm2']
+    assert second.version('alice') == first.version('alice')
+
+
+def test_versions_frame_each_append(tmp_path):
+    store = ChatLogStore(tmp_path, fsync_policy='never')
+    _, before, after = store.append_versioned('alice', 'm0', 'r0')
+    assert before == (None, 0)
+    assert after == store.version('alice')
+    _, before, after = store.append_versioned('alice', 'm1', 'r1')
+    assert before[0] == after[0] and before[1] < after[1]
+
+
+def test_compaction_drops_dead_records_and_keeps_live_ones(tmp_path):
+    store = ChatLogStore(tmp_path, fsync_policy='never', compact_min_dead=3, compact_dead_ratio=0.5)
+    entries = [store.append('alice', f'm{i}', f'r{i}') for i in range(6)]
+    store.write_summary('alice', 'summary')
+    path = store._log_path('alice')
+    inode, size = os.stat(path).st_ino, os.path.getsize(path)
+
+    store.delete_many('alice', [entry['id'] for entry in entries[:4]])
+
+    # Three of six turns dead crosses both thresholds; the log is rewritten as a new file
+    assert os.stat(path).st_ino != inode
+    assert os.path.getsize(path) < size
+    assert messages(store.read('alice')) == ['m4', 'm5']
+    assert store.read_summary('alice')['text'] == 'summary'
+    assert messages(ChatLogStore(tmp_path).read('alice')) == ['m4', 'm5']
+
+
+def test_interval_policy_syncs_the_last_write_of_a_burst(tmp_path, fsyncs):
+    store = ChatLogStore(tmp_path, fsync_policy='interval', fsync_interval=0.1)
+    store.append('alice', 'm0', 'r0')
+    store.append('alice', 'm1', 'r1')
+    assert len(fsyncs) == 1  # the second write falls inside the interval
+
+    time.sleep(0.35)
+    assert len(fsyncs) == 2  # the flusher thread synced it
+    store.close()
+
+
+def test_close_syncs_outstanding_writes(tmp_path, fsyncs):
+    store = ChatLogStore(tmp_path, fsync_policy='interval', fsync_interval=60)
+    store.append('alice', 'm0', 'r0')
+    store.append('alice', 'm1', 'r1')
+    store.append('bob', 'm0', 'r0')
+    assert len(fsyncs) == 2
+
+    store.close()
+    assert len(fsyncs) == 3
+    store.append('alice', 'm2', 'r2')
+    assert len(fsyncs) == 4
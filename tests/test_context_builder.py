@@ -0,0 +1,38 @@
+from context_builder import ContextBuilder, clip_to_tokens, estimate_tokens
+
+
+def turn(message, response):
+    return {"message": message, "response": response}
+
+
+def test_recent_turns_fill_the_budget_newest_first():
+    builder = ContextBuilder(token_budget=40, min_clip_tokens=5)
+    turns = [turn('a' * 40, 'b' * 40), turn('c' * 40, 'd' * 40), turn('e' * 40, 'f' * 40)]
+    context = builder.build_context(turns)
+    # The newest turn fits whole, the one before is clipped, the oldest is left out
+    assert context.endswith(f"User: {'e' * 40}\nAssistant: {'f' * 40}")
+    assert 'c' * 10 in context and context.count('...') == 1
+    assert 'a' * 10 not in context
+    assert estimate_tokens(context) <= 40
+
+
+def test_the_summary_comes_first_and_counts_against_the_budget():
+    builder = ContextBuilder(token_budget=30)
+    prompt = builder.build_prompt('next?', [turn('hi', 'hello')], summary='- User: earlier')
+    assert prompt.startswith(f"{ContextBuilder.SUMMARY_HEADER}\n- User: earlier\nUser: hi")
+    assert prompt.endswith("User: next?\nAssistant:")
+
+
+def test_the_rolling_summary_drops_its_oldest_lines_over_budget():
+    builder = ContextBuilder(summary_budget=30)
+    summary = None
+    for i in range(5):
+        summary = builder.fold_into_summary(summary, turn(f'question {i}', f'answer  {i}\nmore'))
+    lines = summary.split('\n')
+    assert lines[-1] == '- User: question 4 / Assistant: answer 4 more'
+    assert len(lines) < 5 and estimate_tokens(summary) <= 30
+
+
+def test_clipping_marks_the_cut():
+    assert clip_to_tokens('short', 10) == 'short'
+    assert clip_to_tokens('x' * 100, 5) == 'x' * 17 + '...'
@@ -0,0 +1,55 @@
+from context_cache import ContextCache
+
+
+def turn(i, size=10):
+    return {"id": f't{i}', "timestamp": '2026-01-01T00:00:00', "message": 'm' * size, "response": ''}
+
+
+def test_a_window_is_served_only_at_its_version():
+    cache = ContextCache(window=3)
+    cache.put('alice', [turn(i) for i in range(5)], {"text": 'earlier', "upto": 't1'}, version=(1, 100))
+
+    turns, summary = cache.get('alice', (1, 100))
+    assert [t['id'] for t in turns] == ['t2', 't3', 't4']
+    assert summary['text'] == 'earlier'
+    assert [t['id'] for t in cache.get('alice', (1, 100), limit=1)[0]] == ['t4']
+    assert cache.get('alice', (1, 150)) is None  # another worker appended
+    assert cache.get('alice', (1, 100), limit=4) is None  # more than the window holds
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_appends_write_through_and_push_out_the_oldest_turn():
+    cache = ContextCache(window=2)
+    cache.put('alice', [turn(0), turn(1)], None, version=(1, 100))
+    assert cache.append('alice', turn(2), (1, 100), (1, 120)) == (True, turn(0))
+    assert [t['id'] for t in cache.get('alice', (1, 120))[0]] == ['t1', 't2']
+
+    # A write that missed another worker's append drops the window
+    assert cache.append('alice', turn(3), (1, 130), (1, 150)) == (False, None)
+    assert cache.get('alice', (1, 150)) is None
+
+
+def test_invalidating_a_user_drops_their_thread_windows_too():
+    cache = ContextCache(window=2)
+    cache.put(('alice', 1), [turn(0)], None, version=(1, 100))
+    cache.put(('alice', 2), [turn(1)], None, version=(1, 100))
+    cache.put(('bob', 3), [turn(2)], None, version=(2, 100))
+
+    cache.invalidate('alice')
+    assert cache.get(('alice', 1), (1, 100)) is None
+    assert cache.get(('alice', 2), (1, 100)) is None
+    assert cache.get(('bob', 3), (2, 100)) is not None
+
+
+def test_least_recently_used_windows_go_first_over_budget():
+    cache = ContextCache(window=2, max_users=2, max_bytes=10 * 1024)
+    cache.put('alice', [turn(0)], None, version=1)
+    cache.put('bob', [turn(1)], None, version=1)
+    cache.get('alice', 1)
+    cache.put('carol', [turn(2)], None, version=1)
+    assert cache.get('bob', 1) is None
+    assert cache.get('alice', 1) is not None
+
+    cache.put('dave', [turn(3, size=20 * 1024)], None, version=1)  # alone over max_bytes
+    assert cache.stats()['users'] == 0 and cache.stats()['bytes'] == 0
+    assert cache.evictions == 4
@@ -0,0 +1,48 @@
+import pytest
+
+from conversation_store import InvalidCursor
+
+
+def walk(fetch):
+    pages, cursor = [], None
+    while True:
+        page, cursor = fetch(cursor)
+        pages.append(page)
+        if cursor is None:
+            return pages
+
+
+def test_message_pages_walk_back_without_gaps_or_repeats(conversations):
+    thread = conversations.create_thread('alice', 'chat')
+    # Turns sharing a timestamp are ordered by row id
+    for i in range(7):
+        conversations.add_turn('alice', f'm{i}', f'r{i}', thread_id=thread['id'], turn_id=f't{i}',
+                               timestamp=f'2026-01-01T00:00:0{i // 2}')
+
+    pages = walk(lambda cursor: conversations.list_messages('alice', thread['id'], cursor, limit=4))
+    assert [len(page) for page in pages] == [4, 4, 4, 2]
+    # Each page is oldest first; together they are every message, newest page first
+    contents = [message['content'] for page in reversed(pages) for message in page]
+    assert contents == [text for i in range(7) for text in (f'm{i}', f'r{i}')]
+
+
+def test_thread_pages_are_most_recently_updated_first(conversations):
+    threads = [conversations.create_thread('alice', f'thread {i}') for i in range(5)]
+    conversations.add_turn('alice', 'hello', 'hi', thread_id=threads[1]['id'])
+    conversations.create_thread('bob', 'not alice')
+
+    pages = walk(lambda cursor: conversations.list_threads('alice', cursor, limit=2))
+    ids = [thread['id'] for page in pages for thread in page]
+    assert ids[0] == threads[1]['id']
+    assert sorted(ids) == sorted(thread['id'] for thread in threads)
+
+
+def test_bad_cursors_and_other_users_threads_are_refused(conversations):
+    thread = conversations.create_thread('alice', 'chat')
+    with pytest.raises(InvalidCursor):
+        conversations.list_messages('alice', thread['id'], cursor='not-a-cursor')
+    with pytest.raises(InvalidCursor):
+        conversations.list_threads('alice', cursor='bm90IGpzb24')
+    assert conversations.list_messages('bob', thread['id']) is None
+    assert conversations.get_thread('bob', thread['id']) is None
+
@@ -0,0 +1,46 @@
+import warnings
+
+import pytest
+
+import gemini_pool
+from gemini_pool import GeminiClientPool
+
+MODEL = 'gemini-1.5-flash'
+
+
+@pytest.fixture(autouse=True)
+def quiet_deprecation():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        yield
+
+
+def test_each_key_gets_its_own_client_reused_across_messages():
+    pool = GeminiClientPool()
+    first = pool.get('key-a', MODEL)
+    assert pool.get('key-a', MODEL) is first
+    other = pool.get('key-b', MODEL)
+    assert other is not first and other._client is not first._client
+    assert pool.stats()['hits'] == 1 and pool.stats()['misses'] == 2
+    assert not [key for key in pool._clients if 'key-a' in key or 'key-b' in key]
+
+
+def test_clients_are_evicted_least_recently_used_and_when_idle(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(gemini_pool.time, 'monotonic', lambda: now[0])
+    pool = GeminiClientPool(max_clients=2, idle_ttl=60)
+    first = pool.get('key-a', MODEL)
+    pool.get('key-b', MODEL)
+    pool.get('key-a', MODEL)
+    pool.get('key-c', MODEL)  # key-b was used least recently
+    assert pool.get('key-a', MODEL) is first
+    assert pool.stats()['evictions'] == 1
+
+    now[0] += 61
+    assert pool.get('key-a', MODEL) is not first
+    assert pool.stats()['evictions'] == 3
+
+
+def test_a_key_is_required():
+    with pytest.raises(ValueError):
+        GeminiClientPool().get('', MODEL)
@@ -0,0 +1,71 @@
+import gzip
+import io
+import json
+
+from history_transfer import HistoryImporter, IMPORTED_TITLE, export_chunks, gzip_chunks
+
+
+def dump(conversations, user_id):
+    return b''.join(gzip_chunks(export_chunks(conversations, user_id)))
+
+
+def records(data, kind):
+    lines = gzip.decompress(data).decode('utf-8').splitlines()
+    return [record for record in map(json.loads, lines) if record['type'] == kind]
+
+
+def test_an_export_imports_back_as_the_same_threads_and_turns(threaded_manager, conversations):
+    first = conversations.create_thread('alice', 'Trip')
+    second = conversations.create_thread('alice', 'Recipes')
+    threaded_manager.add_to_history('alice', 'where to?', 'Lisbon', thread_id=first['id'])
+    threaded_manager.add_to_history('alice', 'when?', 'May', thread_id=first['id'])
+    threaded_manager.add_to_history('alice', 'soup?', 'lentil', thread_id=second['id'])
+    exported = dump(conversations, 'alice')
+
+    result = HistoryImporter(threaded_manager, user_id='bob').run(io.BytesIO(exported))
+    assert result == {"threads": 2, "turns": 3, "duplicates": 0, "skipped": 0, "errors": []}
+
+    strip = lambda turns: [{key: turn[key] for key in ('message', 'response', 'timestamp')} for turn in turns]
+    assert strip(records(dump(conversations, 'bob'), 'turn')) == strip(records(exported, 'turn'))
+    assert ([thread['title'] for thread in records(dump(conversations, 'bob'), 'thread')]
+            == [thread['title'] for thread in records(exported, 'thread')])
+    assert len(threaded_manager.store.read('bob')) == 3
+
+    # The same dump again finds every turn already there
+    result = HistoryImporter(threaded_manager, user_id='bob').run(io.BytesIO(exported))
+    assert result["threads"] == 0 and result["turns"] == 0 and result["duplicates"] == 3
+    assert len(threaded_manager.store.read('bob')) == 3
+
+
+def test_invalid_lines_are_skipped_and_reported(threaded_manager):
+    data = b'\n'.join([
+        b'{"type": "export", "version": 1}',
+        b'not json',
+        b'{"type": "turn", "message": "hi", "response": 5}',
+        b'{"type": "turn", "thread_id": 9, "message": "hi", "response": "yo"}',
+        b'{"type": "turn", "message": "hi", "response": "yo", "timestamp": "2026-01-01T10:00:00+00:00"}',
+    ])
+    result = HistoryImporter(threaded_manager, user_id='alice').run(io.BytesIO(data))
+    assert result["turns"] == 1 and result["skipped"] == 3
+    assert [error.split(':')[0] for error in result["errors"]] == ['line 2', 'line 3', 'line 4']
+
+
+def test_admin_imports_need_an_existing_owner(threaded_manager):
+    data = b'\n'.join([b'{"type": "turn", "user_id": "alice", "message": "hi", "response": "yo"}',
+                       b'{"type": "turn", "user_id": "ghost", "message": "hi", "response": "yo"}',
+                       b'{"type": "turn", "message": "hi", "response": "yo"}'])
+    result = HistoryImporter(threaded_manager, user_exists=lambda user_id: user_id == 'alice').run(io.BytesIO(data))
+    assert result["turns"] == 1 and result["skipped"] == 2
+
+
+def test_new_turns_never_go_to_an_imported_thread(threaded_manager, conversations):
+    chatted = conversations.create_thread('alice', 'mine')
+    data = b'{"type": "turn", "message": "from backup", "response": "ok", "timestamp": "2030-01-01T00:00:00"}'
+    HistoryImporter(threaded_manager, user_id='alice').run(io.BytesIO(data))
+    threads, _ = conversations.list_threads('alice')
+    assert IMPORTED_TITLE in [thread['title'] for thread in threads]
+
+    # Turns without a thread still go where the user last chatted, as does their context
+    assert conversations.add_turn('alice', 'hello', 'hi')['id'] == chatted['id']
+    assert conversations.latest_thread_id('alice') == chatted['id']
+    assert conversations.latest_thread_id('bob') is None
@@ -0,0 +1,67 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import http_pool
+
+
+class Upstream(BaseHTTPRequestHandler):
+    """Answers 503 ("model loading") to the first ``loading`` requests, then 200"""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+            status = 503 if server.requests <= server.loading else 200
+        body = b'loading' if status == 503 else b'image'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '0')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Upstream)
+    server.lock, server.requests, server.loading, server.connections = threading.Lock(), 0, 0, set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server):
+    return f'http://127.0.0.1:{server.server_address[1]}/models/sd'
+
+
+def test_model_loading_is_retried(upstream):
+    upstream.loading = 2
+    session = http_pool.build_session(max_retries=3, backoff_factor=0, backoff_jitter=0)
+    response = session.post(url(upstream), json={"inputs": "fox"}, timeout=5)
+    assert (response.status_code, response.content) == (200, b'image')
+    assert upstream.requests == 3
+
+
+def test_the_last_503_is_returned_once_retries_run_out(upstream):
+    upstream.loading = 10
+    session = http_pool.build_session(max_retries=1, backoff_factor=0, backoff_jitter=0)
+    assert session.post(url(upstream), json={}, timeout=5).status_code == 503
+    assert upstream.requests == 2
+
+
+def test_connections_are_kept_alive_and_the_session_is_shared(upstream):
+    session = http_pool.build_session()
+    for _ in range(5):
+        session.post(url(upstream), json={}, timeout=5)
+    assert len(upstream.connections) == 1
+    assert http_pool.get_session() is http_pool.get_session()
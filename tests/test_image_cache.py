@@ -0,0 +1,52 @@
+import os
+import time
+
+from image_cache import ImageCache
+
+
+def test_keys_cover_the_normalized_prompt_model_and_encoding(tmp_path):
+    cache = ImageCache(tmp_path)
+    key = cache.key_for('A  red fox', 'sd', 'WEBP', 80)
+    assert key == cache.key_for('a red fox', 'sd', 'webp', 80)
+    assert key != cache.key_for('a red fox', 'sd', 'webp', 90)
+    assert key != cache.key_for('a red fox', 'other', 'webp', 80)
+    assert key != cache.key_for('a blue fox', 'sd', 'webp', 80)
+
+
+def test_entries_are_served_until_their_ttl(tmp_path):
+    cache = ImageCache(tmp_path, ttl=60)
+    cache.put('ab' * 32, b'image')
+    assert cache.get('ab' * 32) == b'image'
+    assert cache.get('cd' * 32) is None
+
+    path = cache.path_for('ab' * 32)
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    assert cache.get('ab' * 32) is None
+    assert not path.exists()
+    assert cache.stats() == {"bytes": 0, "hits": 1, "misses": 2, "evictions": 0}
+
+
+def test_least_recently_read_images_are_evicted_over_budget(tmp_path):
+    cache = ImageCache(tmp_path, max_bytes=250)
+    keys = [f'{i:02d}' * 32 for i in range(3)]
+    for i, key in enumerate(keys[:2]):
+        cache.put(key, b'x' * 100)
+        os.utime(cache.path_for(key), (1000 + i, time.time()))
+    cache.get(keys[0])  # read last, so kept
+
+    cache.put(keys[2], b'x' * 100)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    assert cache.stats()['bytes'] == 200 and cache.evictions == 1
+
+    # Measured from the directory, which other workers share
+    assert ImageCache(tmp_path).stats()['bytes'] == 200
+
+
+def test_content_addressed_adds_are_stored_once(tmp_path):
+    cache = ImageCache(tmp_path)
+    key = cache.add(b'png bytes')
+    assert cache.add(b'png bytes') == key
+    assert cache.get(key) == b'png bytes'
+    assert cache.stats()['bytes'] == len(b'png bytes')
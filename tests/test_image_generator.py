@@ -0,0 +1,49 @@
+import threading
+import time
+
+import pytest
+
+from image_generator import ImageGenerator
+from image_processing import ImageProcessor
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    generator = ImageGenerator(processor=ImageProcessor(workers=0))
+    calls = []
+
+    def fetch(prompt, api_key, cache_keys):
+        time.sleep(0.2)
+        calls.append(api_key)
+        return {'jpeg': b'image'}
+
+    monkeypatch.setattr(generator, '_fetch_image', fetch)
+    generator.calls = calls
+    return generator
+
+
+def generate_concurrently(generator, keys):
+    threads = [threading.Thread(target=generator.generate_image_variants, args=('a  Red fox', key))
+               for key in keys]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_flight_key_depends_on_api_key(generator):
+    assert generator._flight_key('a red fox', 'hf-a') != generator._flight_key('a red fox', 'hf-b')
+    assert generator._flight_key('a red fox', 'hf-a') == generator._flight_key('A  red fox', 'hf-a')
+    assert 'hf-a' not in repr(generator._flight_key('a red fox', 'hf-a'))
+
+
+def test_different_keys_never_share_a_flight(generator):
+    generate_concurrently(generator, ['hf-a', 'hf-b'])
+    assert sorted(generator.calls) == ['hf-a', 'hf-b']
+    assert generator.single_flight.coalesced == 0
+
+
+def test_same_key_shares_a_flight(generator):
+    generate_concurrently(generator, ['hf-a', 'hf-a'])
+    assert generator.calls == ['hf-a']
+    assert generator.single_flight.coalesced == 1
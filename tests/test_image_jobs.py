@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from image_jobs import CANCELLED, DONE, FAILED, QUEUED, RUNNING, ImageJobQueue, JobRejected
+
+
+@pytest.fixture
+def gate():
+    return threading.Event()
+
+
+@pytest.fixture
+def jobs(gate):
+    def generate(prompt, api_key):
+        gate.wait(5)
+        if prompt == 'bad':
+            raise ValueError('Invalid prompt provided')
+        return f'/images/{prompt}.{api_key}'
+
+    queue = ImageJobQueue(generate, workers=1, max_queue=1, per_user=2)
+    yield queue
+    gate.set()
+    queue.shutdown()
+
+
+def test_a_job_reports_its_result_to_its_owner_only(jobs, gate):
+    job = jobs.submit('alice', 'fox', 'hf-a')
+    assert jobs.wait(job, QUEUED, timeout=1) == RUNNING
+    gate.set()
+    assert jobs.wait(job, RUNNING, timeout=1) == DONE
+    assert jobs.get(job.id, 'alice').to_dict()['image_url'] == '/images/fox.hf-a'
+    assert jobs.get(job.id, 'bob') is None
+
+
+def test_errors_end_up_on_the_job(jobs, gate):
+    gate.set()
+    job = jobs.submit('alice', 'bad', 'hf-a')
+    jobs.wait(job, QUEUED, timeout=1)
+    assert jobs.wait(job, RUNNING, timeout=1) == FAILED
+    assert job.error == 'Invalid prompt provided'
+
+
+def test_per_user_and_queue_limits(jobs):
+    running = jobs.submit('alice', 'one', 'hf-a')
+    jobs.wait(running, QUEUED, timeout=1)
+    jobs.submit('alice', 'two', 'hf-a')  # queued behind the single worker
+    with pytest.raises(JobRejected) as excinfo:
+        jobs.submit('alice', 'three', 'hf-a')
+    assert excinfo.value.status_code == 429
+    with pytest.raises(JobRejected) as excinfo:
+        jobs.submit('bob', 'four', 'hf-b')
+    assert excinfo.value.status_code == 503 and excinfo.value.retry_after == 10
+
+
+def test_cancelled_jobs_discard_their_result(jobs, gate):
+    running = jobs.submit('alice', 'one', 'hf-a')
+    jobs.wait(running, QUEUED, timeout=1)
+    queued = jobs.submit('alice', 'two', 'hf-a')
+    assert not jobs.cancel(running.id, 'bob')
+    assert jobs.cancel(running.id, 'alice') and jobs.cancel(queued.id, 'alice')
+    gate.set()
+    jobs.shutdown()
+    assert (running.status, running.result) == (CANCELLED, None)
+    assert queued.status == CANCELLED
+    assert jobs.stats()['cancelled'] == 2
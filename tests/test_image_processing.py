@@ -0,0 +1,40 @@
+import asyncio
+from io import BytesIO
+
+import pytest
+from PIL import Image, features
+
+from image_processing import ImageProcessor, render_variants
+
+
+def png(width=1024, height=768, mode='RGBA'):
+    buffered = BytesIO()
+    Image.new(mode, (width, height), 'red').save(buffered, format='PNG')
+    return buffered.getvalue()
+
+
+@pytest.mark.skipif(not features.check('webp'), reason='Pillow built without WebP')
+def test_every_format_gets_a_full_size_image_and_a_thumbnail():
+    variants, timings = render_variants(png(), formats=('webp', 'jpeg'), thumbnail_size=256)
+    assert sorted(variants) == ['jpeg', 'thumb.jpeg', 'thumb.webp', 'webp']
+    sizes = {name: Image.open(BytesIO(data)).size for name, data in variants.items()}
+    assert sizes['jpeg'] == sizes['webp'] == (1024, 768)
+    assert sizes['thumb.jpeg'] == sizes['thumb.webp'] == (256, 192)
+    assert Image.open(BytesIO(variants['webp'])).format == 'WEBP'
+    assert set(timings) == {'image_decode', 'image_encode_webp', 'image_encode_jpeg'}
+
+
+@pytest.mark.parametrize('workers', [0, 1])
+def test_rendering_inline_and_in_the_process_pool(workers):
+    processor = ImageProcessor(workers=workers)
+    try:
+        variants = processor.render(png(64, 64))
+        assert variants == asyncio.run(processor.render_async(png(64, 64)))
+        assert 'jpeg' in variants and 'thumb.jpeg' in variants
+    finally:
+        processor.shutdown()
+
+
+def test_empty_upstream_responses_are_refused():
+    with pytest.raises(ValueError):
+        ImageProcessor(workers=0).render(b'')
@@ -0,0 +1,59 @@
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+from lazy import LazyService
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+class Service:
+    def __init__(self):
+        self.value = 1
+
+    def double(self):
+        return self.value * 2
+
+
+def test_the_service_is_built_on_first_use_only():
+    built = []
+    service = LazyService(lambda: built.append(1) or Service())
+    assert built == [] and 'not built' in repr(service)
+
+    assert service.double() == 2
+    service.value = 5
+    assert service.double() == 10
+    assert built == [1]
+
+
+def test_concurrent_first_uses_build_it_once():
+    built = []
+    barrier = threading.Barrier(8)
+
+    def factory():
+        built.append(1)
+        return Service()
+
+    service = LazyService(factory)
+
+    def use():
+        barrier.wait()
+        service.double()
+
+    threads = [threading.Thread(target=use) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert built == [1]
+
+
+
+def test_importing_the_app_leaves_heavy_libraries_unloaded(tmp_path):
+    code = ("import sys, app; print(' '.join(name for name in ('google.generativeai', 'PIL', 'httpx', 'requests')"
+            " if name in sys.modules))")
+    env = {'VERCEL_ENV': '1', 'SECRET_KEY': 'test', 'TMPDIR': str(tmp_path), 'PYTHONPATH': str(ROOT)}
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, timeout=60, env=env)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ''
@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+from werkzeug.security import check_password_hash, generate_password_hash
+
+import login_throttle
+from login_throttle import LoginThrottle, Throttled
+from password_hasher import HashingBusy, PasswordHasher
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(login_throttle.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_an_email_is_throttled_after_its_limit_until_the_window_ends(clock):
+    throttle = LoginThrottle(limits={'ip': 10, 'email': 3}, window=60)
+    for _ in range(3):
+        throttle.check(ip='10.0.0.1', email='alice@example.com')
+        throttle.record(ip='10.0.0.1', email='alice@example.com')
+
+    with pytest.raises(Throttled) as excinfo:
+        throttle.check(ip='10.0.0.1', email=' Alice@Example.com')
+    assert excinfo.value.retry_after == 60
+    throttle.check(ip='10.0.0.1', email='bob@example.com')  # other accounts from the same IP are fine
+
+    clock[0] += 59.5
+    with pytest.raises(Throttled) as excinfo:
+        throttle.check(email='alice@example.com')
+    assert excinfo.value.retry_after == 1
+    clock[0] += 1
+    throttle.check(email='alice@example.com')
+    assert throttle.stats() == {'keys': 2, 'throttled': 2}
+
+
+def test_a_successful_sign_in_resets_the_email_but_not_the_ip(clock):
+    throttle = LoginThrottle(limits={'ip': 2, 'email': 2}, window=60)
+    throttle.record(ip='10.0.0.1', email='alice@example.com')
+    throttle.record(ip='10.0.0.1', email='alice@example.com')
+    throttle.reset(email='alice@example.com')
+    throttle.check(email='alice@example.com')
+    with pytest.raises(Throttled):
+        throttle.check(ip='10.0.0.1')
+
+
+def test_only_max_keys_are_tracked(clock):
+    throttle = LoginThrottle(limits={'ip': 1}, max_keys=2)
+    for ip in ('10.0.0.1', '10.0.0.2', '10.0.0.3'):
+        throttle.record(ip=ip)
+    throttle.check(ip='10.0.0.1')  # least recently used, dropped
+    with pytest.raises(Throttled):
+        throttle.check(ip='10.0.0.3')
+
+
+def test_password_checks_and_background_rehash():
+    hasher = PasswordHasher(workers=1, method='pbkdf2:sha256:1000')
+    new_hash = hasher.hash('secret')
+    assert hasher.verify(new_hash, 'secret')
+    assert not hasher.verify(new_hash, 'wrong')
+    assert not hasher.verify(None, 'secret')  # unknown user, still checked against a dummy hash
+
+    old_hash = generate_password_hash('secret', method='pbkdf2:sha256:2000')
+    assert not hasher.needs_rehash(new_hash)
+    assert hasher.needs_rehash(old_hash)
+    saved = []
+    done = threading.Event()
+
+    def save(password_hash):
+        saved.append(password_hash)
+        done.set()
+
+    hasher.rehash('secret', save)
+    assert done.wait(5)
+    assert saved[0].startswith('pbkdf2:sha256:1000$') and check_password_hash(saved[0], 'secret')
+
+
+def test_a_full_hashing_queue_fails_fast():
+    hasher = PasswordHasher(workers=1, max_queue=1, method='pbkdf2:sha256:1000')
+    release = threading.Event()
+    hasher._submit('password_hash', release.wait)
+    hasher._submit('password_hash', release.wait)
+    with pytest.raises(HashingBusy):
+        hasher.hash('secret')
+    release.set()
+    assert hasher.stats()['rejected'] == 1
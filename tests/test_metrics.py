@@ -0,0 +1,37 @@
+from metrics import Registry
+
+
+def test_histograms_render_cumulative_buckets_per_label():
+    registry = Registry()
+    latency = registry.histogram('stage_seconds', 'Time per stage', ('stage',), buckets=(0.1, 1.0))
+    latency.observe(0.05, stage='chat')
+    latency.observe(0.5, stage='chat')
+    latency.observe(5, stage='chat')
+    latency.observe(0.2, stage='say "hi"')
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ['# HELP stage_seconds Time per stage', '# TYPE stage_seconds histogram']
+    assert 'stage_seconds_bucket{stage="chat",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{stage="chat",le="1.0"} 2' in lines
+    assert 'stage_seconds_bucket{stage="chat",le="+Inf"} 3' in lines
+    assert 'stage_seconds_sum{stage="chat"} 5.55' in lines
+    assert 'stage_seconds_count{stage="chat"} 3' in lines
+    assert 'stage_seconds_count{stage="say \\"hi\\""} 1' in lines
+
+
+def test_counters_and_collectors_are_rendered():
+    registry = Registry()
+    retries = registry.counter('retries_total', 'Retries')
+    retries.inc()
+    retries.inc(2)
+    registry.add_collector('cache', lambda: {"hits": 3, "hit_rate": 0.75, "enabled": True, "name": "lru"})
+    registry.add_collector('broken', lambda: 1 / 0)
+
+    lines = registry.render().splitlines()
+    assert 'retries_total 3' in lines
+    assert 'cache_hits 3' in lines and 'cache_hit_rate 0.75' in lines
+    assert not [line for line in lines if 'enabled' in line or 'name' in line or 'broken' in line]
+
+    # A collector registered again under the same prefix replaces the old one
+    registry.add_collector('cache', lambda: {"hits": 4})
+    assert 'cache_hits 4' in registry.render().splitlines()
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimited, RateLimiter, retry_after_from
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_sync_callers_get_the_burst_then_fail_fast(clock):
+    limiter = RateLimiter(rate=2.0, burst=3)
+    for _ in range(3):
+        limiter.acquire('key-a')
+    with pytest.raises(RateLimited) as excinfo:
+        limiter.acquire('key-a')
+    assert excinfo.value.retry_after == 1
+    limiter.acquire('key-b')  # every key has its own bucket
+
+    clock[0] += 0.5  # one token back at 2/s
+    limiter.acquire('key-a')
+    assert limiter.stats()['admitted'] == 5
+    assert limiter.stats()['rejected'] == 1
+
+
+def test_retry_after_blocks_the_key_and_halves_its_rate(clock):
+    limiter = RateLimiter(rate=1.0, burst=5)
+    assert limiter.record_rate_limit('key-a', 10) == 10
+    with pytest.raises(RateLimited) as excinfo:
+        limiter.acquire('key-a')
+    assert excinfo.value.retry_after == 12  # blocked for 10 s, then 2 s for a token at half the rate
+
+    clock[0] += 12
+    limiter.acquire('key-a')
+    limiter.record_success('key-a')
+    assert limiter._buckets[limiter._key('key-a')].rate == pytest.approx(0.6)
+
+
+def test_async_callers_wait_up_to_max_wait():
+    limiter = RateLimiter(rate=20.0, burst=1, max_wait=0.2, max_queue=2)
+
+    async def main():
+        await limiter.acquire_async('key')
+        # The next two sleep for tokens 50 and 100 ms away
+        await asyncio.gather(limiter.acquire_async('key'), limiter.acquire_async('key'))
+        # A 1 s block is longer than max_wait, so this one is refused
+        limiter.record_rate_limit('key', 1)
+        await limiter.acquire_async('key')
+
+    with pytest.raises(RateLimited):
+        asyncio.run(main())
+    assert limiter.stats()['admitted'] == 3
+    assert limiter.stats()['waiting'] == 0
+
+
+def test_retry_after_is_read_from_the_error():
+    class Error(Exception):
+        def __init__(self, headers):
+            self.response = type('Response', (), {'headers': headers})()
+
+    assert retry_after_from(Error({'Retry-After': '7'})) == 7.0
+    assert retry_after_from(Error({})) is None
+    assert retry_after_from(ValueError('429')) is None
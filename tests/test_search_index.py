@@ -0,0 +1,71 @@
+import pytest
+
+from search_index import SearchIndex
+
+
+@pytest.fixture
+def index(conversations):
+    return SearchIndex(conversations.app)
+
+
+def add_turns(conversations, index, user_id, texts):
+    for i, (message, response) in enumerate(texts):
+        turn_id = f'{user_id}-{i:04d}'
+        conversations.add_turn(user_id, message, response, turn_id=turn_id,
+                               timestamp=f'2026-01-01T00:{i // 60:02d}:{i % 60:02d}')
+        index.add(user_id, {"id": turn_id, "message": message, "response": response})
+
+
+def turn_ids(results):
+    return [result['turn_id'] for result in results]
+
+
+def test_turns_with_only_a_common_term_are_still_found(conversations, index):
+    add_turns(conversations, index, 'alice', [
+        ('python loops', 'use for'),
+        ('python classes', 'use class'),
+        ('deploy python', 'use docker'),
+        ('weather today', 'sunny'),
+    ])
+    results, has_more = index.search('alice', 'python weather')
+    # The rare term ranks first; every turn with the common term still matches
+    assert turn_ids(results)[0] == 'alice-0003'
+    assert sorted(turn_ids(results)) == ['alice-0000', 'alice-0001', 'alice-0002', 'alice-0003']
+    assert not has_more
+
+
+def test_rarer_terms_rank_higher_and_pages_follow_the_ranking(conversations, index):
+    add_turns(conversations, index, 'alice', [('python tips', 'more python')] * 30
+              + [('python and rust', 'both compile'), ('rust borrow checker', 'lifetimes')])
+    everything, _ = index.search('alice', 'rust python', limit=100)
+    assert len(everything) == 32
+    assert set(turn_ids(everything[:2])) == {'alice-0030', 'alice-0031'}
+    assert everything[0]['turn_id'] == 'alice-0030'  # has both terms
+
+    first, has_more = index.search('alice', 'rust python', limit=10)
+    second, _ = index.search('alice', 'rust python', offset=10, limit=10)
+    assert has_more
+    assert turn_ids(first + second) == turn_ids(everything[:20])
+    assert [result['score'] for result in first] == [result['score'] for result in everything[:10]]
+
+
+def test_other_users_turns_are_not_searched(conversations, index):
+    add_turns(conversations, index, 'alice', [('rust', 'yes')])
+    add_turns(conversations, index, 'bob', [('rust', 'no')])
+    results, _ = index.search('bob', 'rust')
+    assert turn_ids(results) == ['bob-0000']
+
+
+def test_common_terms_are_only_read_for_the_rarer_terms_turns_when_those_fill_the_page(conversations, index,
+                                                                                        monkeypatch):
+    add_turns(conversations, index, 'alice', [('rust python', 'ok')] * 12 + [('python', 'ok')] * 20)
+    everything, _ = index.search('alice', 'rust python', limit=100)
+
+    scored = []
+    score = index._score
+    monkeypatch.setattr(index, '_score', lambda user_id, terms, *args: scored.append(
+        (sorted(terms), len(args) > 2)) or score(user_id, terms, *args))
+    page, has_more = index.search('alice', 'rust python', limit=5)
+    assert scored == [(['rust'], False), (['python'], True)]
+    assert has_more
+    assert page == everything[:5]
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+from flask import Flask, session
+
+from session_store import MemorySessionStore, SQLiteSessionStore, ServerSessionInterface, load_secret_key
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    return MemorySessionStore() if request.param == 'memory' else SQLiteSessionStore(tmp_path / 'sessions.db')
+
+
+def test_expired_sessions_are_hidden_and_swept(store):
+    now = time.time()
+    store.set('live', b'{"a": 1}', now + 60)
+    store.set('expired', b'{"b": 2}', now - 1)
+    store.set('touched', b'{"c": 3}', now - 1)
+    store.touch('touched', now + 60)
+
+    assert store.get('live') == (b'{"a": 1}', now + 60)
+    assert store.get('expired') is None
+    assert store.sweep(now) == 1
+    assert store.size() == (2, 16)
+
+    store.delete('live')
+    assert store.get('live') is None
+    assert store.sweep(now + 120) == 1
+    assert store.size() == (0, 0)
+
+
+def test_the_cookie_carries_only_a_signed_id(tmp_path):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.session_interface = ServerSessionInterface(MemorySessionStore(), sweep_interval=3600)
+
+    @app.route('/set')
+    def set_value():
+        session['user'] = 'alice'
+        return ''
+
+    @app.route('/get')
+    def get_value():
+        return session.get('user', '')
+
+    client = app.test_client()
+    client.get('/set')
+    cookie = client.get_cookie('session')
+    assert 'alice' not in cookie.value
+    assert client.get('/get').text == 'alice'
+
+    client.set_cookie('session', cookie.value[:-2] + 'xx')
+    assert client.get('/get').text == ''
+
+
+def test_the_secret_key_is_generated_once(tmp_path, monkeypatch):
+    monkeypatch.delenv('SECRET_KEY', raising=False)
+    key = load_secret_key(tmp_path / '.secret_key')
+    assert key and load_secret_key(tmp_path / '.secret_key') == key
+    monkeypatch.setenv('SECRET_KEY', 'from-env')
+    assert load_secret_key(tmp_path / '.secret_key') == 'from-env'
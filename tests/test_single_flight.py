@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_a_follower_takes_over_when_the_leader_is_cancelled():
+    flight = SingleFlight(timeout=5)
+    calls = []
+
+    async def fetch(n):
+        calls.append(n)
+        await asyncio.sleep(0.1)
+        return f'result {n}'
+
+    async def main():
+        leader = asyncio.create_task(flight.do_async('key', fetch, 1))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(flight.do_async('key', fetch, n)) for n in (2, 3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers)
+
+    results = asyncio.run(main())
+    # The leader's call was abandoned; one follower ran it again and the other waited for it
+    assert calls == [1, 2]
+    assert results == ['result 2', 'result 2']
+    assert flight.stats()['takeovers'] == 1
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_a_leader_error_is_shared_with_followers():
+    flight = SingleFlight(timeout=5)
+
+    async def fail():
+        await asyncio.sleep(0.05)
+        raise ValueError('upstream failed')
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async('key', fail) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert flight.stats()['leaders'] == 1
+    assert flight.stats()['coalesced'] == 2
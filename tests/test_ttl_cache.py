@@ -0,0 +1,43 @@
+import pytest
+
+import ttl_cache
+from ttl_cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ttl_cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = TTLCache(ttl=30)
+    cache.put('1', 'alice')
+    cache.put('2', 'bob', ttl=5)
+    clock[0] += 10
+    assert cache.get('1') == 'alice'
+    assert cache.get('2') is None
+    clock[0] += 25
+    assert cache.get('1', 'gone') == 'gone'
+    assert cache.stats() == {"entries": 0, "hits": 1, "misses": 2, "hit_rate": 1 / 3,
+                             "evictions": 0, "expirations": 2}
+
+
+def test_the_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(max_entries=2)
+    cache.put('1', 'alice')
+    cache.put('2', 'bob')
+    cache.get('1')
+    cache.put('3', 'carol')
+    assert cache.get('2') is None
+    assert cache.get('1') == 'alice' and cache.get('3') == 'carol'
+    assert cache.evictions == 1
+
+
+def test_invalidate_drops_a_changed_user(clock):
+    cache = TTLCache()
+    cache.put('1', 'alice')
+    cache.invalidate('1')
+    cache.invalidate('missing')
+    assert cache.get('1') is None and len(cache) == 0
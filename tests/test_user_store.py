@@ -0,0 +1,45 @@
+import pytest
+
+from user_store import UserStore
+
+
+def test_users_are_found_by_id_and_email(tmp_path):
+    store = UserStore(tmp_path / 'users.json')
+    alice = store.create('Alice', 'alice@example.com', 'hash-a')
+    bob = store.create('Bob', 'bob@example.com', 'hash-b', is_admin=True)
+    assert (alice['id'], bob['id']) == ('1', '2')
+    assert store.get(2)['is_admin']
+    assert store.get_by_email('alice@example.com')['name'] == 'Alice'
+    assert store.get('3') is None
+
+    with pytest.raises(ValueError):
+        store.create('Alice again', 'alice@example.com', 'hash')
+
+
+def test_an_email_change_moves_the_index_entry(tmp_path):
+    store = UserStore(tmp_path / 'users.json')
+    store.create('Alice', 'alice@example.com', 'hash-a')
+    store.create('Bob', 'bob@example.com', 'hash-b')
+
+    store.update('1', email='alice@example.org')
+    assert store.get_by_email('alice@example.com') is None
+    assert store.get_by_email('alice@example.org')['id'] == '1'
+    with pytest.raises(ValueError):
+        store.update('2', email='alice@example.org')
+
+
+def test_writes_from_another_worker_are_picked_up(tmp_path):
+    first = UserStore(tmp_path / 'users.json', reload_interval=0)
+    second = UserStore(tmp_path / 'users.json', reload_interval=0)
+    first.create('Alice', 'alice@example.com', 'hash-a')
+    assert second.get_by_email('alice@example.com')['id'] == '1'
+    # Ids come from the file under its lock, so workers never hand out the same one
+    assert second.create('Bob', 'bob@example.com', 'hash-b')['id'] == '2'
+    assert first.get('2')['name'] == 'Bob'
+
+
+def test_the_old_users_file_layout_is_read(tmp_path):
+    (tmp_path / 'users.json').write_text('{"7": {"id": 7, "name": "Old", "email": "old@example.com"}}')
+    store = UserStore(tmp_path / 'users.json')
+    assert store.get('7')['email'] == 'old@example.com'
+    assert store.create('New', 'new@example.com', 'hash')['id'] == '8'
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from write_behind import WriteBehindQueue
+
+
+class Recorder:
+    def __init__(self, delay=0.0):
+        self.batches = []
+        self.delay = delay
+
+    def __call__(self, by_user):
+        time.sleep(self.delay)
+        self.batches.append(by_user)
+
+
+def test_items_are_grouped_into_batches_in_order():
+    writes = Recorder()
+    queue = WriteBehindQueue(writes, max_batch=64, max_latency=0.1)
+    for i in range(5):
+        queue.submit('alice', i)
+    queue.submit('bob', 'x')
+    queue.close()
+    assert writes.batches == [{'alice': [0, 1, 2, 3, 4], 'bob': ['x']}]
+    assert queue.stats() == {"pending": 0, "batches": 1, "written": 6, "failed": 0, "blocked": 0}
+    assert not queue.submit('alice', 5)  # closed: the caller writes it itself
+
+
+def test_a_full_batch_goes_out_without_waiting_for_max_latency():
+    writes = Recorder()
+    queue = WriteBehindQueue(writes, max_batch=3, max_latency=10)
+    for i in range(3):
+        queue.submit('alice', i)
+    assert queue.flush(timeout=1)
+    assert writes.batches == [{'alice': [0, 1, 2]}]
+
+
+def test_flush_user_gives_read_your_writes():
+    writes = Recorder()
+    queue = WriteBehindQueue(writes, max_latency=10)
+    queue.submit('alice', 'turn')
+    started = time.monotonic()
+    assert queue.flush_user('alice', timeout=1)
+    assert time.monotonic() - started < 1  # a waiting reader sends the batch at once
+    assert writes.batches == [{'alice': ['turn']}]
+    assert queue.flush_user('bob')
+
+
+def test_submit_blocks_at_max_pending_and_failures_are_counted():
+    def fail(by_user):
+        time.sleep(0.05)
+        raise OSError('disk full')
+
+    queue = WriteBehindQueue(fail, max_batch=2, max_latency=0, max_pending=2)
+    submitters = [threading.Thread(target=queue.submit, args=('alice', i)) for i in range(4)]
+    for submitter in submitters:
+        submitter.start()
+    for submitter in submitters:
+        submitter.join(2)
+    assert queue.flush(timeout=2)
+    stats = queue.stats()
+    assert stats['failed'] == 4 and stats['written'] == 0 and stats['blocked'] >= 1
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock; fall back to in-process locking only
+    fcntl = None
+
+
+class UserStore:
+    """Users file with in-memory id and email indexes.
+
+    Lookups are served from dictionaries. The backing JSON file is only
+    stat'ed at most once every ``reload_interval`` seconds to pick up
+    changes made by other workers (by mtime and size), and every change is
+    a locked read-modify-write that replaces the file atomically, so
+    concurrent workers neither lose updates nor hand out the same id.
+    """
+
+    def __init__(self, users_file, reload_interval=1.0):
+        self.users_file = Path(users_file)
+        self.lock_file = self.users_file.with_name(self.users_file.name + '.lock')
+        self.reload_interval = reload_interval
+        self._lock = threading.RLock()
+        self._by_id = {}
+        self._by_email = {}
+        self._signature = None
+        self._checked_at = 0
+        self._load()
+
+    def get(self, user_id):
+        """Get a user record by id"""
+        self._maybe_reload()
+        user = self._by_id.get(str(user_id))
+        return dict(user) if user else None
+
+    def get_by_email(self, email):
+        """Get a user record by email"""
+        self._maybe_reload()
+        user = self._by_email.get(email)
+        return dict(user) if user else None
+
+    def create(self, name, email, password_hash, is_admin=False):
+        """Add a new user and return its record; raises ValueError if the email is taken"""
+        with self._exclusive():
+            if email in self._by_email:
+                raise ValueError('Email already registered.')
+            numeric_ids = [int(uid) for uid in self._by_id if uid.isdigit()]
+            user = {
+                'id': str(max(numeric_ids, default=0) + 1),
+                'name': name,
+                'email': email,
+                'password': password_hash,
+                'is_admin': is_admin
+            }
+            self._index(user)
+            self._save()
+            return dict(user)
+
+    def update(self, user_id, **fields):
+        """Update fields of a user and return the new record"""
+        with self._exclusive():
+            user = self._by_id.get(str(user_id))
+            if user is None:
+                raise ValueError('User not found.')
+            email = fields.get('email')
+            if email and email != user['email'] and email in self._by_email:
+                raise ValueError('Email already registered.')
+            self._by_email.pop(user['email'], None)
+            user.update(fields)
+            self._by_email[user['email']] = user
+            self._save()
+            return dict(user)
+
+    # ------------------------------------------------------------------
+    # Internals
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.users_file)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            if self._file_signature() != self._signature:
+                self._load()
+
+    def _load(self):
+        with self._lock:
+            self._signature = self._file_signature()
+            self._checked_at = time.monotonic()
+            try:
+                with open(self.users_file, 'r') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+            # Older files keyed users by id ({"<id>": {...}}) instead of a "users" list
+            users = data.get('users', []) if 'users' in data else list(data.values())
+            self._by_id = {}
+            self._by_email = {}
+            for user in users:
+                self._index(user)
+
+    def _index(self, user):
+        user['id'] = str(user.get('id'))
+        self._by_id[user['id']] = user
+        if user.get('email'):
+            self._by_email[user['email']] = user
+
+    def _save(self):
+        tmp_path = self.users_file.with_name(self.users_file.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'users': list(self._by_id.values())}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.users_file)
+        self._signature = self._file_signature()
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold the in-process and cross-process locks, with indexes fresh from disk"""
+        with self._lock:
+            lock_fd = None
+            try:
+                if fcntl:
+                    lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                if self._file_signature() != self._signature:
+                    self._load()
+                yield self
+            except BaseException:
+                self._signature = None  # memory may be ahead of disk; reload on next access
+                raise
+            finally:
+                if lock_fd is not None:
+                    os.close(lock_fd)
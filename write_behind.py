@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import deque
+
+from metrics import STAGE_SECONDS, timed
+
+
+class WriteBehindQueue:
+    """Bounded queue of completed chat turns, committed in groups by a background thread.
+
+    ``write_batch({user_id: [item, ...]})`` is called with up to
+    ``max_batch`` items, once that many are waiting or the oldest has
+    waited ``max_latency`` seconds, whichever comes first. Items of one
+    user keep their order. With ``max_pending`` items not yet written,
+    submit blocks until the flusher catches up. ``flush_user`` waits until
+    everything a user submitted is written (and has the next batch go out
+    at once), which gives readers in this process read-your-writes; other
+    processes see a turn at most about ``max_latency`` (plus the write
+    itself) later.
+    """
+
+    def __init__(self, write_batch, max_batch=64, max_latency=0.05, max_pending=1024):
+        self.write_batch = write_batch
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.max_pending = max_pending
+        self._queue = deque()  # (enqueue time, user id, item)
+        self._pending = {}     # user id -> items submitted but not yet written
+        self._total = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._thread = None
+        self._closed = False
+        self._waiters = 0
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.blocked = 0
+
+    def submit(self, user_id: str, item) -> bool:
+        """Queue an item for ``user_id``; False once the queue is closed, so the caller writes it itself"""
+        with self._changed:
+            if self._closed:
+                return False
+            if self._total >= self.max_pending:
+                self.blocked += 1
+                self._changed.wait_for(lambda: self._total < self.max_pending or self._closed)
+            self._start()
+            self._queue.append((time.monotonic(), user_id, item))
+            self._pending[user_id] = self._pending.get(user_id, 0) + 1
+            self._total += 1
+            self._changed.notify_all()
+            return True
+
+    def flush_user(self, user_id: str, timeout: float = None) -> bool:
+        """Wait until every turn ``user_id`` submitted is written; False on timeout"""
+        with self._changed:
+            if not self._pending.get(user_id):
+                return True
+            self._waiters += 1  # a reader is blocked: don't hold the batch for max_latency
+            self._changed.notify_all()
+            try:
+                return self._changed.wait_for(lambda: not self._pending.get(user_id), timeout)
+            finally:
+                self._waiters -= 1
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until the queue is drained; False on timeout"""
+        with self._changed:
+            self._waiters += 1
+            self._changed.notify_all()
+            try:
+                return self._changed.wait_for(lambda: not self._total, timeout)
+            finally:
+                self._waiters -= 1
+
+    def close(self, timeout: float = 30.0):
+        """Write what is queued and stop the flusher (e.g. at interpreter exit)"""
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _start(self):
+        # Started on first use, so forked workers each get their own flusher
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='history-write-behind', daemon=True)
+            self._thread.start()
+
+    def _next_batch(self):
+        with self._changed:
+            while True:
+                if self._queue:
+                    due = self._queue[0][0] + self.max_latency
+                    if (len(self._queue) >= self.max_batch or self._closed or self._waiters
+                            or time.monotonic() >= due):
+                        break
+                    self._changed.wait(due - time.monotonic())
+                elif self._closed:
+                    return None
+                else:
+                    self._changed.wait()
+            batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+        STAGE_SECONDS.observe(time.monotonic() - batch[0][0], stage='history_queued')
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            by_user = {}
+            for _, user_id, item in batch:
+                by_user.setdefault(user_id, []).append(item)
+            try:
+                with timed('history_flush'):
+                    self.write_batch(by_user)
+                failed = 0
+            except Exception as e:
+                print(f"Error writing history batch: {e}")
+                failed = len(batch)
+            with self._changed:
+                self.batches += 1
+                self.written += len(batch) - failed
+                self.failed += failed
+                self._total -= len(batch)
+                for user_id, items in by_user.items():
+                    left = self._pending[user_id] - len(items)
+                    if left:
+                        self._pending[user_id] = left
+                    else:
+                        del self._pending[user_id]
+                self._changed.notify_all()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": self._total,
+                "batches": self.batches,
+                "written": self.written,
+                "failed": self.failed,
+                "blocked": self.blocked
+            }